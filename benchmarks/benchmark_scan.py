@@ -0,0 +1,303 @@
+"""
+Benchmark for the duplicate finder.
+
+Generates a synthetic corpus with known near-duplicates (resized, recompressed,
+cropped and byte-identical copies), then times each stage of a
+DuplicateImageFinder scan and reports throughput, peak memory and the
+precision/recall of the groups it found.
+
+    python benchmarks/benchmark_scan.py --sizes 1000,10000 --methods phash,md5
+
+Corpora are cached under --corpus-dir and reused when the size and seed match.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import duplicate_finder_app as app
+import image_hashing
+
+# Files per corpus sub folder, so recursive listing has some work to do
+FILES_PER_FOLDER = 1000
+BASE_SIZE = (320, 240)
+VARIANT_KINDS = ('resize', 'recompress', 'crop', 'copy')
+
+def make_base_image(rng):
+    """A random smooth colour field with a few shapes, distinct enough for perceptual hashes"""
+    field = np.array([[[rng.randrange(256) for _ in range(3)] for _ in range(6)] for _ in range(5)], dtype=np.uint8)
+    img = Image.fromarray(field).resize(BASE_SIZE, Image.BICUBIC)
+    draw = ImageDraw.Draw(img)
+    for _ in range(rng.randint(2, 6)):
+        x0, y0 = rng.randrange(BASE_SIZE[0]), rng.randrange(BASE_SIZE[1])
+        x1, y1 = x0 + rng.randint(20, 160), y0 + rng.randint(20, 120)
+        colour = tuple(rng.randrange(256) for _ in range(3))
+        if rng.random() < 0.5:
+            draw.ellipse((x0, y0, x1, y1), fill=colour)
+        else:
+            draw.rectangle((x0, y0, x1, y1), fill=colour)
+    return img.filter(ImageFilter.GaussianBlur(1))
+
+def make_variant(img, kind, rng):
+    """A near-duplicate of img; 'copy' is handled by copying the file bytes"""
+    if kind == 'resize':
+        scale = rng.uniform(0.5, 0.9)
+        return img.resize((int(img.width * scale), int(img.height * scale)), Image.LANCZOS), {}
+    if kind == 'recompress':
+        return img, {'quality': rng.randint(30, 70)}
+    # crop a few percent off each side
+    dx, dy = int(img.width * rng.uniform(0.02, 0.06)), int(img.height * rng.uniform(0.02, 0.06))
+    return img.crop((dx, dy, img.width - dx, img.height - dy)), {}
+
+def generate_chunk(root, seed, first_base, num_bases, dup_ratio):
+    """Write num_bases originals and their variants, returns {relative path: (base id, kind)}"""
+    rng = random.Random(seed * 1_000_003 + first_base)
+    truth = {}
+    for base_id in range(first_base, first_base + num_bases):
+        folder = f"{base_id // FILES_PER_FOLDER:05d}"
+        os.makedirs(os.path.join(root, folder), exist_ok=True)
+        img = make_base_image(rng)
+        base_rel = os.path.join(folder, f"img{base_id:07d}.jpg")
+        img.save(os.path.join(root, base_rel), quality=90)
+        truth[base_rel] = (base_id, 'original')
+        
+        if rng.random() >= dup_ratio:
+            continue
+        for variant_no, kind in enumerate(rng.sample(VARIANT_KINDS, rng.randint(1, 3))):
+            rel = os.path.join(folder, f"img{base_id:07d}_{kind}{variant_no}.jpg")
+            if kind == 'copy':
+                with open(os.path.join(root, base_rel), 'rb') as src, open(os.path.join(root, rel), 'wb') as dst:
+                    dst.write(src.read())
+            else:
+                variant, options = make_variant(img, kind, rng)
+                variant.save(os.path.join(root, rel), quality=options.get('quality', 90))
+            truth[rel] = (base_id, kind)
+    return truth
+
+def ensure_corpus(corpus_dir, size, seed=0, dup_ratio=0.25, workers=None):
+    """Generate (or reuse) a corpus of about size files, returns (root, ground truth)"""
+    # Every parameter that shapes the corpus is part of its name, so none reuses another's files
+    root = os.path.join(corpus_dir, f"corpus_{size}_{seed}_{dup_ratio:g}")
+    manifest_path = os.path.join(root, 'manifest.json')
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        return root, {rel: tuple(value) for rel, value in manifest['truth'].items()}
+    
+    # Each original brings on average about 2 * dup_ratio variants
+    num_bases = max(1, int(size / (1 + 2 * dup_ratio)))
+    chunk = 200
+    truth = {}
+    with ProcessPoolExecutor(max_workers=workers, mp_context=app.get_pool_context()) as executor:
+        futures = [executor.submit(generate_chunk, root, seed, first, min(chunk, num_bases - first), dup_ratio)
+                   for first in range(0, num_bases, chunk)]
+        for future in futures:
+            truth.update(future.result())
+    
+    with open(manifest_path, 'w') as f:
+        json.dump({'size': size, 'seed': seed, 'dup_ratio': dup_ratio, 'truth': truth}, f)
+    return root, truth
+
+def pair_count(n):
+    return n * (n - 1) // 2
+
+def group_accuracy(duplicates, truth, exact=False):
+    """
+    Pairwise precision and recall of the found groups. Two files belong
+    together when they come from the same original; for exact (md5) scans
+    only byte-identical copies count.
+    """
+    def label(rel):
+        base_id, kind = truth.get(rel, (None, None))
+        if base_id is None:
+            return None
+        if exact and kind not in ('original', 'copy'):
+            return (base_id, rel)
+        return base_id
+    
+    true_pairs = sum(pair_count(count) for count in Counter(label(rel) for rel in truth).values())
+    found_pairs = 0
+    correct_pairs = 0
+    for original, duplicates_list in duplicates.items():
+        members = [original] + list(duplicates_list)
+        found_pairs += pair_count(len(members))
+        correct_pairs += sum(pair_count(count) for key, count in Counter(map(label, members)).items()
+                             if key is not None)
+    
+    precision = correct_pairs / found_pairs if found_pairs else 1.0
+    recall = correct_pairs / true_pairs if true_pairs else 1.0
+    return precision, recall
+
+class PeakMemory:
+    """
+    Peak memory of this process between reset() and read(), in bytes.
+    Uses the kernel's resident high-water mark where it can be reset (Linux),
+    else tracemalloc's Python heap peak when tracing, else ru_maxrss.
+    Hashing worker processes are not included.
+    """
+    
+    def __init__(self):
+        self.kernel = os.path.exists('/proc/self/clear_refs') and os.path.exists('/proc/self/status')
+    
+    def reset(self):
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        if self.kernel:
+            try:
+                with open('/proc/self/clear_refs', 'w') as f:
+                    f.write('5')
+            except OSError:
+                self.kernel = False
+    
+    def read(self):
+        if tracemalloc.is_tracing():
+            return tracemalloc.get_traced_memory()[1]
+        if self.kernel:
+            with open('/proc/self/status') as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        return int(line.split()[1]) * 1024
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class StageRecorder(app.ScanProgress):
+    """Collects wall time and peak memory for each scan stage from the finder's stage events"""
+    
+    def __init__(self, memory):
+        super().__init__()
+        self.memory = memory
+        self.stages = {}
+        self.current = None
+        self.started = None
+    
+    def stage(self, name):
+        now = time.perf_counter()
+        if self.current is not None:
+            # A stage can be entered more than once (a cascade groups before and after confirming)
+            seconds, peak = self.stages.get(self.current, (0.0, 0))
+            self.stages[self.current] = (seconds + now - self.started, max(peak, self.memory.read()))
+        self.current, self.started = name, now
+        self.memory.reset()
+        super().stage(name)
+
+def timed(memory, func, *args, **kwargs):
+    """Run func, returns (result, seconds, peak bytes)"""
+    memory.reset()
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start, memory.read()
+
+def decode_all(files, root, fast_decode):
+    for filename in files:
+        with Image.open(os.path.join(root, filename)) as img:
+            image_hashing.prepare_image_for_hashing(img, fast_decode).load()
+
+def render_thumbnails(duplicates, root, thumbnail_dir):
+    for original, duplicates_list in duplicates.items():
+        for filename in [original] + list(duplicates_list):
+            app.get_image_base64(os.path.join(root, filename), thumbnail_dir=thumbnail_dir)
+
+def benchmark(root, truth, method, workers, fast_decode=True, threshold=12, decode_sample=2000, thumbnail_limit=200,
+              prefetch=None):
+    """One scan of root, returns rows of (stage, items, seconds, peak bytes) and (precision, recall)"""
+    memory = PeakMemory()
+    rows = []
+    
+    finder = app.DuplicateImageFinder(root, recursive=True, workers=workers, fast_decode=fast_decode,
+                                      progress=app.ScanProgress())
+    image_files, seconds, peak = timed(memory, finder.get_image_files)
+    rows.append(('listing (walk only)', len(image_files), seconds, peak))
+    
+    if method != 'md5':
+        sample = image_files[:decode_sample]
+        _, seconds, peak = timed(memory, decode_all, sample, root, fast_decode)
+        rows.append(('decode (1 process)', len(sample), seconds, peak))
+    
+    # Full scan without a cache; listing runs again inside it, overlapped with hashing
+    recorder = StageRecorder(memory)
+    finder = app.DuplicateImageFinder(root, recursive=True, workers=workers, fast_decode=fast_decode,
+                                      progress=recorder, prefetch=prefetch)
+    start = time.perf_counter()
+    duplicates, _, _, _ = finder.find_duplicates_with_similarity(method=method, threshold=threshold)
+    total = time.perf_counter() - start
+    # A stage only handles some of the files, e.g. confirming just the cascade's candidates
+    stage_files = {stage: values['files'] for stage, values in finder.metrics.stages.items()}
+    for stage, (seconds, peak) in recorder.stages.items():
+        rows.append((stage, stage_files.get(stage, len(image_files)), seconds, peak))
+    rows.append(('scan total', len(image_files), total, None))
+    
+    with tempfile.TemporaryDirectory() as thumbnail_dir:
+        limited = dict(list(duplicates.items())[:thumbnail_limit])
+        count = sum(1 + len(dups) for dups in limited.values())
+        _, seconds, peak = timed(memory, render_thumbnails, limited, root, thumbnail_dir)
+        rows.append(('thumbnails (cold)', count, seconds, peak))
+        _, seconds, peak = timed(memory, render_thumbnails, limited, root, thumbnail_dir)
+        rows.append(('thumbnails (cached)', count, seconds, peak))
+    
+    return rows, group_accuracy(duplicates, truth, exact=(method == 'md5'))
+
+def format_rows(size, method, rows, accuracy):
+    lines = [f"\n== {size} files, {method}: precision {accuracy[0]:.4f}, recall {accuracy[1]:.4f}",
+             f"{'stage':<22}{'items':>10}{'seconds':>10}{'items/s':>12}{'peak MB':>10}"]
+    for stage, items, seconds, peak in rows:
+        rate = f"{items / seconds:,.0f}" if seconds > 0 else '-'
+        peak_mb = f"{peak / 1e6:,.0f}" if peak is not None else '-'
+        lines.append(f"{stage:<22}{items:>10,}{seconds:>10.3f}{rate:>12}{peak_mb:>10}")
+    return "\n".join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark DuplicateImageFinder on synthetic corpora.")
+    parser.add_argument("--sizes", default="1000", help="comma separated corpus sizes, e.g. 1000,10000,1000000")
+    parser.add_argument("--methods", default="phash,md5", help="comma separated methods to scan with")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--full-decode", action="store_true", help="benchmark full decodes instead of fast mode")
+    parser.add_argument("--threshold", type=int, default=12, help="hash threshold in bits (default: 12)")
+    parser.add_argument("--prefetch", type=int, metavar="THREADS",
+                        help="prefetch reader threads, 0 for none (default: on only for network and FUSE mounts)")
+    parser.add_argument("--corpus-dir", default=os.path.join(tempfile.gettempdir(), 'duplicate-finder-bench'),
+                        help="where generated corpora are kept between runs")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--dup-ratio", type=float, default=0.25, help="share of originals that get variants")
+    parser.add_argument("--tracemalloc", action="store_true",
+                        help="report Python heap peaks instead of resident memory (slower)")
+    parser.add_argument("--json", metavar="PATH", help="also write the results as JSON")
+    args = parser.parse_args(argv)
+    
+    if args.tracemalloc:
+        tracemalloc.start()
+    
+    report = []
+    for size in [int(value) for value in args.sizes.split(',')]:
+        start = time.perf_counter()
+        root, truth = ensure_corpus(args.corpus_dir, size, args.seed, args.dup_ratio, args.workers)
+        print(f"corpus {root}: {len(truth):,} files ({time.perf_counter() - start:.1f}s)", file=sys.stderr)
+        
+        for method in args.methods.split(','):
+            rows, accuracy = benchmark(root, truth, method, args.workers, fast_decode=not args.full_decode,
+                                       threshold=args.threshold, prefetch=args.prefetch)
+            print(format_rows(len(truth), method, rows, accuracy), flush=True)
+            report.append({
+                'size': len(truth),
+                'method': method,
+                'precision': accuracy[0],
+                'recall': accuracy[1],
+                'stages': [{'stage': stage, 'items': items, 'seconds': seconds, 'peak_bytes': peak}
+                           for stage, items, seconds, peak in rows]
+            })
+    
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
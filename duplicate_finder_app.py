@@ -1,27 +1,65 @@
 
 import streamlit as st
 import os
+import sys
+import argparse
+import json
+import logging
 import hashlib
 from PIL import Image
-import imagehash
 from collections import defaultdict
+import numpy as np
 import pandas as pd
 import tempfile
 import shutil
+import errno
 from pathlib import Path
 import base64
 import io
 import math
+import time
+import sqlite3
+import threading
+import multiprocessing
+import weakref
+import cProfile
+import contextlib
+import pstats
+import uuid
+from abc import abstractmethod
+from array import array
+from collections import deque
+from collections.abc import Mapping
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from itertools import combinations, islice
+from functools import lru_cache
 from typing import Dict, List, Tuple
 
-st.set_page_config(
-    page_title="Duplicate Image Finder",
-    page_icon="🖼️",
-    layout="wide"
+from image_hashing import (
+    HASH_METHODS, THUMBNAIL_FORMAT, THUMBNAIL_MIME, THUMBNAIL_QUALITY, THUMBNAIL_SIZE,
+    compute_image_hash, compute_image_hashes, save_thumbnail, thumbnail_path
 )
 
-# Custom CSS with your color scheme
-st.markdown("""
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Page setup only applies under `streamlit run`, not to the command line or imports
+if st.runtime.exists():
+    st.set_page_config(
+        page_title="Duplicate Image Finder",
+        page_icon="🖼️",
+        layout="wide"
+    )
+    
+    # Custom CSS with your color scheme
+    st.markdown("""
 <style>
     /* Main Colors */
     :root {
@@ -208,226 +246,2725 @@ st.markdown("""
     .badge-medium { background: linear-gradient(135deg, var(--accent-yellow), #FFA726); }
     .badge-low { background: linear-gradient(135deg, #FF9800, #FF5722); }
 </style>
-""", unsafe_allow_html=True)
+    """, unsafe_allow_html=True)
+else:
+    # Headless runs fall back to Streamlit's in-memory caches, which is fine here
+    logging.getLogger('streamlit.runtime.caching.cache_data_api').setLevel(logging.ERROR)
+
+HASH_BITS = 64
+
+def max_distance_for_similarity(similarity_threshold: float, max_diff: int = HASH_BITS) -> int:
+    """
+    Largest Hamming distance that still reaches the given similarity percentage.
+    A distance equal to max_diff (0% similar) never counts as a match.
+    """
+    distance = int(math.floor(max_diff * (1 - similarity_threshold / 100.0) + 1e-9))
+    return max(0, min(max_diff - 1, distance))
+
+def match_radius(threshold, similarity_threshold: float, max_diff: int = HASH_BITS) -> int:
+    """
+    Hamming radius two hashes must fall within to be grouped: the hash
+    threshold in bits, tightened further by the similarity percentage.
+    A threshold of None leaves only the similarity bound.
+    """
+    radius = max_distance_for_similarity(similarity_threshold, max_diff)
+    if threshold is not None:
+        radius = min(radius, max(0, int(threshold)))
+    return radius
+
+@lru_cache(maxsize=None)
+def _flip_masks(bits: int, radius: int) -> Tuple[int, ...]:
+    """All bit masks of width `bits` with at most `radius` bits set"""
+    masks = []
+    for k in range(min(radius, bits) + 1):
+        for positions in combinations(range(bits), k):
+            mask = 0
+            for pos in positions:
+                mask |= 1 << pos
+            masks.append(mask)
+    return tuple(masks)
+
+def hash_blocks(hash_bits: int = HASH_BITS, num_blocks: int = 4) -> List[Tuple[int, int, int]]:
+    """Split a hash into num_blocks disjoint substrings, as (shift, width, mask) triples"""
+    num_blocks = max(1, min(num_blocks, hash_bits))
+    blocks = []
+    start = 0
+    for i in range(num_blocks):
+        width = hash_bits // num_blocks + (1 if i < hash_bits % num_blocks else 0)
+        blocks.append((start, width, (1 << width) - 1))
+        start += width
+    return blocks
+
+class UnionFind:
+    """
+    Disjoint sets over 0..n-1 in one int64 parent array, merged a whole array
+    of pairs at a time: every round hooks the larger root of each pair that is
+    still split under the smaller one, so memory stays at eight bytes per item
+    however many pairs there are.
+    """
+    
+    def __init__(self, n: int):
+        self.parent = np.arange(n, dtype=np.int64)
+    
+    def __len__(self):
+        return len(self.parent)
+    
+    def find(self, items: np.ndarray) -> np.ndarray:
+        """Roots of an array of items, which are pointed straight at them afterwards"""
+        parent = self.parent
+        roots = parent[items]
+        while True:
+            up = parent[roots]
+            if np.array_equal(up, roots):
+                break
+            roots = up
+        parent[items] = roots
+        return roots
+    
+    def union(self, first, second):
+        """Merge the sets of every pair (first[i], second[i])"""
+        first = np.asarray(first, dtype=np.int64)
+        second = np.asarray(second, dtype=np.int64)
+        while len(first):
+            a, b = self.find(first), self.find(second)
+            split = a != b
+            if not split.any():
+                break
+            first, second, a, b = first[split], second[split], a[split], b[split]
+            # Roots only ever point at smaller roots, so conflicting hooks cannot form a cycle
+            np.minimum.at(self.parent, np.maximum(a, b), np.minimum(a, b))
+    
+    def roots(self) -> np.ndarray:
+        """Root of every item, as an array"""
+        parent = self.parent
+        while True:
+            up = parent[parent]
+            if np.array_equal(up, parent):
+                break
+            parent = up
+        self.parent = parent
+        return parent
+
+def near_pairs(values, max_distance: int, hash_bits: int = HASH_BITS, num_blocks: int = 4,
+               chunk_size: int = 1 << 20, on_progress=None):
+    """
+    Every pair of positions (i < j) whose hashes are within max_distance, as
+    (i, j) array chunks. Hashes are split into num_blocks substrings, and two
+    hashes within max_distance differ in at most max_distance // num_blocks
+    bits of at least one of them (pigeonhole), so only those nearby
+    substrings are probed. Per block, positions are sorted by substring with
+    a table of where each substring value starts, so one flip mask is a
+    single lookup over all hashes.
+    A pair is only reported from the first block where it is close enough, so
+    each shows up exactly once. on_progress(done, total) follows the probe rounds.
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    blocks = hash_blocks(hash_bits, num_blocks)
+    sub_radius = max_distance // len(blocks)
+    if max_distance < 0 or len(values) < 2:
+        return
+    rounds = sum(len(_flip_masks(width, sub_radius)) for _, width, _ in blocks)
+    done = 0
+    
+    for block_idx, (shift, width, mask) in enumerate(blocks):
+        subs = ((values >> np.uint64(shift)) & np.uint64(mask)).astype(np.intp)
+        order = np.argsort(subs, kind='stable')
+        bucket_starts = np.searchsorted(subs[order], np.arange(mask + 2, dtype=np.intp))
+        for flip in _flip_masks(width, sub_radius):
+            done += 1
+            if on_progress is not None:
+                on_progress(done, rounds)
+            targets = subs ^ flip
+            starts = bucket_starts[targets]
+            counts = bucket_starts[targets + 1] - starts
+            if flip:
+                # Two different buckets are probed from the lower substring only
+                counts[targets < subs] = 0
+            queries = np.flatnonzero(counts)
+            if not len(queries):
+                continue
+            ends = np.cumsum(counts[queries])
+            cuts = np.searchsorted(ends, np.arange(chunk_size, ends[-1], chunk_size), side='right')
+            for chunk in (np.split(queries, cuts) if len(cuts) else (queries,)):
+                chunk_counts = counts[chunk]
+                skip = np.cumsum(chunk_counts) - chunk_counts - starts[chunk]
+                first = np.repeat(chunk, chunk_counts)
+                second = order[np.arange(len(first)) - np.repeat(skip, chunk_counts)]
+                if flip:
+                    first, second = np.minimum(first, second), np.maximum(first, second)
+                else:
+                    keep = first < second
+                    first, second = first[keep], second[keep]
+                xor = values[first] ^ values[second]
+                keep = popcount64(xor) <= max_distance
+                for earlier_shift, _, earlier_mask in blocks[:block_idx]:
+                    keep &= popcount64((xor >> np.uint64(earlier_shift)) & np.uint64(earlier_mask)) > sub_radius
+                if keep.any():
+                    yield first[keep], second[keep]
+
+def cluster_hashes(hash_values, max_distance: int, hash_bits: int = HASH_BITS, on_progress=None):
+    """
+    Connected components of the graph linking every pair of hashes within
+    max_distance, so groups are transitive and independent of input order.
+
+    Identical hashes are merged up front and every candidate pair among the
+    distinct ones is a union. Candidates come from near_pairs(), or from a
+    dense popcount scan at radii so wide that the multi-index would probe more
+    buckets than there are hashes. on_progress(done, total) reports how far
+    the search is. Returns (groups, degree): sorted position arrays for every
+    group of two or more, ordered by their first position, and for each
+    position the number of other hashes within max_distance of it.
+    """
+    values = np.asarray(hash_values, dtype=np.uint64)
+    if not len(values):
+        return [], np.zeros(0, dtype=np.int64)
+    unique, inverse, counts = np.unique(values, return_inverse=True, return_counts=True)
+    inverse = inverse.reshape(-1)
+    links = UnionFind(len(unique))
+    degree = counts.astype(np.int64) - 1
+    blocks = hash_blocks(hash_bits)
+    probes = sum(len(_flip_masks(width, max(0, max_distance) // len(blocks))) for _, width, _ in blocks)
+    
+    if probes < len(unique):
+        for first, second in near_pairs(unique, max_distance, hash_bits, len(blocks), on_progress=on_progress):
+            np.add.at(degree, first, counts[second])
+            np.add.at(degree, second, counts[first])
+            links.union(first, second)
+    else:
+        matrix = HashMatrix(unique, hash_bits=hash_bits)
+        for block in matrix.row_blocks():
+            close = matrix.distance_block(block) <= max_distance
+            close[np.arange(len(block)), block] = False
+            degree[block] += close.astype(np.int64) @ counts
+            block_rows, others = np.nonzero(close[:, :block[-1]])
+            positions = block[block_rows]
+            earlier = others < positions
+            links.union(positions[earlier], others[earlier])
+            if on_progress is not None:
+                on_progress(int(block[-1]) + 1, len(unique))
+    
+    labels = links.roots()[inverse]
+    order = np.argsort(labels, kind='stable')
+    boundaries = np.flatnonzero(np.diff(labels[order])) + 1
+    groups = [group for group in np.split(order, boundaries) if len(group) > 1]
+    groups.sort(key=lambda group: group[0])
+    return groups, degree[inverse]
+
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def popcount64(values: np.ndarray) -> np.ndarray:
+    """Element-wise popcount of a uint64 array"""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    values = np.ascontiguousarray(values, dtype=np.uint64)
+    per_byte = _POPCOUNT_TABLE[values.view(np.uint8)].reshape(values.shape + (8,))
+    return per_byte.sum(axis=-1, dtype=np.uint8)
+
+class HashMatrix:
+    """
+    Packed uint64 column of perceptual hashes for vectorized comparisons.
+
+    Distances are computed with XOR + popcount over whole rows or row blocks,
+    so comparing one hash against thousands costs a single NumPy call.
+    """
+    
+    # Upper bound on cells per distance block (~32 MB of uint64 intermediates)
+    BLOCK_CELLS = 4_000_000
+    
+    def __init__(self, hashes: List[int], hash_bits: int = HASH_BITS):
+        self.hash_bits = hash_bits
+        self.values = np.array(hashes, dtype=np.uint64)
+    
+    def __len__(self):
+        return len(self.values)
+    
+    def distances(self, query: int, candidates=None) -> np.ndarray:
+        """Hamming distances from one hash to all (or the selected) stored hashes"""
+        values = self.values if candidates is None else self.values[candidates]
+        return popcount64(np.bitwise_xor(values, np.uint64(query)))
+    
+    def distance_block(self, rows, candidates=None) -> np.ndarray:
+        """Distance matrix of shape (len(rows), len(candidates)) for stored row indices"""
+        values = self.values if candidates is None else self.values[candidates]
+        return popcount64(np.bitwise_xor(self.values[rows][:, None], values[None, :]))
+    
+    def similarity(self, distances: np.ndarray) -> np.ndarray:
+        """Convert Hamming distances to similarity percentages"""
+        similarity = 100 * (1 - (distances.astype(np.float64) / self.hash_bits))
+        return np.clip(similarity, 0, 100)
+    
+    def similarity_row(self, query: int, candidates=None) -> np.ndarray:
+        """Similarity percentages from one hash to a whole row of candidates"""
+        return self.similarity(self.distances(query, candidates))
+    
+    def row_blocks(self, rows=None, num_candidates: int = None, block_cells: int = None):
+        """Yield blocks of row indices (all rows by default) sized to stay under block_cells cells"""
+        rows = np.arange(len(self.values)) if rows is None else np.asarray(rows, dtype=np.int64)
+        num_candidates = len(self.values) if num_candidates is None else num_candidates
+        block_cells = block_cells or self.BLOCK_CELLS
+        block_rows = max(1, block_cells // max(1, num_candidates))
+        for start in range(0, len(rows), block_rows):
+            yield rows[start:start + block_rows]
+    
+    def nearest_neighbours(self, rows=None, workers: int = 1):
+        """
+        Nearest other hash for each of the given rows (all by default).
+        Returns (rows, neighbours, distances) arrays; ties go to the lowest index.
+
+        Rows with an identical twin are answered at distance 0 without any
+        comparison. The rest are scanned in row blocks whose combined size
+        across worker threads stays under BLOCK_CELLS, so memory is bounded no
+        matter how many hashes there are.
+        """
+        n = len(self.values)
+        rows = np.arange(n) if rows is None else np.asarray(rows, dtype=np.int64)
+        neighbours = np.full(len(rows), -1, dtype=np.int64)
+        distances = np.full(len(rows), np.iinfo(np.uint8).max, dtype=np.uint8)
+        if n < 2 or not len(rows):
+            return rows, neighbours, distances
+        
+        # Stop early at distance 0: the first other row with the same hash wins
+        order = np.argsort(self.values, kind='stable')
+        sorted_values = self.values[order]
+        starts = np.searchsorted(sorted_values, self.values[rows], side='left')
+        counts = np.searchsorted(sorted_values, self.values[rows], side='right') - starts
+        twins = np.flatnonzero(counts > 1)
+        first = order[starts[twins]]
+        second = order[starts[twins] + 1]
+        neighbours[twins] = np.where(first == rows[twins], second, first)
+        distances[twins] = 0
+        
+        pending = np.flatnonzero(counts <= 1)
+        if not len(pending):
+            return rows, neighbours, distances
+        
+        threads = max(1, workers)
+        
+        def scan_block(positions):
+            block_rows = rows[positions]
+            block = self.distance_block(block_rows)
+            block[np.arange(len(block_rows)), block_rows] = np.iinfo(block.dtype).max  # never match itself
+            columns = block.argmin(axis=1)
+            return positions, columns, block[np.arange(len(block_rows)), columns]
+        
+        blocks = self.row_blocks(pending, block_cells=max(1, self.BLOCK_CELLS // threads))
+        if threads > 1:
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                results = list(executor.map(scan_block, blocks))
+        else:
+            results = map(scan_block, blocks)
+        
+        for positions, columns, block_distances in results:
+            neighbours[positions] = columns
+            distances[positions] = block_distances
+        
+        return rows, neighbours, distances
+
+# Cascades: a cheap hash over every file, the confirming hash only on its candidates
+CASCADE_METHODS = {
+    f"{cheap}+{confirm}": (cheap, confirm)
+    for cheap in ('dhash', 'average_hash') for confirm in ('phash', 'whash')
+}
+
+def get_pool_context():
+    """
+    Multiprocessing context for hashing workers. Scans run inside the
+    multi-threaded Streamlit server, which is unsafe to fork, so workers come
+    from a fork server where there is one and are spawned otherwise.
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+# Byte digests available for exact-duplicate detection
+CONTENT_DIGESTS = {
+    'md5': hashlib.md5,
+    'blake2b': lambda: hashlib.blake2b(digest_size=16)
+}
+if xxhash is not None:
+    CONTENT_DIGESTS['xxh3_128'] = xxhash.xxh3_128
+
+# Bytes read from each end of a file for the cheap pre-check
+SAMPLE_SIZE = 64 * 1024
+# Read size for streaming full-content hashes
+READ_CHUNK_SIZE = 1024 * 1024
+
+_read_buffers = threading.local()
+
+def read_buffer(size=READ_CHUNK_SIZE):
+    """A writable view of at least size bytes, allocated once per thread and reused for every file it reads"""
+    buffer = getattr(_read_buffers, 'buffer', None)
+    if buffer is None or len(buffer) < size:
+        buffer = _read_buffers.buffer = bytearray(size)
+    return memoryview(buffer)
+
+def update_from_file(hasher, f, length=None, chunk_size=READ_CHUNK_SIZE):
+    """
+    Feed length bytes from f's position (all that is left when None) to
+    hasher, reading with readinto into the thread's reused buffer so no
+    bytes object is made per read. f should be unbuffered (open(..., buffering=0)).
+    """
+    view = read_buffer(chunk_size)[:chunk_size]
+    while length is None or length > 0:
+        count = f.readinto(view if length is None or length >= chunk_size else view[:length])
+        if not count:
+            break
+        hasher.update(view[:count])
+        if length is not None:
+            length -= count
+
+def hash_file_sample(filepath, size, digest='md5', sample_size=SAMPLE_SIZE):
+    """Digest of the first and last sample_size bytes of a file"""
+    hasher = CONTENT_DIGESTS[digest]()
+    with open(filepath, 'rb', buffering=0) as f:
+        update_from_file(hasher, f, sample_size)
+        if size > sample_size:
+            f.seek(max(sample_size, size - sample_size))
+            update_from_file(hasher, f, sample_size)
+    return hasher.hexdigest()
+
+def hash_file_contents(filepath, digest='md5', chunk_size=READ_CHUNK_SIZE):
+    """
+    Streaming digest of a whole file, read into the thread's reused buffer so
+    no bytes object is made per read. Not memory mapped: a file truncated
+    while it is hashed would raise SIGBUS and take the whole process down,
+    where a read just comes up short.
+    """
+    hasher = CONTENT_DIGESTS[digest]()
+    with open(filepath, 'rb', buffering=0) as f:
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        update_from_file(hasher, f, chunk_size=chunk_size)
+    return hasher.hexdigest()
+
+# File system types reached over a network or through a userspace daemon, where per-file latency rather than
+# bandwidth limits a scan that reads one file at a time
+NETWORK_FILESYSTEMS = ('nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', '9p', 'afs', 'ceph', 'glusterfs', 'lustre',
+                       'davfs', 'fuse')
+# Reader threads used when prefetching is switched on automatically
+PREFETCH_THREADS = 16
+# Raw bytes that may be read ahead of the decoders at once
+PREFETCH_BYTES = 256 * 1024 * 1024
+
+def is_network_path(path):
+    """
+    Whether path lives on a network share or FUSE mount: a UNC path on
+    Windows, else the file system of its longest mount point in /proc/self/mounts.
+    Where neither tells (macOS, BSD), local is assumed.
+    """
+    path = os.path.realpath(path)
+    if os.name == 'nt':
+        return path.startswith('\\\\')
+    try:
+        with open('/proc/self/mounts', encoding='utf-8', errors='replace') as f:
+            mounts = [line.split()[1:3] for line in f]
+    except OSError:
+        return False
+    
+    best, fstype = '', ''
+    for mount_point, kind in mounts:
+        # Spaces, tabs and backslashes in mount points are octal-escaped
+        mount_point = mount_point.replace('\\040', ' ').replace('\\011', '\t').replace('\\134', '\\')
+        inside = path == mount_point or path.startswith(mount_point.rstrip('/') + '/')
+        if inside and len(mount_point) >= len(best):
+            best, fstype = mount_point, kind
+    return fstype.split('.')[0] in NETWORK_FILESYSTEMS
+
+def read_file_content(filepath):
+    """(bytes, size, mtime_ns) of a whole file, taken from one unbuffered read; None if it cannot be read"""
+    try:
+        with open(filepath, 'rb', buffering=0) as f:
+            stat = os.fstat(f.fileno())
+            return f.read(), stat.st_size, stat.st_mtime_ns
+    except OSError:
+        return None
+
+class ByteBudget:
+    """
+    Counts bytes in flight between pipeline stages. acquire blocks while the
+    budget is spent, so readers cannot run further ahead of the decoders than
+    limit bytes; a single item larger than the limit is still let through alone.
+    """
+    def __init__(self, limit=PREFETCH_BYTES):
+        self.limit = limit
+        self.used = 0
+        self._cond = threading.Condition()
+    
+    def acquire(self, nbytes):
+        nbytes = min(nbytes, self.limit)
+        with self._cond:
+            while self.used and self.used + nbytes > self.limit:
+                self._cond.wait()
+            self.used += nbytes
+        return nbytes
+    
+    def release(self, nbytes):
+        with self._cond:
+            self.used -= nbytes
+            self._cond.notify_all()
+
+def prefetch_image_hashes(filepaths, budget, nbytes, executor, method='phash', fast_decode=True, thumbnail_dir=None):
+    """
+    Reader-thread task of the prefetch pipeline: read a chunk of files into
+    memory, then hand the bytes to the process pool and return its future,
+    or hash them on this thread when there is no pool. The nbytes taken from
+    budget are given back once the chunk is hashed.
+    """
+    if executor is None:
+        try:
+            contents = [read_file_content(filepath) for filepath in filepaths]
+            return compute_image_hashes(filepaths, method, fast_decode, thumbnail_dir, contents)
+        finally:
+            budget.release(nbytes)
+    
+    try:
+        contents = [read_file_content(filepath) for filepath in filepaths]
+        future = executor.submit(compute_image_hashes, filepaths, method, fast_decode, thumbnail_dir, contents)
+    except BaseException:
+        budget.release(nbytes)
+        raise
+    future.add_done_callback(lambda _: budget.release(nbytes))
+    return future
+
+def default_cache_path():
+    """Location of the shared hash cache inside the user's cache directory"""
+    cache_root = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_root, 'duplicate-image-finder', 'hash_cache.sqlite3')
+
+def default_profile_path():
+    """Where an opted-in scan profile is written, one file per scan"""
+    return os.path.join(os.path.dirname(default_cache_path()), 'profiles',
+                        f"scan-{time.strftime('%Y%m%d-%H%M%S')}.prof")
+
+def default_thumbnail_dir():
+    """Location of the shared thumbnail store, next to the hash cache"""
+    return os.path.join(os.path.dirname(default_cache_path()), 'thumbnails')
+
+def default_journal_path():
+    """Location of the file action journal, next to the hash cache"""
+    return os.path.join(os.path.dirname(default_cache_path()), 'file_actions.sqlite3')
+
+def prune_thumbnails(thumbnail_dir, max_bytes=1024 * 1024 * 1024):
+    """Delete the least recently used thumbnails until the store fits in max_bytes"""
+    entries = []
+    total = 0
+    try:
+        buckets = list(os.scandir(thumbnail_dir))
+    except OSError:
+        return 0
+    for bucket in buckets:
+        if not bucket.is_dir(follow_symlinks=False):
+            continue
+        try:
+            for entry in os.scandir(bucket.path):
+                stat = entry.stat(follow_symlinks=False)
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+                total += stat.st_size
+        except OSError:
+            continue
+    
+    removed = 0
+    entries.sort()
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    return removed
+
+class HashCache:
+    """
+    Persistent SQLite store of per-file hashes.
+
+    Rows are keyed by scanned folder, relative path and hash method, and are only
+    trusted while the file's size and mtime still match what was recorded.
+    Least recently used rows are evicted once the table grows past max_entries.
+    """
+    # Paths looked up per query, well under SQLite's bound-parameter limit
+    LOOKUP_CHUNK = 500
+    
+    def __init__(self, cache_path=None, max_entries=5_000_000):
+        self.cache_path = cache_path or default_cache_path()
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        
+        cache_dir = os.path.dirname(os.path.abspath(self.cache_path))
+        os.makedirs(cache_dir, exist_ok=True)
+        
+        self.conn = sqlite3.connect(self.cache_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS file_hashes (
+                folder TEXT NOT NULL,
+                path TEXT NOT NULL,
+                method TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                hash TEXT NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (folder, path, method)
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_file_hashes_last_used ON file_hashes (last_used)")
+        self.conn.commit()
+    
+    @staticmethod
+    def folder_key(folder_path):
+        return os.path.normcase(os.path.abspath(folder_path))
+    
+    def lookup(self, folder_path, method, file_stats):
+        """
+        Return {path: hash} for every entry of file_stats ({path: (size, mtime_ns)})
+        whose cached row is still fresh. Stale rows count as misses.
+        Only the asked-for paths are read, through the primary key, so a scan
+        looking up one batch at a time does not rescan the folder's rows per batch.
+        """
+        folder = self.folder_key(folder_path)
+        paths = list(file_stats)
+        cached = {}
+        with self._lock:
+            for start in range(0, len(paths), self.LOOKUP_CHUNK):
+                chunk = paths[start:start + self.LOOKUP_CHUNK]
+                rows = self.conn.execute(
+                    "SELECT path, size, mtime_ns, hash FROM file_hashes "
+                    f"WHERE folder = ? AND method = ? AND path IN ({', '.join('?' * len(chunk))})",
+                    [folder, method] + chunk
+                )
+                for path, size, mtime_ns, hash_value in rows:
+                    if file_stats[path] == (size, mtime_ns):
+                        cached[path] = hash_value
+            
+            if cached:
+                now = time.time()
+                self.conn.executemany(
+                    "UPDATE file_hashes SET last_used = ? WHERE folder = ? AND path = ? AND method = ?",
+                    [(now, folder, path, method) for path in cached]
+                )
+                self.conn.commit()
+        
+        self.hits += len(cached)
+        self.misses += len(file_stats) - len(cached)
+        return cached
+    
+    def store(self, folder_path, method, entries):
+        """Insert or refresh rows from (path, size, mtime_ns, hash) tuples"""
+        if not entries:
+            return
+        folder = self.folder_key(folder_path)
+        now = time.time()
+        with self._lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO file_hashes (folder, path, method, size, mtime_ns, hash, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(folder, path, method, size, mtime_ns, hash_value, now)
+                 for path, size, mtime_ns, hash_value in entries]
+            )
+            self.conn.commit()
+    
+    def invalidate(self, folder_path, paths=None):
+        """Forget cached hashes for the given paths, or for the whole folder"""
+        folder = self.folder_key(folder_path)
+        with self._lock:
+            if paths is None:
+                self.conn.execute("DELETE FROM file_hashes WHERE folder = ?", (folder,))
+            else:
+                self.conn.executemany(
+                    "DELETE FROM file_hashes WHERE folder = ? AND path = ?",
+                    [(folder, path) for path in paths]
+                )
+            self.conn.commit()
+    
+    def prune_missing(self, folder_path, existing_paths):
+        """Drop rows for files that no longer exist in the folder"""
+        folder = self.folder_key(folder_path)
+        # A PathTable or mapping answers membership as it is, without a set of every path
+        if not isinstance(existing_paths, (PathTable, dict, set, frozenset)):
+            existing_paths = set(existing_paths)
+        with self._lock:
+            stale = {path for (path,) in self.conn.execute(
+                "SELECT DISTINCT path FROM file_hashes WHERE folder = ?", (folder,)
+            ) if path not in existing_paths}
+        if stale:
+            self.invalidate(folder_path, stale)
+        return len(stale)
+    
+    def evict(self):
+        """Remove least recently used rows beyond max_entries"""
+        with self._lock:
+            (count,) = self.conn.execute("SELECT COUNT(*) FROM file_hashes").fetchone()
+            excess = count - self.max_entries
+            if excess > 0:
+                self.conn.execute(
+                    "DELETE FROM file_hashes WHERE rowid IN "
+                    "(SELECT rowid FROM file_hashes ORDER BY last_used LIMIT ?)",
+                    (excess,)
+                )
+                self.conn.commit()
+        return max(0, excess)
+    
+    def close(self):
+        self.evict()
+        with self._lock:
+            self.conn.close()
+
+def move_file(source, target):
+    """Rename source to target, creating target's folder; copies only when they are on different file systems"""
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    if os.path.lexists(target):
+        raise FileExistsError(errno.EEXIST, "Target exists", target)
+    try:
+        os.rename(source, target)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.move(source, target)
+
+def same_contents(path, other, chunk_size=READ_CHUNK_SIZE):
+    """Byte-for-byte comparison of two files"""
+    if os.path.getsize(path) != os.path.getsize(other):
+        return False
+    with open(path, 'rb') as first, open(other, 'rb') as second:
+        while True:
+            chunk = first.read(chunk_size)
+            if chunk != second.read(chunk_size):
+                return False
+            if not chunk:
+                return True
+
+# Linux ioctl that makes a file share another's extents copy-on-write (Btrfs, XFS, bcachefs, ...)
+FICLONE = 0x40049409
+
+def clone_file(source, target):
+    """Create target as a reflink of source, on file systems that support it"""
+    if fcntl is None or not sys.platform.startswith('linux'):
+        raise OSError(errno.EOPNOTSUPP, "Reflinks are only supported on Linux")
+    with open(source, 'rb') as src, open(target, 'xb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            os.remove(target)
+            raise
+    shutil.copystat(source, target)
+
+def replace_with_link(path, original, reflink=False, temp_suffix='.dedupe'):
+    """
+    Replace path with a hardlink to original, or a reflink when reflink is
+    set, once their contents are verified identical. The link is made next
+    to path first and renamed over it, so path is never missing. Returns
+    False when path is already a hardlink of original.
+    """
+    path_stat, original_stat = os.stat(path), os.stat(original)
+    if (path_stat.st_dev, path_stat.st_ino) == (original_stat.st_dev, original_stat.st_ino):
+        return False
+    if not same_contents(path, original):
+        raise ValueError("Contents differ from the original")
+    temp = path + temp_suffix
+    try:
+        if reflink:
+            clone_file(original, temp)
+        else:
+            os.link(original, temp)
+        os.replace(temp, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temp)
+        raise
+    return True
+
+# Quarantined files are moved here, at the top of the scanned folder, so the move is a rename on the same file system
+QUARANTINE_DIRNAME = '.duplicate-quarantine'
+
+# Deletes and renames mostly wait on the file system, on network shares especially
+FILE_ACTION_WORKERS = 16
+
+FILE_ACTIONS = {
+    'quarantine': "Move to quarantine",
+    'delete': "Delete permanently",
+    'hardlink': "Replace with hardlinks",
+    'reflink': "Replace with reflinks"
+}
+
+# Actions that keep every path, pointing duplicates at their original's bytes
+LINK_ACTIONS = ('hardlink', 'reflink')
+
+class FileActions:
+    """
+    Batch delete or quarantine of scanned files, with a SQLite journal.
+
+    A batch and every file in it are journaled as pending before anything is
+    touched, and outcomes are recorded as files complete, so recover() can
+    settle a batch that was interrupted by checking what is on disk. Files
+    are handled on a thread pool. Quarantine renames files into
+    QUARANTINE_DIRNAME/<batch>/ under the scanned folder, and undo() moves
+    them back; deleted files cannot be restored. The link actions replace
+    exact duplicates with hardlinks or reflinks to their original, keeping
+    every path; undo() turns hardlinks back into separate copies.
+    """
+    
+    # Outcomes are written to the journal in batches of this many files
+    RECORD_EVERY = 500
+    
+    def __init__(self, journal_path=None, workers=FILE_ACTION_WORKERS):
+        self.journal_path = journal_path or default_journal_path()
+        self.workers = max(1, workers)
+        self._lock = threading.Lock()
+        
+        os.makedirs(os.path.dirname(os.path.abspath(self.journal_path)), exist_ok=True)
+        self.conn = sqlite3.connect(self.journal_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS batches (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                folder TEXT NOT NULL,
+                action TEXT NOT NULL,
+                created REAL NOT NULL,
+                finished INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS batch_files (
+                batch INTEGER NOT NULL,
+                path TEXT NOT NULL,
+                target TEXT,
+                state TEXT NOT NULL,
+                error TEXT,
+                PRIMARY KEY (batch, path)
+            )
+        """)
+        self.conn.commit()
+    
+    @staticmethod
+    def quarantine_path(folder_path, batch_id, filename):
+        return os.path.join(folder_path, QUARANTINE_DIRNAME, str(batch_id), filename)
+    
+    @staticmethod
+    def temp_suffix(batch_id):
+        """Suffix of the link a batch creates next to a file before renaming it over the file"""
+        return f".dedupe-{batch_id}"
+    
+    def apply(self, folder_path, filenames, action='quarantine', on_progress=None, originals=None):
+        """
+        Apply action to filenames, relative to folder_path. The link actions
+        need originals, {filename: original filename}. on_progress is called
+        with (files finished, total). Returns (batch id, [done], [(file, error)]).
+        """
+        if action not in FILE_ACTIONS:
+            raise ValueError(f"unknown file action {action!r}")
+        folder = os.path.abspath(folder_path)
+        filenames = list(filenames)
+        
+        def target(batch_id, filename):
+            if action == 'quarantine':
+                return self.quarantine_path(folder, batch_id, filename)
+            if action in LINK_ACTIONS:
+                return os.path.join(folder, originals[filename])
+            return None
+        
+        with self._lock:
+            batch_id = self.conn.execute(
+                "INSERT INTO batches (folder, action, created) VALUES (?, ?, ?)", (folder, action, time.time())
+            ).lastrowid
+            self.conn.executemany(
+                "INSERT INTO batch_files (batch, path, target, state) VALUES (?, ?, ?, 'pending')",
+                [(batch_id, filename, target(batch_id, filename)) for filename in filenames]
+            )
+            self.conn.commit()
+        
+        def run(filename):
+            source = os.path.join(folder, filename)
+            try:
+                if action == 'delete':
+                    os.remove(source)
+                elif action == 'quarantine':
+                    move_file(source, self.quarantine_path(folder, batch_id, filename))
+                elif not replace_with_link(source, target(batch_id, filename), action == 'reflink',
+                                           self.temp_suffix(batch_id)):
+                    return filename, "Already a hardlink of its original"
+            except FileNotFoundError:
+                return filename, "File not found"
+            except ValueError as e:
+                return filename, str(e)
+            except OSError as e:
+                return filename, e.strerror or str(e)
+            return filename, None
+        
+        done, errors, outcomes = [], [], []
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="file-action") as executor:
+            for filename, error in executor.map(run, filenames):
+                if error is None:
+                    done.append(filename)
+                else:
+                    errors.append((filename, error))
+                outcomes.append(('failed' if error else 'done', error, batch_id, filename))
+                if len(outcomes) >= self.RECORD_EVERY:
+                    self._record(outcomes)
+                    outcomes = []
+                if on_progress is not None:
+                    on_progress(len(done) + len(errors), len(filenames))
+        self._record(outcomes, finish=batch_id)
+        return batch_id, done, errors
+    
+    def undo(self, batch_id, on_progress=None):
+        """
+        Move a quarantine batch's files back where they were, or give a
+        hardlink batch's files their own copy again. Returns ([restored], [(file, error)])
+        """
+        with self._lock:
+            row = self.conn.execute("SELECT folder, action FROM batches WHERE id = ?", (batch_id,)).fetchone()
+            if row is None:
+                raise KeyError(batch_id)
+            if row[1] == 'delete':
+                raise ValueError("deleted files cannot be restored")
+            if row[1] == 'reflink':
+                raise ValueError("reflinked files are already separate copies")
+            entries = self.conn.execute(
+                "SELECT path, target FROM batch_files WHERE batch = ? AND state = 'done'", (batch_id,)
+            ).fetchall()
+        folder, action = row
+        
+        def run(entry):
+            filename, target = entry
+            source = os.path.join(folder, filename)
+            try:
+                if action == 'hardlink':
+                    # Copy the shared bytes next to the link and rename the copy over it
+                    temp = source + self.temp_suffix(batch_id)
+                    shutil.copy2(source, temp)
+                    os.replace(temp, source)
+                elif os.path.lexists(source):
+                    return filename, "A file with this name exists again"
+                else:
+                    move_file(target, source)
+            except OSError as e:
+                return filename, e.strerror or str(e)
+            return filename, None
+        
+        restored, errors, outcomes = [], [], []
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="file-action") as executor:
+            for filename, error in executor.map(run, entries):
+                if error is None:
+                    restored.append(filename)
+                    outcomes.append(('restored', None, batch_id, filename))
+                else:
+                    errors.append((filename, error))
+                if on_progress is not None:
+                    on_progress(len(restored) + len(errors), len(entries))
+        self._record(outcomes)
+        if action == 'quarantine' and not errors:
+            shutil.rmtree(os.path.join(folder, QUARANTINE_DIRNAME, str(batch_id)), ignore_errors=True)
+        return restored, errors
+    
+    def recover(self):
+        """
+        Settle batches that never finished, e.g. because the app was stopped
+        mid-batch: a pending file counts as done when it has left its folder
+        (and, for quarantine, arrived in the quarantine), or for hardlinks when
+        it shares its original's inode. Leftover temporary links are removed.
+        Returns files settled.
+        """
+        with self._lock:
+            pending = self.conn.execute("""
+                SELECT f.batch, f.path, f.target, b.folder, b.action FROM batch_files f
+                JOIN batches b ON b.id = f.batch WHERE b.finished = 0 AND f.state = 'pending'
+            """).fetchall()
+            unfinished = [batch for (batch,) in self.conn.execute("SELECT id FROM batches WHERE finished = 0")]
+        
+        outcomes = []
+        for batch_id, filename, target, folder, action in pending:
+            path = os.path.join(folder, filename)
+            if action in LINK_ACTIONS:
+                with contextlib.suppress(OSError):
+                    os.remove(path + self.temp_suffix(batch_id))
+                try:
+                    done = action == 'hardlink' and os.path.samefile(path, target)
+                except OSError:
+                    done = False
+            else:
+                done = not os.path.lexists(path) and (action == 'delete' or os.path.lexists(target))
+            if done:
+                outcomes.append(('done', None, batch_id, filename))
+            else:
+                outcomes.append(('failed', "Interrupted", batch_id, filename))
+        with self._lock:
+            self.conn.executemany("UPDATE batch_files SET state = ?, error = ? WHERE batch = ? AND path = ?", outcomes)
+            self.conn.executemany("UPDATE batches SET finished = 1 WHERE id = ?", [(batch,) for batch in unfinished])
+            self.conn.commit()
+        return len(outcomes)
+    
+    def _record(self, outcomes, finish=None):
+        with self._lock:
+            self.conn.executemany("UPDATE batch_files SET state = ?, error = ? WHERE batch = ? AND path = ?", outcomes)
+            if finish is not None:
+                self.conn.execute("UPDATE batches SET finished = 1 WHERE id = ?", (finish,))
+            self.conn.commit()
+    
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+class PathTable:
+    """
+    Interned relative paths: one UTF-8 blob plus an offsets array, so a path
+    costs its bytes and eight more rather than a Python string. A path's id is
+    its row. Lookups by path go through a compact hash index built on first use.
+    """
+    
+    # Rows decoded per slice when iterating
+    ITER_CHUNK = 65536
+    # Rows per slice when bytes are gathered with an index per byte
+    GATHER_CHUNK = 8192
+    
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray):
+        self.blob = blob
+        self.offsets = offsets
+        self._lookup = None
+    
+    @classmethod
+    def from_paths(cls, paths):
+        encoded = [path.encode('utf-8', 'surrogateescape') for path in paths]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum(np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded)), out=offsets[1:])
+        return cls(np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets)
+    
+    def __len__(self):
+        return len(self.offsets) - 1
+    
+    def __getitem__(self, idx):
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+        return self.blob[start:end].tobytes().decode('utf-8', 'surrogateescape')
+    
+    def __iter__(self):
+        for start in range(0, len(self), self.ITER_CHUNK):
+            offsets = self.offsets[start:start + self.ITER_CHUNK + 1].tolist()
+            base = offsets[0]
+            chunk = self.blob[base:offsets[-1]].tobytes()
+            for begin, end in zip(offsets, offsets[1:]):
+                yield chunk[begin - base:end - base].decode('utf-8', 'surrogateescape')
+    
+    def _hash_index(self):
+        """(sorted str hashes, rows in that order), built on first use"""
+        if self._lookup is None:
+            keys = np.fromiter((hash(name) for name in self), dtype=np.int64, count=len(self))
+            order = np.argsort(keys, kind='stable')
+            self._lookup = (keys[order], order)
+        return self._lookup
+    
+    def index(self, path):
+        """Row of a path, or -1 when it is not in the table"""
+        keys, order = self._hash_index()
+        key = hash(path)
+        pos = int(np.searchsorted(keys, key))
+        while pos < len(keys) and keys[pos] == key:
+            if self[order[pos]] == path:
+                return int(order[pos])
+            pos += 1
+        return -1
+    
+    def __contains__(self, path):
+        return self.index(path) >= 0
+    
+    def rows_of(self, other):
+        """
+        Row in this table of every path of other, another PathTable, -1 where
+        it is absent. Hash index hits are confirmed byte-wise in bulk, so no
+        per-path objects are kept.
+        """
+        keys, order = self._hash_index()
+        rows = np.full(len(other), -1, dtype=np.int64)
+        if not len(keys):
+            return rows
+        other_keys = np.fromiter((hash(name) for name in other), dtype=np.int64, count=len(other))
+        positions = np.minimum(np.searchsorted(keys, other_keys), len(keys) - 1)
+        hits = np.flatnonzero(keys[positions] == other_keys)
+        rows[hits] = order[positions[hits]]
+        # Colliding hashes fall back to a full probe
+        for position in hits[~self._equal_rows(rows[hits], other, hits)].tolist():
+            rows[position] = self.index(other[position])
+        return rows
+    
+    def _equal_rows(self, rows, other, other_rows):
+        """Whether each of rows holds the same bytes as the matching row of other"""
+        lengths = self.offsets[rows + 1] - self.offsets[rows]
+        equal = lengths == other.offsets[other_rows + 1] - other.offsets[other_rows]
+        for start in range(0, len(rows), self.GATHER_CHUNK):
+            block = np.arange(start, min(start + self.GATHER_CHUNK, len(rows)))
+            block = block[equal[block] & (lengths[block] > 0)]
+            if not len(block):
+                continue
+            counts = lengths[block]
+            firsts = np.cumsum(counts) - counts
+            within = np.arange(counts.sum()) - np.repeat(firsts, counts)
+            mine = self.blob[np.repeat(self.offsets[rows[block]], counts) + within]
+            theirs = other.blob[np.repeat(other.offsets[other_rows[block]], counts) + within]
+            equal[block[np.logical_or.reduceat(mine != theirs, firsts)]] = False
+        return equal
+
+class FileListing:
+    """
+    Files in the order a walk finds them: relative paths appended to one UTF-8
+    bytearray with an offsets array, and size and mtime_ns columns (-1 when
+    the file could not be stat'ed). A file costs its path's bytes and 24 more,
+    so a scan in progress holds no per-file Python objects; sorted() turns the
+    listing into a PathTable with its columns in path order. Files with more
+    than one hardlink also have their row and (device, inode) recorded.
+    """
+    
+    def __init__(self):
+        self._blob = bytearray()
+        self._offsets = array('q', [0])
+        self._sizes = array('q')
+        self._mtimes = array('q')
+        self._link_rows = array('q')
+        self._link_keys = array('Q')
+    
+    def __len__(self):
+        return len(self._sizes)
+    
+    def append(self, path, stat=None, link=None):
+        """Add a file with its (size, mtime_ns) or None and its link key or None, returns its row"""
+        self._blob += path.encode('utf-8', 'surrogateescape')
+        self._offsets.append(len(self._blob))
+        size, mtime_ns = stat if stat is not None else (-1, -1)
+        self._sizes.append(size)
+        self._mtimes.append(mtime_ns)
+        if link is not None:
+            self._link_rows.append(len(self._sizes) - 1)
+            self._link_keys.extend(link)
+        return len(self._sizes) - 1
+    
+    def link_siblings(self, order):
+        """
+        For each row in the path order given by sorted()'s order, the row of
+        the first path that is a hardlink of the same file, -1 for that first
+        path and for files with a single link.
+        """
+        first = np.full(len(order), -1, dtype=np.int64)
+        if not len(self._link_rows):
+            return first
+        position = np.empty(len(order), dtype=np.int64)
+        position[order] = np.arange(len(order))
+        rows = position[np.array(self._link_rows, dtype=np.int64)]
+        keys = np.array(self._link_keys, dtype=np.uint64).reshape(-1, 2)
+        ranked = np.lexsort((rows, keys[:, 1], keys[:, 0]))
+        rows, keys = rows[ranked], keys[ranked]
+        starts = np.ones(len(rows), dtype=bool)
+        starts[1:] = (keys[1:] != keys[:-1]).any(axis=1)
+        group_first = rows[np.flatnonzero(starts)[np.cumsum(starts) - 1]]
+        later = ~starts
+        first[rows[later]] = group_first[later]
+        return first
+    
+    def sort_order(self):
+        """
+        Rows in path order, comparing UTF-8 bytes, which orders paths as
+        sorting their strings does. An MSD radix sort on eight bytes at a time
+        that only revisits rows still tied on their prefix.
+        """
+        offsets = np.array(self._offsets, dtype=np.int64)
+        blob = np.frombuffer(self._blob, dtype=np.uint8)
+        order = np.arange(len(self), dtype=np.int64)
+        # Positions in order still tied with a neighbour, and the run of ties each is in
+        pending = order.copy() if len(self) > 1 and len(blob) else order[:0]
+        runs = np.zeros(len(pending), dtype=np.int64)
+        depth = 0
+        while len(pending):
+            rows = order[pending]
+            first = offsets[rows]
+            remaining = offsets[rows + 1] - first - depth
+            key = np.zeros(len(rows), dtype=np.uint64)
+            position = np.empty_like(first)
+            for byte in range(8):
+                np.add(first, depth + byte, out=position)
+                np.minimum(position, len(blob) - 1, out=position)
+                values = blob[position]
+                values[remaining <= byte] = 0
+                key <<= np.uint64(8)
+                key |= values
+            del first, position, values
+            
+            # A path that ends within these bytes sorts before the longer paths sharing them
+            local = np.lexsort((remaining > 8, key, runs))
+            rows, key, runs, remaining = rows[local], key[local], runs[local], remaining[local]
+            del local
+            order[pending] = rows
+            del rows
+            depth += 8
+            
+            # Rows stay tied while they share their run and key and have bytes left to compare
+            new_run = np.ones(len(key), dtype=bool)
+            new_run[1:] = (runs[1:] != runs[:-1]) | (key[1:] != key[:-1])
+            del key
+            run_starts = np.flatnonzero(new_run)
+            run_sizes = np.diff(np.append(run_starts, len(new_run)))
+            tied = (np.repeat(run_sizes, run_sizes) > 1) & (remaining > 8)
+            runs = np.repeat(run_starts, run_sizes)[tied]
+            pending = pending[tied]
+        del blob
+        return order
+    
+    def sorted(self):
+        """(PathTable, sizes, mtimes, order) in path order; order[row] is the listing row behind each row"""
+        order = self.sort_order()
+        offsets = np.array(self._offsets, dtype=np.int64)
+        lengths = np.diff(offsets)[order]
+        new_offsets = np.zeros(len(order) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=new_offsets[1:])
+        new_blob = np.empty(int(new_offsets[-1]), dtype=np.uint8)
+        blob = np.frombuffer(self._blob, dtype=np.uint8)
+        for start in range(0, len(order), PathTable.GATHER_CHUNK):
+            rows = order[start:start + PathTable.GATHER_CHUNK]
+            counts = lengths[start:start + len(rows)]
+            first = new_offsets[start]
+            # Source byte of every output byte: its row's old start plus its place in the row
+            shift = np.repeat(offsets[rows] - (new_offsets[start:start + len(rows)] - first), counts)
+            new_blob[first:first + counts.sum()] = blob[shift + np.arange(counts.sum())]
+        del blob
+        sizes = np.array(self._sizes, dtype=np.int64)[order]
+        mtimes = np.array(self._mtimes, dtype=np.int64)[order]
+        return PathTable(new_blob, new_offsets), sizes, mtimes, order
+
+def hex_words(hex_hash, words=1):
+    """A hex digest as words uint64 values, most significant first"""
+    hex_hash = hex_hash.rjust(16 * words, '0')
+    return [int(hex_hash[16 * word:16 * (word + 1)], 16) for word in range(words)]
+
+class ScanResults:
+    """
+    Array-backed results of one scan, compact enough for tens of millions of files.
+
+    Rows are the listed files in sorted order, interned in a PathTable. Columns
+    hold their size, mtime_ns (-1 when unknown) and packed hash words; groups
+    are CSR arrays whose slices start with the group's original; best matches
+    point at rows (-1 for none). spill() moves every array to .npy files and
+    memory-maps them back. The duplicates, hash_values, similarity_scores,
+    best_matches and file_stats properties are read-only dict-like views,
+    and lookups from a file to its group, original or similarity go through
+    reverse indexes built once, which is what the results tabs read.
+    """
+    
+    # Results with at least this many rows are spilled to disk by DuplicateImageFinder
+    SPILL_ROWS = 1_000_000
+    ARRAYS = ('sizes', 'mtimes', 'hashes', 'has_hash', 'group_offsets', 'group_members',
+              'member_similarity', 'best_match', 'best_similarity')
+    
+    def __init__(self, paths: PathTable, sizes, mtimes, hashes, has_hash, group_offsets=None, group_members=None,
+                 member_similarity=None, best_match=None, best_similarity=None):
+        n = len(paths)
+        self.paths = paths
+        self.sizes = sizes
+        self.mtimes = mtimes
+        self.hashes = hashes
+        self.has_hash = has_hash
+        self.group_offsets = group_offsets if group_offsets is not None else np.zeros(1, dtype=np.int64)
+        self.group_members = group_members if group_members is not None else np.zeros(0, dtype=np.int64)
+        self.member_similarity = member_similarity if member_similarity is not None else np.zeros(0)
+        self.best_match = best_match if best_match is not None else np.full(n, -1, dtype=np.int64)
+        self.best_similarity = best_similarity if best_similarity is not None else np.zeros(n)
+        self.spill_dir = None
+        self._row_group = None
+        self._row_position = None
+        self._is_duplicate = None
+        self._duplicate_rows = None
+        self._reclaimable = None
+    
+    @classmethod
+    def build(cls, image_files, file_stats, hashes, has_hash, groups=(), best_match=None, best_similarity=None):
+        """
+        Assemble results from sorted image_files, their {file: (size, mtime_ns)}
+        stats, packed hashes and groups given as [[(original row, 100.0),
+        (duplicate row, similarity), ...], ...] in display order.
+        """
+        n = len(image_files)
+        stats = [file_stats.get(filename, (-1, -1)) for filename in image_files]
+        sizes = np.fromiter((stat[0] for stat in stats), dtype=np.int64, count=n)
+        mtimes = np.fromiter((stat[1] for stat in stats), dtype=np.int64, count=n)
+        del stats
+        return cls.from_columns(PathTable.from_paths(image_files), sizes, mtimes, hashes, has_hash, groups,
+                                best_match, best_similarity)
+    
+    @classmethod
+    def from_columns(cls, paths, sizes, mtimes, hashes, has_hash, groups=(), best_match=None, best_similarity=None):
+        """Assemble results from a PathTable and its columns, with groups as build() takes them"""
+        group_offsets = np.zeros(len(groups) + 1, dtype=np.int64)
+        np.cumsum(np.fromiter(map(len, groups), dtype=np.int64, count=len(groups)), out=group_offsets[1:])
+        members = [member for group in groups for member in group]
+        group_members = np.fromiter((row for row, _ in members), dtype=np.int64, count=len(members))
+        member_similarity = np.fromiter((similarity for _, similarity in members), dtype=np.float64,
+                                        count=len(members))
+        
+        return cls(paths, sizes, mtimes, hashes, has_hash, group_offsets, group_members, member_similarity,
+                   best_match, best_similarity)
+    
+    @classmethod
+    def empty(cls):
+        return cls.build([], {}, np.zeros((0, 1), dtype=np.uint64), np.zeros(0, dtype=bool))
+    
+    def __len__(self):
+        return len(self.paths)
+    
+    @property
+    def num_groups(self):
+        return len(self.group_offsets) - 1
+    
+    def group_rows(self, group):
+        """Rows of one group, original first"""
+        return self.group_members[self.group_offsets[group]:self.group_offsets[group + 1]]
+    
+    def _group_index(self):
+        """
+        Reverse indexes, built once on first use: each row's group and its
+        position in group_members (-1 when ungrouped), which positions and
+        rows are duplicates rather than originals, and each group's
+        reclaimable bytes, the total size of its duplicates.
+        """
+        if self._row_group is None:
+            row_group = np.full(len(self), -1, dtype=np.int64)
+            row_group[self.group_members] = np.repeat(np.arange(self.num_groups), np.diff(self.group_offsets))
+            row_position = np.full(len(self), -1, dtype=np.int64)
+            row_position[self.group_members] = np.arange(len(self.group_members))
+            is_duplicate = np.ones(len(self.group_members), dtype=bool)
+            is_duplicate[self.group_offsets[:-1]] = False
+            duplicate_sizes = np.where(is_duplicate, np.maximum(self.sizes[self.group_members], 0), 0)
+            self._reclaimable = (np.add.reduceat(duplicate_sizes, self.group_offsets[:-1]) if self.num_groups
+                                 else np.zeros(0, dtype=np.int64))
+            self._duplicate_rows = np.zeros(len(self), dtype=bool)
+            self._duplicate_rows[self.group_members[is_duplicate]] = True
+            self._is_duplicate = is_duplicate
+            self._row_position = row_position
+            self._row_group = row_group
+    
+    def group_of(self, row):
+        """Group a row is the original of, or -1"""
+        self._group_index()
+        position = self._row_position[row]
+        return int(self._row_group[row]) if position >= 0 and not self._is_duplicate[position] else -1
+    
+    def original_of(self, row):
+        """(original row, similarity) of a duplicate, or None for originals and ungrouped rows"""
+        self._group_index()
+        position = self._row_position[row]
+        if position < 0 or not self._is_duplicate[position]:
+            return None
+        original = self.group_members[self.group_offsets[self._row_group[row]]]
+        return int(original), float(self.member_similarity[position])
+    
+    @property
+    def duplicate_rows(self):
+        """Boolean column, True for rows that are a duplicate in some group"""
+        self._group_index()
+        return self._duplicate_rows
+    
+    @property
+    def reclaimable(self):
+        """Bytes freed per group by deleting its duplicates"""
+        self._group_index()
+        return self._reclaimable
+    
+    @property
+    def num_duplicates(self):
+        return len(self.group_members) - self.num_groups
+    
+    def duplicate_similarities(self):
+        self._group_index()
+        return self.member_similarity[self._is_duplicate]
+    
+    def group_order(self, sort_by='size'):
+        """
+        Group numbers in display order: largest groups first ('size'), most
+        reclaimable space first ('bytes') or scan order ('scan'). Ties keep scan order.
+        """
+        if sort_by == 'size':
+            return np.argsort(-np.diff(self.group_offsets), kind='stable')
+        if sort_by == 'bytes':
+            return np.argsort(-self.reclaimable, kind='stable')
+        return np.arange(self.num_groups)
+    
+    def best_match_order(self):
+        """Rows that have a best match, most similar first"""
+        rows = np.flatnonzero(self.best_match >= 0)
+        return rows[np.argsort(-self.best_similarity[rows], kind='stable')]
+    
+    def pair_order(self):
+        """Positions in group_members of every duplicate, most similar first"""
+        self._group_index()
+        positions = np.flatnonzero(self._is_duplicate)
+        return positions[np.argsort(-self.member_similarity[positions], kind='stable')]
+    
+    def pair_at(self, position):
+        """(original row, duplicate row, similarity) of a duplicate's position in group_members"""
+        self._group_index()
+        row = int(self.group_members[position])
+        original = self.group_members[self.group_offsets[self._row_group[row]]]
+        return int(original), row, float(self.member_similarity[position])
+    
+    def without(self, rows, files_remain=False):
+        """
+        Results after the files at rows are gone, e.g. deleted: their stats,
+        hashes and best matches are cleared, they leave their groups, groups
+        left with one file are dropped, and a group whose original went is
+        led by its next member. Other members keep the similarity they were
+        scored with. With files_remain, e.g. after they were replaced by
+        links to their original, the rows only leave their groups. Unchanged
+        arrays are shared rather than copied.
+        """
+        removed = np.zeros(len(self), dtype=bool)
+        removed[np.asarray(rows, dtype=np.int64)] = True
+        
+        keep = ~removed[self.group_members]
+        counts = (np.add.reduceat(keep.astype(np.int64), self.group_offsets[:-1]) if self.num_groups
+                  else np.zeros(0, dtype=np.int64))
+        keep &= np.repeat(counts >= 2, np.diff(self.group_offsets))
+        group_offsets = np.zeros(np.count_nonzero(counts >= 2) + 1, dtype=np.int64)
+        np.cumsum(counts[counts >= 2], out=group_offsets[1:])
+        member_similarity = self.member_similarity[keep]
+        member_similarity[group_offsets[:-1]] = 100.0
+        
+        if files_remain:
+            columns = (self.sizes, self.mtimes, self.has_hash, self.best_match, self.best_similarity)
+        else:
+            best_match = np.where(removed | ((self.best_match >= 0) & removed[np.maximum(self.best_match, 0)]),
+                                  -1, self.best_match)
+            columns = (np.where(removed, -1, self.sizes), np.where(removed, -1, self.mtimes),
+                       self.has_hash & ~removed, best_match, np.where(best_match >= 0, self.best_similarity, 0.0))
+        sizes, mtimes, has_hash, best_match, best_similarity = columns
+        patched = ScanResults(self.paths, sizes, mtimes, self.hashes, has_hash, group_offsets,
+                              self.group_members[keep], member_similarity, best_match, best_similarity)
+        # Shared arrays may be memory maps of a spill directory that goes away with these results
+        patched.spill_dir = self.spill_dir
+        patched._spill_owner = self if self.spill_dir is not None else None
+        return patched
+    
+    def hash_hex(self, row):
+        return ''.join(format(word, '016x') for word in self.hashes[row].tolist())
+    
+    def spill(self, directory, cleanup=False):
+        """
+        Write every array to directory and replace it with a read-only memory map.
+        With cleanup, the directory is removed once these results are garbage.
+        """
+        os.makedirs(directory, exist_ok=True)
+        
+        def spilled(name, array):
+            path = os.path.join(directory, f"{name}.npy")
+            np.save(path, array)
+            return np.load(path, mmap_mode='r') if array.size else array
+        
+        self.paths = PathTable(spilled('path_blob', self.paths.blob), spilled('path_offsets', self.paths.offsets))
+        for name in self.ARRAYS:
+            setattr(self, name, spilled(name, getattr(self, name)))
+        self.spill_dir = directory
+        if cleanup:
+            weakref.finalize(self, shutil.rmtree, directory, True)
+        return self
+    
+    @property
+    def duplicates(self):
+        return DuplicatesView(self)
+    
+    @property
+    def hash_values(self):
+        return HashValuesView(self)
+    
+    @property
+    def similarity_scores(self):
+        return SimilarityScoresView(self)
+    
+    @property
+    def best_matches(self):
+        return BestMatchesView(self)
+    
+    @property
+    def file_stats(self):
+        return FileStatsView(self)
+    
+    def as_tuple(self):
+        """(duplicates, hash_values, similarity_scores, best_matches), as find_duplicates_with_similarity returns"""
+        return self.duplicates, self.hash_values, self.similarity_scores, self.best_matches
+
+class _ResultsView(Mapping):
+    """
+    Read-only mapping over a ScanResults, keyed by relative path. Mapping is
+    an abstract base class, so subclasses must define _value().
+    """
+    
+    def __init__(self, results: ScanResults):
+        self.results = results
+    
+    def _rows(self) -> np.ndarray:
+        return np.arange(len(self.results))
+    
+    def _has(self, row):
+        return True
+    
+    @abstractmethod
+    def _value(self, row):
+        """The mapping's value for a row"""
+    
+    def _iter_rows(self):
+        rows = self._rows()
+        for start in range(0, len(rows), PathTable.ITER_CHUNK):
+            yield from rows[start:start + PathTable.ITER_CHUNK].tolist()
+    
+    def __getitem__(self, filename):
+        row = self.results.paths.index(filename)
+        if row < 0 or not self._has(row):
+            raise KeyError(filename)
+        return self._value(row)
+    
+    def __iter__(self):
+        paths = self.results.paths
+        return (paths[row] for row in self._iter_rows())
+    
+    def __len__(self):
+        return len(self._rows())
+    
+    def items(self):
+        paths = self.results.paths
+        return ((paths[row], self._value(row)) for row in self._iter_rows())
+    
+    def values(self):
+        return (self._value(row) for row in self._iter_rows())
+    
+    def __repr__(self):
+        return f"{type(self).__name__}({len(self)} entries)"
+
+class DuplicatesView(_ResultsView):
+    """original -> [duplicates], in group order"""
+    
+    def _rows(self):
+        results = self.results
+        return results.group_members[results.group_offsets[:-1]]
+    
+    def _has(self, row):
+        return self.results.group_of(row) >= 0
+    
+    def _value(self, row):
+        results = self.results
+        return [results.paths[member] for member in results.group_rows(results.group_of(row))[1:].tolist()]
+
+class SimilarityScoresView(DuplicatesView):
+    """original -> {duplicate: similarity}"""
+    
+    def _value(self, row):
+        results = self.results
+        group = results.group_of(row)
+        start, end = results.group_offsets[group] + 1, results.group_offsets[group + 1]
+        return {
+            results.paths[member]: similarity
+            for member, similarity in zip(results.group_members[start:end].tolist(),
+                                          results.member_similarity[start:end].tolist())
+        }
+
+class HashValuesView(_ResultsView):
+    """file -> hex hash, for files that were hashed"""
+    
+    def _rows(self):
+        return np.flatnonzero(self.results.has_hash)
+    
+    def _has(self, row):
+        return bool(self.results.has_hash[row])
+    
+    def _value(self, row):
+        return self.results.hash_hex(row)
+
+class BestMatchesView(_ResultsView):
+    """file -> {'best_match': file, 'similarity': percentage}"""
+    
+    def _rows(self):
+        return np.flatnonzero(self.results.best_match >= 0)
+    
+    def _has(self, row):
+        return self.results.best_match[row] >= 0
+    
+    def _value(self, row):
+        results = self.results
+        return {
+            'best_match': results.paths[results.best_match[row]],
+            'similarity': float(results.best_similarity[row])
+        }
+
+class FileStatsView(_ResultsView):
+    """file -> (size, mtime_ns), for files that could be stat'ed"""
+    
+    def _rows(self):
+        return np.flatnonzero(self.results.sizes >= 0)
+    
+    def _has(self, row):
+        return self.results.sizes[row] >= 0
+    
+    def _value(self, row):
+        return (int(self.results.sizes[row]), int(self.results.mtimes[row]))
+
+class ScanState:
+    """
+    What a finished scan saw: its ScanResults with file stats, hashes and best
+    matches. Handed to the next scan of the same folder so only added or
+    modified files are re-hashed.
+    """
+    
+    def __init__(self, folder_path, hash_key, results: ScanResults):
+        self.folder_path = folder_path
+        self.hash_key = hash_key
+        self.results = results
+    
+    def is_compatible(self, folder_path, hash_key):
+        """Hashes can only be reused for the same folder and the same kind of hash"""
+        return (os.path.abspath(folder_path) == os.path.abspath(self.folder_path)
+                and hash_key == self.hash_key)
+    
+    def unchanged_hashes(self, file_stats):
+        """Previous hashes of the files in file_stats whose size and mtime are unchanged"""
+        results = self.results
+        unchanged = {}
+        for filename, stat in file_stats.items():
+            row = results.paths.index(filename)
+            if (row >= 0 and results.has_hash[row]
+                    and stat == (int(results.sizes[row]), int(results.mtimes[row]))):
+                unchanged[filename] = results.hash_hex(row)
+        return unchanged
+    
+    def matching_rows(self, paths, sizes, mtimes):
+        """
+        For each row of a PathTable with its size and mtime columns: its row in
+        this scan's results (-1 when new), and whether its hash there still holds
+        """
+        results = self.results
+        previous_rows = results.paths.rows_of(paths)
+        known = np.flatnonzero(previous_rows >= 0)
+        unchanged = np.zeros(len(paths), dtype=bool)
+        rows = previous_rows[known]
+        unchanged[known] = (results.has_hash[rows] & (results.sizes[rows] == sizes[known])
+                            & (results.mtimes[rows] == mtimes[known]) & (sizes[known] >= 0))
+        return previous_rows, unchanged
+    
+    def change_counts(self, results: ScanResults):
+        """(added, modified, removed) counts of the files results could stat, relative to this scan"""
+        previous = self.results
+        current = np.flatnonzero(results.sizes >= 0)
+        rows = previous.paths.rows_of(results.paths)[current]
+        known = rows >= 0
+        known[known] = previous.sizes[rows[known]] >= 0
+        rows, current_rows = rows[known], current[known]
+        modified = np.count_nonzero((previous.sizes[rows] != results.sizes[current_rows])
+                                    | (previous.mtimes[rows] != results.mtimes[current_rows]))
+        removed = np.count_nonzero(previous.sizes >= 0) - len(rows)
+        return len(current) - len(rows), int(modified), int(removed)
+
+class ScanMetrics:
+    """
+    Instrumentation collected by DuplicateImageFinder during a scan: wall and
+    CPU time per stage (CPU includes worker processes once they have been
+    joined), counters such as files hashed and bytes read, and decode failures
+    by file format.
+    """
+    
+    def __init__(self):
+        self.stages = {}
+        self.counters = defaultdict(int)
+        self.failures = defaultdict(int)
+        self._stage = None
+        self._started = None
+    
+    @staticmethod
+    def _clock():
+        times = os.times()
+        return time.perf_counter(), times.user + times.system + times.children_user + times.children_system
+    
+    def start_stage(self, name):
+        """Close the running stage and start timing name (None just closes it)"""
+        now = self._clock()
+        if self._stage is not None:
+            stage = self.stages.setdefault(self._stage, {'wall': 0.0, 'cpu': 0.0, 'files': 0})
+            stage['wall'] += now[0] - self._started[0]
+            stage['cpu'] += now[1] - self._started[1]
+        self._stage, self._started = name, now
+    
+    def add(self, counter, amount=1):
+        self.counters[counter] += amount
+    
+    def failure(self, filename):
+        self.failures[os.path.splitext(filename)[1].lower() or '(none)'] += 1
+    
+    @property
+    def cache_hit_rate(self):
+        """Share of hash lookups served by the previous scan or the cache, None before any lookup"""
+        reused = self.counters['hashes_reused']
+        total = reused + self.counters['files_hashed']
+        return reused / total if total else None
+    
+    def to_dict(self):
+        wall = sum(stage['wall'] for stage in self.stages.values())
+        return {
+            'wall_seconds': wall,
+            'cpu_seconds': sum(stage['cpu'] for stage in self.stages.values()),
+            'files_per_second': self.counters['files_listed'] / wall if wall else None,
+            'cache_hit_rate': self.cache_hit_rate,
+            'stages': [
+                {
+                    'stage': name,
+                    'wall_seconds': stage['wall'],
+                    'cpu_seconds': stage['cpu'],
+                    'files': stage['files'],
+                    'files_per_second': stage['files'] / stage['wall'] if stage['wall'] else None
+                }
+                for name, stage in self.stages.items()
+            ],
+            'counters': dict(self.counters),
+            'decode_failures': dict(self.failures)
+        }
+
+class ScanProfiler:
+    """
+    Opt-in cProfile around a scan: `with ScanProfiler(path) as profiler:` dumps
+    the stats to path (when given) and keeps a text summary of the hot paths.
+    Only the calling thread is profiled, not walker threads or worker processes.
+    """
+    
+    def __init__(self, path=None, limit=30):
+        self.path = path
+        self.limit = limit
+        self.profile = cProfile.Profile()
+        self.summary = ""
+    
+    def __enter__(self):
+        self.profile.enable()
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.profile.disable()
+        if self.path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self.profile.dump_stats(self.path)
+        text = io.StringIO()
+        pstats.Stats(self.profile, stream=text).sort_stats('cumulative').print_stats(self.limit)
+        self.summary = text.getvalue()
+        return False
+
+class ScanCancelled(Exception):
+    """Raised from a progress event to stop a scan; hashes computed so far stay in the cache"""
+
+class ScanProgress:
+    """
+    Progress reporter for DuplicateImageFinder. This base class is silent
+    apart from passing each event to callback(event, value), where event is
+    'progress' (fraction 0-1), 'status', 'info', 'warning', 'clear' or
+    'stage' (the name of the scan stage starting now, None once it is done).
+    Reporters created with partials=True also get 'partial' events carrying
+    a ScanResults of the groups found so far, without best matches. A reporter
+    may raise ScanCancelled from progress or status to stop the scan.
+    """
+    
+    def __init__(self, callback=None, partials=False):
+        self.callback = callback
+        self.partials = partials
+    
+    def _emit(self, event, value=None):
+        if self.callback is not None:
+            self.callback(event, value)
+    
+    def progress(self, fraction):
+        self._emit('progress', fraction)
+    
+    def status(self, text):
+        self._emit('status', text)
+    
+    def info(self, text):
+        self._emit('info', text)
+    
+    def warning(self, text):
+        self._emit('warning', text)
+    
+    def clear(self):
+        self._emit('clear')
+    
+    def stage(self, name):
+        self._emit('stage', name)
+    
+    def partial(self, results):
+        self._emit('partial', results)
+
+class StreamlitProgress(ScanProgress):
+    """Reports to a Streamlit progress bar and status line, created on first use"""
+    
+    def __init__(self, callback=None):
+        super().__init__(callback)
+        self.progress_bar = None
+        self.status_text = None
+    
+    def _widgets(self):
+        if self.progress_bar is None:
+            self.progress_bar = st.progress(0)
+            self.status_text = st.empty()
+        return self.progress_bar, self.status_text
+    
+    def progress(self, fraction):
+        self._widgets()[0].progress(fraction)
+        super().progress(fraction)
+    
+    def status(self, text):
+        self._widgets()[1].text(text)
+        super().status(text)
+    
+    def info(self, text):
+        st.info(text)
+        super().info(text)
+    
+    def warning(self, text):
+        st.warning(text)
+        super().warning(text)
+    
+    def clear(self):
+        if self.progress_bar is not None:
+            self.progress_bar.empty()
+            self.status_text.empty()
+            self.progress_bar = self.status_text = None
+        super().clear()
 
 class DuplicateImageFinder:
-    def __init__(self, folder_path, recursive=False):
+    # Rows buffered before computed hashes are written to the cache
+    CACHE_FLUSH_SIZE = 1000
+    # Seconds between partial results, stretched so building them stays a small share of the scan
+    PARTIAL_INTERVAL = 2.0
+    
+    def __init__(self, folder_path, recursive=False, workers=None, chunk_size=None, cache=None, digest='md5',
+                 fast_decode=True, walk_threads=8, thumbnail_dir=None, progress=None, spill_dir=None, prefetch=None):
         self.folder_path = folder_path
         self.recursive = recursive
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.walk_threads = max(1, walk_threads)
+        # Reader threads that fetch file bytes ahead of hashing, 0 reads one file at a time;
+        # by default only network shares and FUSE mounts, where a read mostly waits, get them
+        if prefetch is None:
+            prefetch = PREFETCH_THREADS if is_network_path(folder_path) else 0
+        self.prefetch = max(0, prefetch)
+        self.chunk_size = chunk_size
+        self.cache = cache
+        self.digest = digest if digest in CONTENT_DIGESTS else 'md5'
+        self.fast_decode = fast_decode
+        self.thumbnail_dir = thumbnail_dir
+        self.progress = progress if progress is not None else StreamlitProgress()
+        self.spill_dir = spill_dir
+        self.previous_scan = None
+        self.file_stats = None
+        self.files_listed = 0
+        # Stats and hardlink keys of files the walk has yielded and hashing has not taken yet
+        self._listed_stats = {}
+        self._listed_links = {}
+        self.last_scan = None
+        self.last_results = None
+        self.metrics = ScanMetrics()
+        self._next_partial = 0.0
         self.image_extensions = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tiff', '.webp', '.jfif', '.heic', '.avif')
     
     def get_image_files(self):
         """Get all image files in the folder, optionally recursive"""
-        image_files = []
-        
-        if self.recursive:
-            # Recursive search through all subfolders
-            for root, dirs, files in os.walk(self.folder_path):
-                for filename in files:
-                    if filename.lower().endswith(self.image_extensions):
-                        # Store relative path from main folder
-                        rel_path = os.path.relpath(os.path.join(root, filename), self.folder_path)
-                        image_files.append(rel_path)
+        return list(self.list_image_files().sorted()[0])
+    
+    def list_image_files(self):
+        """The whole walk as a FileListing, in the order files were found, with their stats"""
+        listing = FileListing()
+        for filename in self.iter_image_files():
+            listing.append(filename, self._listed_stats.pop(filename, None), self._listed_links.pop(filename, None))
+        return listing
+    
+    def iter_image_files(self):
+        """
+        Yield relative paths of image files as they are found, in no particular
+        order, so hashing can start before the walk finishes. Stats come from
+        the os.scandir entries and wait in self._listed_stats until
+        get_file_stats() takes them; link keys of files with several hardlinks
+        wait in self._listed_links. When recursive, subfolders are scanned
+        concurrently by a thread pool.
+        """
+        self._listed_stats = {}
+        self._listed_links = {}
+        self.files_listed = 0
+        
+        if not self.recursive:
+            files, _ = self._scan_directory('')
+            for rel_path, stat, link in files:
+                yield self._record_listed_file(rel_path, stat, link)
+            return
+        
+        # Folders are listed at most two per thread ahead of the consumer, so the
+        # listings waiting to be yielded stay bounded however large the tree is
+        with ThreadPoolExecutor(max_workers=self.walk_threads) as executor:
+            waiting = deque()
+            pending = {executor.submit(self._scan_directory, '')}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    files, subfolders = future.result()
+                    waiting.extend(subfolders)
+                    while waiting and len(pending) < 2 * self.walk_threads:
+                        pending.add(executor.submit(self._scan_directory, waiting.popleft()))
+                    for rel_path, stat, link in files:
+                        yield self._record_listed_file(rel_path, stat, link)
+    
+    def _record_listed_file(self, rel_path, stat, link=None):
+        self.files_listed += 1
+        if stat is not None:
+            self._listed_stats[rel_path] = stat
+        if link is not None:
+            self._listed_links[rel_path] = link
+        return rel_path
+    
+    @staticmethod
+    def link_key(stat):
+        """(device, inode) of a file with more than one hardlink, else None"""
+        return (stat.st_dev, stat.st_ino) if stat.st_nlink > 1 and stat.st_ino else None
+    
+    def _scan_directory(self, rel_dir):
+        """
+        List one folder: ([(relative path, (size, mtime_ns) or None, link key
+        or None)], [relative subfolders])
+        """
+        files = []
+        subfolders = []
+        prefix = rel_dir + os.sep if rel_dir else ''
+        
+        try:
+            with os.scandir(os.path.join(self.folder_path, rel_dir)) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.name != QUARANTINE_DIRNAME:
+                                subfolders.append(prefix + entry.name)
+                        elif entry.name.lower().endswith(self.image_extensions) and entry.is_file():
+                            try:
+                                stat = entry.stat()
+                                files.append((prefix + entry.name, (stat.st_size, stat.st_mtime_ns),
+                                              self.link_key(stat)))
+                            except OSError:
+                                files.append((prefix + entry.name, None, None))
+                    except OSError:
+                        continue
+        except OSError:
+            pass
+        
+        return files, subfolders
+    
+    def get_full_path(self, filename):
+        """Get full absolute path for a file (handles recursive paths)"""
+        return os.path.join(self.folder_path, filename)
+    
+    def stat_files(self, image_files):
+        """Return {filename: (size, mtime_ns)}, skipping files that cannot be stat'ed"""
+        file_stats = {}
+        for filename in image_files:
+            try:
+                stat = os.stat(self.get_full_path(filename))
+            except OSError:
+                continue
+            file_stats[filename] = (stat.st_size, stat.st_mtime_ns)
+        return file_stats
+    
+    def get_file_stats(self, image_files):
+        """
+        {filename: (size, mtime_ns)} for image_files: stats the running walk
+        recorded are handed over once, anything else is stat'ed now
+        """
+        file_stats = {}
+        unlisted = []
+        for filename in image_files:
+            stat = self._listed_stats.pop(filename, None)
+            if stat is not None:
+                file_stats[filename] = stat
+            else:
+                unlisted.append(filename)
+        if unlisted:
+            file_stats.update(self.stat_files(unlisted))
+        return file_stats
+    
+    def hash_key(self, method):
+        """Name under which hashes of this method and decode mode are cached and reused"""
+        if method == 'md5':
+            return self.digest
+        # A cascade's results hold its cheap hash, so they are interchangeable with that method's
+        method = CASCADE_METHODS.get(method, (method,))[0]
+        return f"{method}/fast" if self.fast_decode else method
+    
+    def _reusable_previous_hashes(self, hash_key, file_stats):
+        if self.previous_scan is None or not self.previous_scan.is_compatible(self.folder_path, hash_key):
+            return {}
+        return self.previous_scan.unchanged_hashes(file_stats)
+    
+    def _load_cached_hashes(self, image_files, hash_key, file_stats=None):
+        """
+        Hashes that need no recomputation: unchanged files from the previous scan,
+        then fresh rows from the persistent cache. Returns them together with the
+        stats they were validated against.
+        """
+        if file_stats is None:
+            file_stats = self.get_file_stats(image_files)
+        
+        reused = self._reusable_previous_hashes(hash_key, file_stats)
+        reused = {filename: reused[filename] for filename in image_files if filename in reused}
+        self.metrics.add('hashes_from_previous_scan', len(reused))
+        
+        if self.cache is not None:
+            remaining = {filename: file_stats[filename] for filename in image_files
+                         if filename in file_stats and filename not in reused}
+            if remaining:
+                hits = self.cache.lookup(self.folder_path, hash_key, remaining)
+                self.metrics.add('cache_hits', len(hits))
+                self.metrics.add('cache_misses', len(remaining) - len(hits))
+                reused.update(hits)
+        self.metrics.add('hashes_reused', len(reused))
+        return reused, file_stats
+    
+    def _save_cached_hashes(self, method, pending):
+        if self.cache is not None and pending:
+            self.cache.store(self.folder_path, method, pending)
+        # Without a cache the rows are dropped, not kept for the rest of the scan
+        pending.clear()
+    
+    def _partial_due(self):
+        return self.progress.partials and time.monotonic() >= self._next_partial
+    
+    def _publish_partial(self, build):
+        """Send build()'s partial ScanResults to the progress reporter and schedule the next one"""
+        started = time.monotonic()
+        self.progress.partial(build())
+        finished = time.monotonic()
+        self._next_partial = finished + max(self.PARTIAL_INTERVAL, 4 * (finished - started))
+    
+    def _enter_stage(self, name):
+        """Start timing a scan stage (None ends the last one) and tell the progress reporter"""
+        self.metrics.start_stage(name)
+        self.progress.stage(name)
+    
+    def find_duplicates_with_similarity(self, method='phash', threshold=12, similarity_threshold=80.0,
+                                        previous_scan=None):
+        """
+        Find duplicate/similar images with similarity percentages.
+        When previous_scan (a ScanState) is given, only added or modified files are
+        hashed again; the resulting state is kept in self.last_scan.
+        Returns read-only dict views over an array-backed ScanResults, which is
+        kept in self.last_results and spilled to disk for very large folders.
+        """
+        self.previous_scan = previous_scan
+        self.metrics = ScanMetrics()
+        self._next_partial = time.monotonic() + self.PARTIAL_INTERVAL
+        
+        if method == 'md5':
+            # Size bucketing needs the complete listing up front
+            self._enter_stage('listing')
+            results = self._find_exact_duplicates_with_similarity(self.list_image_files())
         else:
-            # Non-recursive (original behavior)
-            for filename in os.listdir(self.folder_path):
-                if filename.lower().endswith(self.image_extensions):
-                    filepath = os.path.join(self.folder_path, filename)
-                    if os.path.isfile(filepath):
-                        image_files.append(filename)
+            # Perceptual hashing consumes the walk as it goes
+            results = self._find_similar_duplicates_with_similarity(
+                self.iter_image_files(), method, threshold, similarity_threshold
+            )
+        
+        if self.cache is not None and self.recursive and self.files_listed:
+            # A recursive listing is complete, so anything else cached for this folder is gone
+            self.cache.prune_missing(self.folder_path, results.paths)
+        
+        if len(results) >= ScanResults.SPILL_ROWS:
+            if self.spill_dir is not None:
+                results.spill(self.spill_dir)
+            else:
+                spill_root = os.path.dirname(default_cache_path())
+                os.makedirs(spill_root, exist_ok=True)
+                results.spill(tempfile.mkdtemp(prefix='scan-', dir=spill_root), cleanup=True)
+        
+        self._enter_stage(None)
+        self._finish_metrics(results)
+        self.file_stats = results.file_stats
+        self.last_results = results
+        self.last_scan = ScanState(self.folder_path, self.hash_key(method), results)
+        return results.as_tuple()
+    
+    def _finish_metrics(self, results):
+        """Fill in per-stage file counts once the totals are known"""
+        metrics = self.metrics
+        hashed = int(np.count_nonzero(results.has_hash))
+        metrics.counters['files_listed'] = self.files_listed
+        metrics.counters['files_with_hash'] = hashed
+        for name, stage in metrics.stages.items():
+            if name == 'confirming':
+                stage['files'] = metrics.counters['files_confirmed']
+            else:
+                stage['files'] = self.files_listed if name in ('listing', 'hashing') else hashed
+    
+    def _find_exact_duplicates_with_similarity(self, listing):
+        """
+        Find exact duplicates in three stages: bucket by file size, compare a
+        head/tail sample within each bucket, then stream a full content hash
+        only for files that still collide. The stages work on row arrays over
+        the sorted listing, so only a cache batch of paths is ever held as str.
+        """
+        if not len(listing):
+            return ScanResults.empty()
+        progress = self.progress
+        progress.progress(0)
+        
+        # Stage 1: a file with a unique size cannot have an exact duplicate
+        self._enter_stage('hashing')
+        progress.status(f"Grouping {len(listing)} files by size...")
+        paths, sizes, mtimes, order = listing.sorted()
+        siblings = listing.link_siblings(order)
+        del listing, order
+        for row in np.flatnonzero(sizes < 0).tolist():
+            progress.warning(f"Error processing {paths[row]}: cannot read file size")
+        
+        # Hardlinks of one file share their bytes already: only the first path is read or reported
+        usable = (sizes >= 0) & (siblings < 0)
+        self.metrics.add('hardlinks_skipped', int(np.count_nonzero(siblings >= 0)))
+        del siblings
+        
+        usable_rows = np.flatnonzero(usable)
+        _, size_class, size_count = np.unique(sizes[usable_rows], return_inverse=True, return_counts=True)
+        candidates = usable_rows[size_count[size_class.reshape(-1)] > 1]
+        del usable, usable_rows, size_class
+        progress.progress(0.1)
+        
+        words = max(1, math.ceil(CONTENT_DIGESTS[self.digest]().digest_size / 8))
+        hashes = np.zeros((len(paths), words), dtype=np.uint64)
+        has_hash = np.zeros(len(paths), dtype=bool)
+        for start in range(0, len(candidates), self.CACHE_FLUSH_SIZE):
+            rows = candidates[start:start + self.CACHE_FLUSH_SIZE].tolist()
+            file_stats = {paths[row]: (int(sizes[row]), int(mtimes[row])) for row in rows}
+            cached, _ = self._load_cached_hashes(list(file_stats), self.digest, file_stats)
+            for filename, row in zip(file_stats, rows):
+                if filename in cached:
+                    hashes[row] = hex_words(cached[filename], words)
+                    has_hash[row] = True
+        cached = has_hash.copy()
+        
+        # Stage 2: head/tail sample for large uncached files sharing a size
+        to_sample = candidates[~cached[candidates] & (sizes[candidates] > 2 * SAMPLE_SIZE)]
+        samples = np.zeros((len(to_sample), words), dtype=np.uint64)
+        sampled = np.zeros(len(to_sample), dtype=bool)
+        sample_results = self._map_files(
+            lambda row: hash_file_sample(self.get_full_path(paths[row]), int(sizes[row]), self.digest),
+            (int(row) for row in to_sample)
+        )
+        with contextlib.closing(sample_results):
+            for idx, (row, sample, error) in enumerate(sample_results):
+                filename = paths[row]
+                progress.status(f"Sampling: {filename} ({idx+1}/{len(to_sample)})")
+                progress.progress(0.1 + (idx + 1) / len(to_sample) * 0.3)
+                
+                if error is not None:
+                    self.metrics.failure(filename)
+                    progress.warning(f"Error processing {filename}: {error}")
+                    continue
+                self.metrics.add('bytes_read', 2 * SAMPLE_SIZE)
+                samples[idx] = hex_words(sample, words)
+                sampled[idx] = True
+        
+        # Cached files have no sample, so uncached files of the same size must be fully hashed
+        collides = np.isin(sizes[to_sample], sizes[cached])
+        if sampled.any():
+            keys = np.column_stack([sizes[to_sample].view(np.uint64), samples])[sampled]
+            _, sample_class, sample_count = np.unique(keys, axis=0, return_inverse=True, return_counts=True)
+            collides[sampled] |= sample_count[sample_class.reshape(-1)] > 1
+            del keys, sample_class
+        needs_hash = np.zeros(len(paths), dtype=bool)
+        needs_hash[candidates[~cached[candidates] & (sizes[candidates] <= 2 * SAMPLE_SIZE)]] = True
+        needs_hash[to_sample[sampled & collides]] = True
+        to_hash = np.flatnonzero(needs_hash)
+        del needs_hash, samples, to_sample, candidates
+        
+        # Stage 3: full streaming hash for whatever still collides
+        pending = []
+        contents = self._map_files(lambda row: hash_file_contents(self.get_full_path(paths[row]), self.digest),
+                                   (int(row) for row in to_hash))
+        try:
+            for idx, (row, file_hash, error) in enumerate(contents):
+                filename = paths[row]
+                progress.status(f"Processing: {filename} ({idx+1}/{len(to_hash)})")
+                progress.progress(0.4 + (idx + 1) / len(to_hash) * 0.6)
+                
+                if error is not None:
+                    self.metrics.failure(filename)
+                    progress.warning(f"Error processing {filename}: {error}")
+                    continue
+                self.metrics.add('files_hashed')
+                self.metrics.add('bytes_read', int(sizes[row]))
+                hashes[row] = hex_words(file_hash, words)
+                has_hash[row] = True
+                pending.append((filename, int(sizes[row]), int(mtimes[row]), file_hash))
+                if len(pending) >= self.CACHE_FLUSH_SIZE:
+                    self._save_cached_hashes(self.digest, pending)
+                if self._partial_due():
+                    self._publish_partial(
+                        lambda: self._exact_results(paths, sizes, mtimes, hashes.copy(), has_hash.copy())
+                    )
+        finally:
+            # Also on cancellation, so a resumed scan starts from what is done
+            contents.close()
+            self._save_cached_hashes(self.digest, pending)
+        
+        self._enter_stage('grouping')
+        results = self._exact_results(paths, sizes, mtimes, hashes, has_hash)
+        progress.clear()
+        return results
+    
+    def _map_files(self, func, filenames):
+        """
+        Yield (filename, func(filename), None) or (filename, None, error) in
+        input order; the exact scan passes rows in place of filenames. With
+        prefetch threads the calls run on a thread pool with at most two files
+        per thread in flight, so reads overlap each other and the caller's
+        bookkeeping; the digests release the GIL while they run.
+        """
+        def call(filename):
+            try:
+                return func(filename), None
+            except Exception as e:
+                return None, e
         
-        return sorted(image_files)
+        if not self.prefetch:
+            for filename in filenames:
+                yield (filename,) + call(filename)
+            return
+        
+        filenames = iter(filenames)
+        with ThreadPoolExecutor(max_workers=self.prefetch, thread_name_prefix="prefetch") as executor:
+            try:
+                in_flight = deque((filename, executor.submit(call, filename))
+                                  for filename in islice(filenames, 2 * self.prefetch))
+                while in_flight:
+                    filename, future = in_flight.popleft()
+                    for next_name in islice(filenames, 1):
+                        in_flight.append((next_name, executor.submit(call, next_name)))
+                    yield (filename,) + future.result()
+            finally:
+                executor.shutdown(wait=True, cancel_futures=True)
     
-    def get_full_path(self, filename):
-        """Get full absolute path for a file (handles recursive paths)"""
-        return os.path.join(self.folder_path, filename)
+    def _exact_results(self, paths, sizes, mtimes, hashes, has_hash):
+        """Group the rows whose full hashes are known; groups are numbered in the order their first duplicate turns up"""
+        groups = []
+        rows = np.flatnonzero(has_hash)
+        if len(rows):
+            _, hash_class, counts = np.unique(hashes[rows], axis=0, return_inverse=True, return_counts=True)
+            hash_class = hash_class.reshape(-1)
+            shared = counts[hash_class] > 1
+            rows, hash_class = rows[shared], hash_class[shared]
+            order = np.lexsort((rows, hash_class))
+            rows, hash_class = rows[order], hash_class[order]
+            starts = np.flatnonzero(np.diff(hash_class)) + 1
+            members = sorted(np.split(rows, starts), key=lambda group: group[1]) if len(rows) else []
+            groups = [[(row, 100.0) for row in group.tolist()] for group in members]
+        return ScanResults.from_columns(paths, sizes, mtimes, hashes, has_hash, groups)
     
-    def calculate_hash_similarity(self, hash1: imagehash.ImageHash, hash2: imagehash.ImageHash, method: str = 'phash') -> float:
+    def iter_perceptual_hashes(self, image_files, method='phash', file_stats=None):
         """
-        Calculate similarity percentage between two image hashes
-        Returns: 100% for identical, 0% for completely different
+        Yield (filename, (size, mtime_ns) or None, hex hash, error) in input
+        order. image_files may be any iterable, including a directory walk that
+        is still running; it is taken in batches, with stats from file_stats
+        when given, else from get_file_stats(). Hashes from the previous scan
+        or the cache are reused, the rest are computed (by a process pool in
+        chunks when workers > 1) and written back to the cache.
+        With prefetch threads, those read each chunk's bytes ahead and the pool
+        decodes from memory, at most PREFETCH_BYTES being in flight between them.
         """
-        max_differences = {
-            'phash': 64,
-            'average_hash': 64,
-            'dhash': 64,
-            'whash': 64
-        }
+        # Reduced-size decoding can flip a bit or two, so it gets its own cache entries
+        cache_key = self.hash_key(method)
+        executor = None
+        if self.workers > 1:
+            executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=get_pool_context())
+        reader = None
+        if self.prefetch:
+            reader = ThreadPoolExecutor(max_workers=self.prefetch, thread_name_prefix="prefetch")
+        budget = ByteBudget()
+        queued = deque()
+        pending = []
+        image_files = iter(image_files)
         
-        max_diff = max_differences.get(method, 64)
-        diff = hash1 - hash2
+        try:
+            while True:
+                batch = list(islice(image_files, self.CACHE_FLUSH_SIZE))
+                if batch:
+                    if file_stats is None:
+                        batch_stats = self.get_file_stats(batch)
+                    else:
+                        batch_stats = {filename: file_stats[filename] for filename in batch if filename in file_stats}
+                    cached, _ = self._load_cached_hashes(batch, cache_key, batch_stats)
+                    misses = [filename for filename in batch if filename not in cached]
+                    futures = self._submit_perceptual_hashes(executor, misses, method, batch_stats, reader, budget)
+                    queued.append((batch, batch_stats, cached, misses, futures))
+                
+                # Keep a few batches in flight so the pool stays busy while the walk continues
+                while queued and (not batch or len(queued) > 3 or
+                                  all(future.done() for future in queued[0][4] or ())):
+                    for item in self._drain_batch(queued.popleft(), method, cache_key, pending):
+                        yield item
+                
+                if not batch:
+                    break
+        finally:
+            # Readers first, so none hands a chunk to a pool that is already shut down
+            if reader is not None:
+                reader.shutdown(wait=True, cancel_futures=True)
+            if executor is not None:
+                executor.shutdown(wait=True, cancel_futures=True)
+            self._save_cached_hashes(cache_key, pending)
+    
+    def _submit_perceptual_hashes(self, executor, image_files, method, file_stats=None, reader=None, budget=None):
+        """
+        Submit chunks of files to the pool, or to the prefetch readers when
+        there are any; None when hashing in-process. Reader chunks wait for
+        budget here, which holds the walk back while decoders fall behind.
+        """
+        if (executor is None and reader is None) or not image_files:
+            return None
+        chunk_size = self.chunk_size or max(1, min(64, len(image_files) // (self.workers * 2)))
+        futures = []
+        for start in range(0, len(image_files), chunk_size):
+            chunk = image_files[start:start + chunk_size]
+            filepaths = [self.get_full_path(filename) for filename in chunk]
+            if reader is None:
+                futures.append(executor.submit(compute_image_hashes, filepaths, method, self.fast_decode,
+                                               self.thumbnail_dir))
+                continue
+            
+            nbytes = budget.acquire(sum(file_stats[filename][0] for filename in chunk if filename in file_stats))
+            try:
+                futures.append(reader.submit(prefetch_image_hashes, filepaths, budget, nbytes, executor, method,
+                                             self.fast_decode, self.thumbnail_dir))
+            except BaseException:
+                budget.release(nbytes)
+                raise
+        return futures
+    
+    def _drain_batch(self, queued_batch, method, cache_key, pending):
+        """Yield one batch in order, waiting for its pool chunks or hashing in-process"""
+        batch, file_stats, cached, misses, futures = queued_batch
+        if futures is not None:
+            computed = (result for future in futures for result in self._chunk_results(future))
+        else:
+            computed = (compute_image_hash(self.get_full_path(filename), method, self.fast_decode, self.thumbnail_dir)
+                        for filename in misses)
         
-        similarity = 100 * (1 - (diff / max_diff))
-        return max(0, min(100, similarity))
+        for filename in batch:
+            if filename in cached:
+                yield filename, file_stats.get(filename), cached[filename], None
+                continue
+            
+            hash_hex, error = next(computed)
+            self.metrics.add('files_hashed')
+            if filename in file_stats:
+                self.metrics.add('bytes_read', file_stats[filename][0])
+            if error is not None:
+                self.metrics.failure(filename)
+            elif filename in file_stats:
+                pending.append((filename,) + file_stats[filename] + (hash_hex,))
+                if len(pending) >= self.CACHE_FLUSH_SIZE:
+                    self._save_cached_hashes(cache_key, pending)
+            yield filename, file_stats.get(filename), hash_hex, error
+    
+    @staticmethod
+    def _chunk_results(future):
+        """A chunk's hash results; a prefetch reader's future resolves to the pool future it handed the bytes to"""
+        results = future.result()
+        return results.result() if isinstance(results, Future) else results
     
-    def find_duplicates_with_similarity(self, method='phash', threshold=5, similarity_threshold=80.0):
+    def _find_similar_duplicates_with_similarity(self, image_files, method='phash', threshold=12, similarity_threshold=80.0):
         """
-        Find duplicate/similar images with similarity percentages
+        Find similar images using perceptual hashing with similarity scores.
+        Two images are linked only when their hashes differ in at most threshold
+        bits and reach similarity_threshold, so a strict threshold also narrows
+        the index search.
+
+        A cascade method (see CASCADE_METHODS) hashes every file with its cheap
+        hash, and only files with a cheap match get the confirming hash, which
+        alone decides the groups. Hash values and best matches use the cheap hash.
         """
-        image_files = self.get_image_files()
+        cheap_method, confirm_method = CASCADE_METHODS.get(method, (method, None))
+        max_diff = HASH_BITS
+        max_distance = match_radius(threshold, similarity_threshold, max_diff)
         
-        if len(image_files) == 0:
-            return {}, {}, {}, {}
+        progress = self.progress
+        progress.progress(0)
         
-        if method == 'md5':
-            return self._find_exact_duplicates_with_similarity(image_files)
-        else:
-            return self._find_similar_duplicates_with_similarity(
-                image_files, method, threshold, similarity_threshold
-            )
-    
-    def _find_exact_duplicates_with_similarity(self, image_files):
-        """Find exact duplicates using MD5 hash"""
-        hash_dict = {}
-        duplicates = defaultdict(list)
-        hash_values = {}
-        similarity_scores = defaultdict(dict)
+        # First pass: calculate all hashes (image_files may still be being listed)
+        self._enter_stage('hashing')
+        progress.info("📊 Calculating image hashes...")
+        # Files go into compact columns as they are hashed, in the order they come
+        listing = FileListing()
+        hash_column = array('Q')
+        hashed = bytearray()
+        links = {}
         
-        progress_bar = st.progress(0)
-        status_text = st.empty()
+        def record(filename, stat, link, hash_hex=None):
+            listing.append(filename, stat, link)
+            hash_column.append(int(hash_hex, 16) if hash_hex is not None else 0)
+            hashed.append(hash_hex is not None)
         
-        for idx, filename in enumerate(image_files):
-            status_text.text(f"Processing: {filename} ({idx+1}/{len(image_files)})")
-            progress_bar.progress((idx + 1) / len(image_files))
-            
-            filepath = self.get_full_path(filename)
+        known_total = len(image_files) if hasattr(image_files, '__len__') else 0
+        image_files = self._skip_link_siblings(image_files, links, record)
+        for idx, (filename, stat, hash_hex, error) in enumerate(
+                self.iter_perceptual_hashes(image_files, cheap_method)):
+            total = max(idx + 1, known_total, self.files_listed)
+            progress.status(f"Calculating: {filename[:50]}... ({idx+1}/{total})")
+            progress.progress((idx + 1) / total * 0.5)
+            record(filename, stat, links.pop(filename, None), hash_hex if error is None else None)
+            if error is not None:
+                progress.warning(f"⚠️ Error processing {filename}: {error}")
             
-            try:
-                with open(filepath, 'rb') as f:
-                    file_hash = hashlib.md5(f.read()).hexdigest()
-                    hash_values[filename] = file_hash
-                    
-                    if file_hash in hash_dict:
-                        original = hash_dict[file_hash]
-                        duplicates[original].append(filename)
-                        similarity_scores[original][filename] = 100.0
-                    else:
-                        hash_dict[file_hash] = filename
-            except Exception as e:
-                st.warning(f"Error processing {filename}: {e}")
-        
-        progress_bar.empty()
-        status_text.empty()
-        
-        return dict(duplicates), hash_values, dict(similarity_scores), {}
-    
-    def _find_similar_duplicates_with_similarity(self, image_files, method='phash', threshold=5, similarity_threshold=80.0):
-        """Find similar images using perceptual hashing with similarity scores"""
-        hashes = {}
-        file_hashes = {}
-        hash_values = {}
-        duplicates = defaultdict(list)
-        similarity_scores = defaultdict(dict)
-        
-        hash_methods = {
-            'phash': imagehash.phash,
-            'average_hash': imagehash.average_hash,
-            'dhash': imagehash.dhash,
-            'whash': imagehash.whash
-        }
-        
-        hash_func = hash_methods.get(method, imagehash.phash)
+            # A cascade's cheap matches are only candidates, so it has nothing to show early
+            if confirm_method is None and self._partial_due():
+                self._publish_partial(
+                    lambda: self._partial_perceptual_results(listing, hash_column, hashed, max_distance)
+                )
         
-        progress_bar = st.progress(0)
-        status_text = st.empty()
+        if not len(listing):
+            progress.clear()
+            return ScanResults.empty()
         
-        # First pass: calculate all hashes
-        st.info("📊 Calculating image hashes...")
-        for idx, filename in enumerate(image_files):
-            status_text.text(f"Calculating: {filename[:50]}... ({idx+1}/{len(image_files)})")
-            progress_bar.progress((idx + 1) / len(image_files) * 0.5)
-            
-            filepath = self.get_full_path(filename)
-            
-            try:
-                with Image.open(filepath) as img:
-                    if img.mode != 'RGB':
-                        img = img.convert('RGB')
-                    
-                    current_hash = hash_func(img)
-                    file_hashes[filename] = current_hash
-                    hash_values[filename] = str(current_hash)
-            except Exception as e:
-                st.warning(f"⚠️ Error processing {filename}: {e}")
+        # Group in path order so results do not depend on walk order
+        paths, sizes, mtimes, hashes, has_hash = self._sorted_columns(listing, hash_column, hashed)
+        del listing, hash_column, hashed
+        hashed_rows = np.flatnonzero(has_hash)
         
         # Second pass: find duplicates
-        st.info("🔍 Finding similar images...")
+        self._enter_stage('grouping')
+        progress.info("🔍 Finding similar images...")
         
-        for idx, (filename, current_hash) in enumerate(file_hashes.items()):
-            status_text.text(f"Comparing: {filename[:50]}... ({idx+1}/{len(file_hashes)})")
-            progress_bar.progress(0.5 + (idx + 1) / len(file_hashes) * 0.5)
-            
-            best_match = None
-            best_similarity = 0
-            
-            for existing_hash, existing_file in hashes.items():
-                similarity = self.calculate_hash_similarity(current_hash, existing_hash, method)
-                
-                if similarity > best_similarity:
-                    best_similarity = similarity
-                    best_match = existing_file
-            
-            if best_match and best_similarity >= similarity_threshold:
-                duplicates[best_match].append(filename)
-                similarity_scores[best_match][filename] = best_similarity
-            else:
-                hashes[current_hash] = filename
+        # Every pair within the threshold is a link; groups are the connected components
+        matrix = HashMatrix(hashes[hashed_rows, 0], hash_bits=max_diff)
+        
+        def on_progress(done, total):
+            progress.status(f"Searching for similar hashes... ({done}/{total})")
+            progress.progress(0.5 + done / total * 0.5)
+        
+        if confirm_method is None:
+            clusters, degree = cluster_hashes(matrix.values, max_distance, max_diff, on_progress)
+            groups = self._groups_from_clusters(clusters, degree, matrix, hashed_rows)
+        else:
+            candidates, _ = cluster_hashes(matrix.values, max_distance, max_diff, on_progress)
+            candidate_rows = np.sort(hashed_rows[np.concatenate(candidates)]) if candidates else hashed_rows[:0]
+            del candidates
+            groups = self._confirm_candidates(paths, sizes, mtimes, candidate_rows, confirm_method, max_distance)
+        progress.clear()
+        
+        # Find best match for each file, a block of rows at a time
+        self._enter_stage('best_matches')
+        
+        previous = None
+        if self.previous_scan is not None and self.previous_scan.is_compatible(self.folder_path, self.hash_key(method)):
+            previous = self.previous_scan.results
         
-        progress_bar.empty()
-        status_text.empty()
+        if previous is None:
+            neighbours, similarities = self._compute_best_matches(matrix)
+        else:
+            previous_rows, unchanged = self.previous_scan.matching_rows(paths, sizes, mtimes)
+            neighbours, similarities = self._update_best_matches(
+                hashed_rows, matrix, previous, previous_rows, unchanged
+            )
         
-        # Find best match for each file
-        best_matches = {}
+        # Back from matrix positions to rows
+        best_match = np.full(len(paths), -1, dtype=np.int64)
+        best_similarity = np.zeros(len(paths))
+        found = neighbours >= 0
+        best_match[hashed_rows[found]] = hashed_rows[neighbours[found]]
+        best_similarity[hashed_rows[found]] = similarities[found]
+        
+        return ScanResults.from_columns(paths, sizes, mtimes, hashes, has_hash, groups, best_match, best_similarity)
+    
+    def _skip_link_siblings(self, image_files, links, record):
+        """
+        Yield image_files, except further hardlinks of a file already yielded:
+        those are passed to record() unhashed, as they decode to the same hash.
+        links gets the link key of every yielded file that has one.
+        """
+        seen = set()
         for filename in image_files:
-            if filename in file_hashes:
-                best_match_file = None
-                best_match_score = 0
-                
-                for other_file, other_hash in file_hashes.items():
-                    if filename != other_file:
-                        similarity = self.calculate_hash_similarity(
-                            file_hashes[filename], 
-                            other_hash, 
-                            method
-                        )
-                        
-                        if similarity > best_match_score:
-                            best_match_score = similarity
-                            best_match_file = other_file
-                
-                if best_match_file:
-                    best_matches[filename] = {
-                        'best_match': best_match_file,
-                        'similarity': best_match_score
-                    }
+            link = self._listed_links.pop(filename, None)
+            if link is not None and link in seen:
+                self.metrics.add('hardlinks_skipped')
+                record(filename, self._listed_stats.pop(filename, None), link)
+                continue
+            if link is not None:
+                seen.add(link)
+                links[filename] = link
+            yield filename
+    
+    @staticmethod
+    def _sorted_columns(listing, hash_column, hashed):
+        """
+        (paths, sizes, mtimes, hashes, has_hash) in path order from the hashing
+        pass's columns. Of a file's hardlinks only the first path keeps a hash,
+        whichever of them was hashed, so the others stay out of the groups.
+        """
+        paths, sizes, mtimes, order = listing.sorted()
+        hashes = np.array(hash_column, dtype=np.uint64)[order].reshape(-1, 1)
+        has_hash = np.array(hashed, dtype=np.uint8)[order] > 0
+        siblings = listing.link_siblings(order)
+        later = np.flatnonzero(siblings >= 0)
+        donors = later[has_hash[later]]
+        hashes[siblings[donors]] = hashes[donors]
+        has_hash[siblings[donors]] = True
+        has_hash[later] = False
+        return paths, sizes, mtimes, hashes, has_hash
+    
+    def _partial_perceptual_results(self, listing, hash_column, hashed, max_distance):
+        """Groups among the files hashed so far, as a ScanResults without best matches"""
+        paths, sizes, mtimes, hashes, has_hash = self._sorted_columns(listing, hash_column, hashed)
+        hashed_rows = np.flatnonzero(has_hash)
+        matrix = HashMatrix(hashes[hashed_rows, 0], hash_bits=HASH_BITS)
+        clusters, degree = cluster_hashes(matrix.values, max_distance, HASH_BITS)
+        groups = self._groups_from_clusters(clusters, degree, matrix, hashed_rows)
+        return ScanResults.from_columns(paths, sizes, mtimes, hashes, has_hash, groups)
+    
+    def _groups_from_clusters(self, clusters, degree, matrix, rows):
+        """
+        Groups in ScanResults.build form from cluster_hashes() output over matrix,
+        whose positions map to result rows through rows. The member linked to the
+        most others stands for the group, ties go to the earliest.
+        """
+        groups = []
+        for members in clusters:
+            original = members[np.argmax(degree[members])]
+            similarities = matrix.similarity_row(int(matrix.values[original]), members)
+            groups.append([(int(rows[original]), 100.0)] + [
+                (int(rows[member]), float(similarity))
+                for member, similarity in zip(members.tolist(), similarities.tolist()) if member != original
+            ])
+        return groups
+    
+    def _confirm_candidates(self, paths, sizes, mtimes, candidate_rows, method, max_distance):
+        """Hash the cascade's candidate rows with the confirming method and group on that hash alone"""
+        progress = self.progress
+        self._enter_stage('confirming')
+        progress.info(f"🔬 Confirming {len(candidate_rows)} candidates with {method}...")
+        self.metrics.add('files_confirmed', len(candidate_rows))
         
-        return dict(duplicates), hash_values, dict(similarity_scores), best_matches
-
-def get_image_base64(image_path, max_size=(200, 200)):
-    """Convert image to base64 for display"""
-    try:
-        img = Image.open(image_path)
-        img.thumbnail(max_size)
+        names = [paths[row] for row in candidate_rows.tolist()]
+        file_stats = {name: (int(sizes[row]), int(mtimes[row]))
+                      for name, row in zip(names, candidate_rows.tolist()) if sizes[row] >= 0}
+        confirmed = np.zeros(len(names), dtype=np.uint64)
+        ok = np.zeros(len(names), dtype=bool)
+        for idx, (filename, _, hash_hex, error) in enumerate(
+                self.iter_perceptual_hashes(names, method, file_stats)):
+            progress.status(f"Confirming: {filename[:50]}... ({idx+1}/{len(names)})")
+            progress.progress(0.5 + (idx + 1) / len(names) * 0.5)
+            if error is None:
+                confirmed[idx] = int(hash_hex, 16)
+                ok[idx] = True
+            else:
+                progress.warning(f"⚠️ Error processing {filename}: {error}")
+        
+        self._enter_stage('grouping')
+        rows = candidate_rows[ok]
+        matrix = HashMatrix(confirmed[ok], hash_bits=HASH_BITS)
+        clusters, degree = cluster_hashes(matrix.values, max_distance, HASH_BITS)
+        return self._groups_from_clusters(clusters, degree, matrix, rows)
+    
+    def _compute_best_matches(self, matrix, rows=None):
+        """
+        Best match for the given matrix rows (all by default) against every other
+        hash. Returns (neighbours, similarities) arrays, neighbour -1 where nothing
+        is even slightly similar.
+        """
+        rows, neighbours, distances = matrix.nearest_neighbours(
+            rows, workers=min(self.workers, os.cpu_count() or 1)
+        )
+        similarities = matrix.similarity(distances)
+        neighbours = np.where(similarities > 0, neighbours, -1)
+        return neighbours, np.where(neighbours >= 0, similarities, 0.0)
+    
+    def _update_best_matches(self, hashed_rows, matrix, previous, previous_rows, unchanged):
+        """
+        Patch the previous scan's best matches instead of recomputing every row.
+        previous_rows and unchanged are ScanState.matching_rows() of the current
+        rows. Unchanged files whose best match is still there unchanged are only
+        compared against the new or modified files; everything else gets a full
+        row. Ties resolve to the earliest file, exactly as in a full computation.
+        """
+        kept = unchanged[hashed_rows]
+        fresh = np.flatnonzero(~kept)
         
-        buffered = io.BytesIO()
-        img.save(buffered, format="PNG")
-        img_str = base64.b64encode(buffered.getvalue()).decode()
+        # Matrix position of every unchanged file, by its previous row
+        previous_position = np.full(len(previous), -1, dtype=np.int64)
+        previous_position[previous_rows[hashed_rows[kept]]] = np.flatnonzero(kept)
+        best_position = np.full(len(hashed_rows), -1, dtype=np.int64)
+        if previous.best_match is not None:
+            kept_rows = previous_rows[hashed_rows[kept]]
+            previous_best = previous.best_match[kept_rows]
+            known = previous_best >= 0
+            best_position[np.flatnonzero(kept)[known]] = previous_position[previous_best[known]]
+        patch_rows = np.flatnonzero(best_position >= 0)
+        full_rows = np.flatnonzero(best_position < 0)
         
-        return img_str
+        neighbours = best_position.copy()
+        similarities = np.zeros(len(hashed_rows))
+        similarities[patch_rows] = previous.best_similarity[previous_rows[hashed_rows[patch_rows]]]
+        
+        if len(full_rows):
+            full_neighbours, full_similarities = self._compute_best_matches(matrix, full_rows)
+            neighbours[full_rows] = full_neighbours
+            similarities[full_rows] = full_similarities
+        
+        if len(fresh) and len(patch_rows):
+            for block in matrix.row_blocks(patch_rows, num_candidates=len(fresh)):
+                distances = matrix.distance_block(block, fresh)
+                nearest = distances.argmin(axis=1)
+                block_similarities = matrix.similarity(distances[np.arange(len(block)), nearest])
+                candidates = fresh[nearest]
+                better = ((block_similarities > similarities[block]) |
+                          ((block_similarities == similarities[block]) & (candidates < neighbours[block])))
+                neighbours[block[better]] = candidates[better]
+                similarities[block[better]] = block_similarities[better]
+        
+        return neighbours, similarities
+
+@st.cache_data(max_entries=4096, show_spinner=False)
+def load_thumbnail_base64(image_path, size, mtime_ns, thumbnail_dir, max_size=THUMBNAIL_SIZE):
+    """
+    Base64 thumbnail for one file version. Streamlit keeps the most recent
+    results in memory across reruns; misses read the on-disk store and only
+    decode the image when no thumbnail has been written yet.
+    """
+    path = thumbnail_path(thumbnail_dir, image_path, size, mtime_ns, max_size)
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        # Touch it so pruning keeps recently viewed thumbnails
+        os.utime(path)
+    except OSError:
+        with Image.open(image_path) as img:
+            if img.format == 'JPEG':
+                img.draft('RGB', max_size)
+            try:
+                save_thumbnail(img, path, max_size)
+                with open(path, 'rb') as f:
+                    data = f.read()
+            except OSError:
+                # Read-only cache dir: encode in memory instead
+                thumb = img.copy()
+                thumb.thumbnail(max_size, reducing_gap=2.0)
+                buffered = io.BytesIO()
+                thumb.convert('RGB').save(buffered, format=THUMBNAIL_FORMAT, quality=THUMBNAIL_QUALITY)
+                data = buffered.getvalue()
+    return base64.b64encode(data).decode()
+
+def get_image_base64(image_path, max_size=THUMBNAIL_SIZE, thumbnail_dir=None):
+    """Convert image to a base64 THUMBNAIL_MIME thumbnail for display"""
+    try:
+        stat = os.stat(image_path)
+        return load_thumbnail_base64(
+            image_path, stat.st_size, stat.st_mtime_ns, thumbnail_dir or default_thumbnail_dir(), max_size
+        )
     except:
         return None
 
-def get_file_size(filepath):
-    """Get file size in human readable format"""
+@st.cache_data(ttl=60, show_spinner=False)
+def count_image_files(folder_path):
+    """Images under folder_path; cached briefly because a running scan reruns the page every few seconds"""
+    return len(DuplicateImageFinder(folder_path, recursive=True, progress=ScanProgress()).list_image_files())
+
+def format_file_size(size):
+    """Format a byte count in human readable format"""
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024.0:
+            return f"{size:.1f} {unit}"
+        size /= 1024.0
+    return f"{size:.1f} TB"
+
+def row_size_text(results, row):
+    """Human readable size of a scanned file, from the scan's stats rather than a stat call"""
+    size = int(results.sizes[row])
+    return format_file_size(size) if size >= 0 else "N/A"
+
+def file_size_bytes(folder_path, filename, file_stats=None):
+    """Size of a scanned file, from the scan's stats when available to avoid a stat call"""
+    stat = file_stats.get(filename) if file_stats else None
+    if stat is not None:
+        return stat[0]
     try:
-        size = os.path.getsize(filepath)
-        for unit in ['B', 'KB', 'MB', 'GB']:
-            if size < 1024.0:
-                return f"{size:.1f} {unit}"
-            size /= 1024.0
-        return f"{size:.1f} TB"
-    except:
-        return "N/A"
+        return os.path.getsize(os.path.join(folder_path, filename))
+    except OSError:
+        return 0
+
+PAGE_SIZES = [10, 25, 50, 100, 250]
+
+GROUP_SORT_OPTIONS = {
+    'size': "Group size",
+    'bytes': "Reclaimable space",
+    'scan': "Scan order"
+}
+
+def paginate(items, page, page_size):
+    """Slice out one page of items, returns (page items, page, page count) with page clamped to range"""
+    num_pages = max(1, math.ceil(len(items) / page_size))
+    page = min(max(1, page), num_pages)
+    start = (page - 1) * page_size
+    return items[start:start + page_size], page, num_pages
+
+def page_controls(key, total, default_size=25):
+    """Page size and page number widgets; returns (page, page size)"""
+    size_col, page_col = st.columns(2)
+    with size_col:
+        page_size = st.selectbox(
+            "Per page:",
+            options=PAGE_SIZES,
+            index=PAGE_SIZES.index(default_size),
+            key=f"{key}_page_size"
+        )
+    
+    num_pages = max(1, math.ceil(total / page_size))
+    page_key = f"{key}_page"
+    # Clamp before the widget is created, a smaller result set or larger page size may have shrunk the range
+    if st.session_state.get(page_key, 1) > num_pages:
+        st.session_state[page_key] = num_pages
+    with page_col:
+        page = st.number_input(
+            f"Page (of {num_pages}):",
+            min_value=1,
+            max_value=num_pages,
+            step=1,
+            key=page_key
+        )
+    return int(page), page_size
+
+def similarity_report_rows(results, positions):
+    """Similarity Analysis rows for duplicates at the given positions of results.group_members"""
+    rows = []
+    for position in positions:
+        original, dup, similarity = results.pair_at(position)
+        rows.append({
+            'Original File': results.paths[original],
+            'Duplicate File': results.paths[dup],
+            'Similarity (%)': similarity,
+            'Match Level': (
+                'Exact' if similarity >= 99 else
+                'Very High' if similarity >= 90 else
+                'High' if similarity >= 80 else
+                'Medium' if similarity >= 70 else
+                'Low' if similarity >= 60 else
+                'Very Low'
+            ),
+            'Original Size': row_size_text(results, original),
+            'Duplicate Size': row_size_text(results, dup),
+            'Hash': (results.hash_hex(dup) if results.has_hash[dup] else 'N/A')[:20] + '...'
+        })
+    return rows
+
+def best_match_rows(results, rows):
+    """Best Matches rows for the given result rows"""
+    duplicate_rows = results.duplicate_rows
+    return [
+        {
+            'Image': results.paths[row],
+            'Best Match': results.paths[results.best_match[row]],
+            'Similarity (%)': float(results.best_similarity[row]),
+            'Is Duplicate?': 'Yes' if duplicate_rows[row] else 'No',
+            'File Size': row_size_text(results, row)
+        }
+        for row in rows
+    ]
 
 def create_similarity_meter(similarity):
     """Create HTML for similarity meter with new colors"""
@@ -474,6 +3011,675 @@ def get_badge_color(similarity):
     else:
         return "#FF5722"
 
+def run_scan(settings, previous_scan=None, progress=None):
+    """Run a scan with the sidebar settings, returns the session state it produces"""
+    cache = HashCache(settings['cache_path']) if settings['cache_path'] else None
+    finder = DuplicateImageFinder(
+        settings['folder_path'], 
+        recursive=settings['recursive'],
+        workers=settings['workers'],
+        cache=cache,
+        digest=settings['digest'],
+        fast_decode=settings['fast_decode'],
+        thumbnail_dir=settings['thumbnail_dir'],
+        progress=progress,
+        prefetch=settings['prefetch']
+    )
+    profiler = ScanProfiler(default_profile_path()) if settings['profile'] else None
+    
+    try:
+        with profiler if profiler is not None else contextlib.nullcontext():
+            if settings['method'] == 'md5':
+                duplicates, hash_values, similarity_scores, best_matches = finder.find_duplicates_with_similarity(
+                    method=settings['method'],
+                    previous_scan=previous_scan
+                )
+            else:
+                duplicates, hash_values, similarity_scores, best_matches = finder.find_duplicates_with_similarity(
+                    method=settings['method'], 
+                    threshold=settings['threshold'],
+                    similarity_threshold=settings['similarity_threshold'],
+                    previous_scan=previous_scan
+                )
+    finally:
+        if cache is not None:
+            cache.close()
+        if settings['thumbnail_dir']:
+            prune_thumbnails(settings['thumbnail_dir'])
+    
+    return {
+        'duplicates': duplicates,
+        'hash_values': hash_values,
+        'similarity_scores': similarity_scores,
+        'best_matches': best_matches,
+        'scan_results': finder.last_results,
+        'scan_state': finder.last_scan,
+        'scan_metrics': finder.metrics.to_dict(),
+        'scan_profile': (profiler.path, profiler.summary) if profiler is not None else None,
+        'rescan_summary': (previous_scan.change_counts(finder.last_results)
+                           if previous_scan is not None else None),
+        'scan_complete': True
+    }
+
+# Scans run one at a time; each one already spreads over every core
+SCAN_SLOTS = 1
+
+class ScanJob(ScanProgress):
+    """
+    One queued scan and everything the UI polls about it. run() calls
+    run_scan() on a ScanJobRunner thread, outside any script run, and the
+    events are recorded here instead of drawing widgets. cancel() makes the
+    next progress or status event raise ScanCancelled; the hashes computed
+    by then are in the cache, so submitting the same settings again resumes.
+    """
+    
+    # Latest messages kept for display
+    MAX_MESSAGES = 50
+    
+    def __init__(self, settings, previous_scan=None):
+        super().__init__(partials=True)
+        self.id = uuid.uuid4().hex[:12]
+        self.settings = settings
+        self.previous_scan = previous_scan
+        self.state = 'queued'
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.fraction = 0.0
+        self.status_text = ""
+        self.stage_name = None
+        self.messages = deque(maxlen=self.MAX_MESSAGES)
+        self.warnings = 0
+        self.partial_results = None
+        self.version = 0
+        self.outcome = None
+        self.error = None
+        self._cancel = threading.Event()
+    
+    @property
+    def done(self):
+        return self.state in ('done', 'failed', 'cancelled')
+    
+    @property
+    def cancel_requested(self):
+        return self._cancel.is_set()
+    
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+    
+    def cancel(self):
+        self._cancel.set()
+    
+    def run(self):
+        if self._cancel.is_set():
+            self.finished = time.time()
+            self.state = 'cancelled'
+            return
+        self.started = time.time()
+        self.state = 'running'
+        try:
+            self.outcome = run_scan(self.settings, self.previous_scan, progress=self)
+            state = 'done'
+        except ScanCancelled:
+            state = 'cancelled'
+        except Exception as e:
+            logging.getLogger(__name__).exception("Scan job %s failed", self.id)
+            self.error = e
+            state = 'failed'
+        self.finished = time.time()
+        self.state = state
+    
+    def _check_cancelled(self):
+        if self._cancel.is_set():
+            raise ScanCancelled(f"scan {self.id} cancelled")
+    
+    def progress(self, fraction):
+        self._check_cancelled()
+        self.fraction = min(1.0, max(0.0, fraction))
+        super().progress(fraction)
+    
+    def status(self, text):
+        self._check_cancelled()
+        self.status_text = text
+        super().status(text)
+    
+    def info(self, text):
+        self.messages.append(('info', text))
+        super().info(text)
+    
+    def warning(self, text):
+        self.messages.append(('warning', text))
+        self.warnings += 1
+        super().warning(text)
+    
+    def clear(self):
+        self.status_text = ""
+        super().clear()
+    
+    def stage(self, name):
+        self.stage_name = name
+        super().stage(name)
+    
+    def partial(self, results):
+        self.partial_results = results
+        self.version += 1
+        super().partial(results)
+
+class ScanJobRunner:
+    """
+    Scan queue shared by every session on the server. Jobs run on the
+    runner's own threads, max_running at a time in submission order, and
+    are looked up by id, so a page rerun or a browser refresh can find its
+    scan again. Finished jobs are kept for keep_seconds, and only the
+    keep_finished most recent ones, since each holds a full set of results.
+    """
+    
+    def __init__(self, max_running=SCAN_SLOTS, keep_seconds=3600, keep_finished=8):
+        self.executor = ThreadPoolExecutor(max_workers=max_running, thread_name_prefix="scan-job")
+        self.keep_seconds = keep_seconds
+        self.keep_finished = keep_finished
+        self.jobs = {}
+        self.lock = threading.Lock()
+    
+    def submit(self, settings, previous_scan=None) -> ScanJob:
+        job = ScanJob(settings, previous_scan)
+        with self.lock:
+            self._prune()
+            self.jobs[job.id] = job
+        self.executor.submit(job.run)
+        return job
+    
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+    
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is not None:
+            job.cancel()
+        return job
+    
+    def queue_position(self, job):
+        """Number of unfinished jobs submitted before job"""
+        with self.lock:
+            ahead = 0
+            for other in self.jobs.values():
+                if other is job:
+                    break
+                if not other.done and not other.cancel_requested:
+                    ahead += 1
+            return ahead
+    
+    def _prune(self):
+        cutoff = time.time() - self.keep_seconds
+        finished = sorted((job for job in self.jobs.values() if job.done), key=lambda job: job.finished)
+        expired = finished[:max(0, len(finished) - self.keep_finished)]
+        expired += [job for job in finished[len(expired):] if job.finished < cutoff]
+        for job in expired:
+            del self.jobs[job.id]
+
+@st.cache_resource
+def get_job_runner():
+    """The server's ScanJobRunner, shared by all sessions"""
+    return ScanJobRunner()
+
+def start_scan_job(settings, previous_scan=None):
+    """Queue a scan for this session and remember its id in the URL, so a refresh can pick it up again"""
+    job = get_job_runner().submit(settings, previous_scan)
+    st.session_state.scan_job = job.id
+    st.session_state.resume_scan = None
+    st.query_params['job'] = job.id
+    return job
+
+def collect_scan_job():
+    """
+    The session's running scan job, after showing its latest partial
+    results. A finished job's outcome is moved into session state instead
+    and None is returned; a cancelled or failed one can be resumed.
+    """
+    runner = get_job_runner()
+    reattached = False
+    if st.session_state.scan_job is None and 'job' in st.query_params:
+        st.session_state.scan_job = st.query_params['job']
+        reattached = True
+    if st.session_state.scan_job is None:
+        return None
+    
+    job = runner.get(st.session_state.scan_job)
+    if job is not None and reattached:
+        # A fresh session after a refresh: show the folder the job is scanning
+        st.session_state.folder_path = job.settings['folder_path']
+        st.session_state.recursive_search = job.settings['recursive']
+    if job is None or job.done:
+        st.session_state.scan_job = None
+        st.session_state.partial_version = 0
+        st.query_params.pop('job', None)
+    if job is None:
+        return None
+    
+    if job.done:
+        if job.state == 'done':
+            st.session_state.update(job.outcome)
+            st.toast("✅ Scan completed!")
+        else:
+            st.session_state.resume_scan = (job.settings, job.previous_scan)
+            if job.state == 'cancelled':
+                st.warning("⏹️ Scan cancelled." + (" Hashes computed so far are cached, Resume continues from there."
+                                                  if job.settings['cache_path'] else ""))
+            else:
+                st.error(f"❌ Scan failed: {job.error}")
+        return None
+    
+    if job.partial_results is not None:
+        partial = job.partial_results
+        st.session_state.duplicates = partial.duplicates
+        st.session_state.hash_values = partial.hash_values
+        st.session_state.similarity_scores = partial.similarity_scores
+        st.session_state.best_matches = partial.best_matches
+        st.session_state.scan_results = partial
+        st.session_state.scan_state = None
+    return job
+
+@st.fragment(run_every=1.0)
+def scan_progress_panel(job_id):
+    """Live progress of a scan job; reruns the whole page when new groups or the outcome arrive"""
+    runner = get_job_runner()
+    job = runner.get(job_id)
+    if job is not None and not job.done:
+        st.markdown("#### ⏳ Scan in progress")
+        if job.state == 'queued':
+            ahead = runner.queue_position(job)
+            st.progress(0.0, text=f"Queued, {ahead} scan(s) ahead" if ahead else "Starting...")
+        else:
+            st.progress(job.fraction, text=job.status_text or "Starting...")
+        details = [f"job {job.id}"]
+        if job.state == 'running':
+            details += [f"{job.stage_name or 'listing'} stage", f"{job.elapsed:.0f}s elapsed"]
+        if job.partial_results is not None:
+            details.append(f"{job.partial_results.num_groups} groups so far, best matches follow at the end")
+        if job.warnings:
+            details.append(f"{job.warnings} files could not be read")
+        st.caption(" · ".join(details))
+        
+        # Checked before any rerun below, so a click is never dropped
+        if st.button("⏹️ Cancel scan", key="cancel_scan", disabled=job.cancel_requested):
+            job.cancel()
+    
+    if job is None or job.done or job.version != st.session_state.partial_version:
+        st.session_state.partial_version = job.version if job is not None else 0
+        st.rerun(scope="app")
+
+# Selected files listed individually in File Management
+SELECTION_PREVIEW = 100
+
+@st.cache_resource
+def get_file_actions():
+    """The server's FileActions journal, settling any batch a previous run left unfinished"""
+    actions = FileActions()
+    actions.recover()
+    return actions
+
+def reset_selection_checkboxes():
+    """Drop the Visual Groups checkbox states so they are seeded from files_to_delete again"""
+    for key in [key for key in st.session_state if str(key).startswith("del_")]:
+        del st.session_state[key]
+
+def remove_from_results(filenames, files_remain=False):
+    """Patch this session's results for files that are gone or linked, rather than discarding them for a rescan"""
+    results = st.session_state.scan_results
+    if results is None:
+        return
+    rows = [row for row in map(results.paths.index, filenames) if row >= 0]
+    results = results.without(rows, files_remain)
+    st.session_state.scan_results = results
+    (st.session_state.duplicates, st.session_state.hash_values,
+     st.session_state.similarity_scores, st.session_state.best_matches) = results.as_tuple()
+    scan_state = st.session_state.scan_state
+    if scan_state is not None:
+        st.session_state.scan_state = ScanState(scan_state.folder_path, scan_state.hash_key, results)
+
+def apply_file_action(action, filenames):
+    """Apply a file action to the selected duplicates as one journaled batch, with a progress bar"""
+    originals = None
+    if action in LINK_ACTIONS:
+        results = st.session_state.scan_results
+        matches = {filename: results.original_of(results.paths.index(filename)) for filename in filenames}
+        originals = {filename: results.paths[match[0]] for filename, match in matches.items() if match is not None}
+        filenames = list(originals)
+    progress_bar = st.progress(0.0, text=f"{FILE_ACTIONS[action]}...")
+    step = max(1, len(filenames) // 100)
+    
+    def on_progress(finished, total):
+        if finished % step == 0 or finished == total:
+            progress_bar.progress(finished / total, text=f"{FILE_ACTIONS[action]}: {finished:,}/{total:,}")
+    
+    batch_id, done, errors = get_file_actions().apply(
+        st.session_state.folder_path, filenames, action, on_progress=on_progress, originals=originals
+    )
+    st.session_state.files_to_delete.difference_update(done)
+    remove_from_results(done, files_remain=action in LINK_ACTIONS)
+    st.session_state.file_action_result = (batch_id, action, len(done), errors)
+
+# Past participles for the file action outcome messages
+FILE_ACTION_DONE = {
+    'quarantine': "moved to quarantine",
+    'delete': "deleted",
+    'hardlink': "replaced with hardlinks to their original",
+    'reflink': "replaced with reflinks to their original"
+}
+
+def show_file_action_result(disabled=False):
+    """
+    Outcome of the last file action, with per-file errors and an undo for
+    quarantine and hardlinks; disabled greys the undo out while a scan runs
+    """
+    batch_id, action, count, errors = st.session_state.file_action_result
+    if count:
+        st.success(f"✅ {count:,} files {FILE_ACTION_DONE[action]}.")
+    if errors:
+        with st.expander(f"❌ {len(errors):,} files failed"):
+            st.dataframe(pd.DataFrame(errors, columns=['File', 'Error']), use_container_width=True, hide_index=True)
+    if action in ('quarantine', 'hardlink') and count:
+        undo_help = ("Move the quarantined files back where they were" if action == 'quarantine'
+                     else "Give each linked file its own copy again")
+        if st.button("↩️ Undo", key="undo_file_action", help=undo_help, disabled=disabled):
+            restored, undo_errors = get_file_actions().undo(batch_id)
+            st.session_state.file_action_result = None
+            if undo_errors:
+                st.error(f"❌ {len(undo_errors):,} files could not be restored: "
+                         + "; ".join(f"{filename}: {error}" for filename, error in undo_errors[:5]))
+            st.info(f"↩️ Restored {len(restored):,} files. Rescan to bring them back into the results.")
+
+def render_performance_panel(metrics, profile=None):
+    """Sidebar panel with the last scan's timings, throughput and cache use"""
+    hit_rate = metrics['cache_hit_rate']
+    cards = [
+        ("Scan Time", f"{metrics['wall_seconds']:.1f}s", "#008571"),
+        ("Files / Second", f"{metrics['files_per_second'] or 0:,.0f}", "#1E5050"),
+        ("Cache Hit Rate", f"{hit_rate * 100:.0f}%" if hit_rate is not None else "–", "#B8D124")
+    ]
+    for label, value, color in cards:
+        st.markdown(f"""
+        <div class="metric-card">
+            <div style="font-size: 0.9em; color: #4D4D4D;">{label}</div>
+            <div style="font-size: 1.8em; font-weight: bold; color: {color};">{value}</div>
+        </div>
+        """, unsafe_allow_html=True)
+    
+    with st.expander("Stage breakdown"):
+        st.dataframe(pd.DataFrame([
+            {
+                'Stage': stage['stage'],
+                'Wall (s)': round(stage['wall_seconds'], 3),
+                'CPU (s)': round(stage['cpu_seconds'], 3),
+                'Files/s': round(stage['files_per_second'] or 0)
+            }
+            for stage in metrics['stages']
+        ]), hide_index=True, use_container_width=True)
+        
+        counters = metrics['counters']
+        st.caption(f"Read {format_file_size(counters.get('bytes_read', 0))}, "
+                   f"hashed {counters.get('files_hashed', 0):,} files, "
+                   f"reused {counters.get('hashes_reused', 0):,} hashes")
+        if metrics['decode_failures']:
+            st.caption("Decode failures: " + ", ".join(
+                f"{extension} {count}" for extension, count in sorted(metrics['decode_failures'].items())
+            ))
+    
+    st.download_button(
+        label="📥 Export Metrics (JSON)",
+        data=json.dumps(metrics, indent=2),
+        file_name="scan_metrics.json",
+        mime="application/json",
+        use_container_width=True
+    )
+    
+    if profile is not None:
+        profile_path, summary = profile
+        with st.expander("Profile (cProfile)"):
+            st.caption(f"Saved to {profile_path}")
+            st.code(summary, language=None)
+
+class ConsoleProgress(ScanProgress):
+    """Reports to a terminal: a percentage line on a tty, ten-percent steps otherwise"""
+    
+    def __init__(self, stream=None, callback=None):
+        super().__init__(callback)
+        self.stream = stream or sys.stderr
+        self.interactive = self.stream.isatty()
+        self.percent = None
+        self.last_status = ""
+    
+    def _end_line(self):
+        if self.interactive and self.percent is not None:
+            self.stream.write("\n")
+        self.percent = None
+    
+    def progress(self, fraction):
+        percent = int(fraction * 100)
+        if percent != self.percent and (self.interactive or percent % 10 == 0):
+            self.percent = percent
+            if self.interactive:
+                self.stream.write(f"\r[{percent:3d}%] {self.last_status[:70]:<70}")
+            else:
+                self.stream.write(f"[{percent:3d}%] {self.last_status}\n")
+            self.stream.flush()
+        super().progress(fraction)
+    
+    def status(self, text):
+        self.last_status = text
+        super().status(text)
+    
+    def info(self, text):
+        self._end_line()
+        self.stream.write(f"{text}\n")
+        super().info(text)
+    
+    def warning(self, text):
+        self._end_line()
+        self.stream.write(f"warning: {text}\n")
+        super().warning(text)
+    
+    def clear(self):
+        self._end_line()
+        self.stream.flush()
+        super().clear()
+
+RESULT_FORMATS = ('json', 'csv', 'parquet')
+
+def results_to_frame(folder_path, duplicates, similarity_scores, hash_values, file_stats=None):
+    """One row per duplicate pair with raw sizes and hashes, the table behind CSV and Parquet output"""
+    rows = []
+    for group, (original, duplicates_list) in enumerate(duplicates.items(), start=1):
+        for dup in duplicates_list:
+            rows.append({
+                'group': group,
+                'original': original,
+                'duplicate': dup,
+                'similarity': similarity_scores.get(original, {}).get(dup, 0),
+                'original_size': file_size_bytes(folder_path, original, file_stats),
+                'duplicate_size': file_size_bytes(folder_path, dup, file_stats),
+                'original_hash': hash_values.get(original),
+                'duplicate_hash': hash_values.get(dup)
+            })
+    return pd.DataFrame(rows, columns=['group', 'original', 'duplicate', 'similarity', 'original_size',
+                                       'duplicate_size', 'original_hash', 'duplicate_hash'])
+
+def write_json_results(stream, folder_path, method, duplicates, hash_values, similarity_scores, best_matches):
+    """
+    Write scan results as JSON: groups with their duplicates, best matches and
+    all hashes. Entries are streamed one per line, so even huge results are
+    never materialised as one big dict.
+    """
+    def write_entries(entries):
+        first = True
+        for entry in entries:
+            stream.write(("\n    " if first else ",\n    ") + entry)
+            first = False
+        if not first:
+            stream.write("\n  ")
+    
+    stream.write(f'{{\n  "folder": {json.dumps(folder_path)},\n  "method": {json.dumps(method)},\n  "groups": [')
+    write_entries(
+        json.dumps({
+            'group': group,
+            'original': original,
+            'duplicates': [{'file': dup, 'similarity': scores.get(dup, 0)} for dup in duplicates_list]
+        }, default=float)
+        for group, ((original, duplicates_list), scores) in enumerate(
+            zip(duplicates.items(), similarity_scores.values()), start=1
+        )
+    )
+    stream.write('],\n  "best_matches": {')
+    write_entries(f"{json.dumps(filename)}: {json.dumps(match, default=float)}"
+                  for filename, match in best_matches.items())
+    stream.write('},\n  "hashes": {')
+    write_entries(f"{json.dumps(filename)}: {json.dumps(hash_value)}" for filename, hash_value in hash_values.items())
+    stream.write('}\n}\n')
+
+def write_results(finder, method, results, output='-', fmt='json'):
+    """Write scan results to a file, or stdout for '-', as JSON, CSV or Parquet"""
+    duplicates, hash_values, similarity_scores, best_matches = results
+    if fmt == 'json':
+        if output == '-':
+            write_json_results(sys.stdout, finder.folder_path, method, *results)
+        else:
+            with open(output, 'w', encoding='utf-8') as f:
+                write_json_results(f, finder.folder_path, method, *results)
+        return
+    
+    df = results_to_frame(finder.folder_path, duplicates, similarity_scores, hash_values, finder.file_stats)
+    if fmt == 'csv':
+        df.to_csv(sys.stdout if output == '-' else output, index=False)
+    else:
+        # Needs pyarrow or fastparquet, pandas raises ImportError without them
+        df.to_parquet(output, index=False)
+
+def build_arg_parser():
+    """Command line options, mirroring the sidebar settings"""
+    parser = argparse.ArgumentParser(
+        description="Find duplicate and similar images without the Streamlit UI.",
+        epilog="Run `streamlit run duplicate_finder_app.py` for the interactive app."
+    )
+    parser.add_argument("folder", help="folder to scan")
+    parser.add_argument("--method", choices=list(HASH_METHODS) + list(CASCADE_METHODS) + ['md5'], default='phash',
+                        help="perceptual hash, a cheap+confirming hash cascade, or md5 for exact duplicates "
+                             "(default: phash)")
+    parser.add_argument("--threshold", type=int, default=12,
+                        help="maximum Hamming distance in bits between grouped hashes (default: 12)")
+    parser.add_argument("--similarity", type=float, default=80.0,
+                        help="minimum similarity percentage (default: 80)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="worker processes for hashing (default: all cores)")
+    parser.add_argument("--prefetch", type=int, metavar="THREADS",
+                        help="threads reading files ahead of hashing, 0 for none (default: "
+                             f"{PREFETCH_THREADS} on network shares and FUSE mounts, else 0)")
+    parser.add_argument("--recursive", action=argparse.BooleanOptionalAction, default=True,
+                        help="include subfolders (default: yes)")
+    parser.add_argument("--cache", metavar="PATH", default=default_cache_path(),
+                        help="hash cache database (default: %(default)s)")
+    parser.add_argument("--no-cache", action="store_true", help="do not read or write the hash cache")
+    parser.add_argument("--digest", choices=list(CONTENT_DIGESTS), default='md5',
+                        help="content digest for --method md5 (default: md5)")
+    parser.add_argument("--full-decode", action="store_true",
+                        help="hash full-size colour decodes instead of the fast reduced decode")
+    parser.add_argument("--thumbnails", action="store_true",
+                        help="also prepare Visual Groups thumbnails while hashing")
+    parser.add_argument("--spill-dir", metavar="DIR",
+                        help=f"where results of {ScanResults.SPILL_ROWS:,}+ files are memory-mapped "
+                             "(default: a temporary folder next to the cache)")
+    parser.add_argument("-o", "--output", default='-', help="output file, '-' for stdout (default)")
+    parser.add_argument("-f", "--format", choices=RESULT_FORMATS,
+                        help="output format (default: from the output extension, else json)")
+    parser.add_argument("--metrics", metavar="PATH",
+                        help="write per-stage timings and counters as JSON to PATH")
+    parser.add_argument("--profile", metavar="PATH",
+                        help="profile the scan with cProfile and dump the stats to PATH")
+    parser.add_argument("--link", choices=LINK_ACTIONS,
+                        help="with --method md5, replace every duplicate with a hardlink or reflink to its "
+                             "original once its contents are verified")
+    parser.add_argument("-q", "--quiet", action="store_true", help="no progress output")
+    return parser
+
+def cli_main(argv=None):
+    """Headless entry point, returns the process exit code"""
+    parser = build_arg_parser()
+    args = parser.parse_args(argv)
+    
+    fmt = args.format
+    if fmt is None:
+        extension = os.path.splitext(args.output)[1].lower().lstrip('.')
+        fmt = extension if extension in RESULT_FORMATS else 'json'
+    if fmt == 'parquet' and args.output == '-':
+        parser.error("parquet output needs --output PATH")
+    if not os.path.isdir(args.folder):
+        parser.error(f"folder does not exist: {args.folder}")
+    if args.link and args.method != 'md5':
+        parser.error("--link needs --method md5, only exact duplicates can share their bytes")
+    
+    cache = None if args.no_cache else HashCache(args.cache)
+    finder = DuplicateImageFinder(
+        args.folder,
+        recursive=args.recursive,
+        workers=args.workers,
+        cache=cache,
+        digest=args.digest,
+        fast_decode=not args.full_decode,
+        thumbnail_dir=default_thumbnail_dir() if args.thumbnails else None,
+        progress=ScanProgress() if args.quiet else ConsoleProgress(),
+        spill_dir=args.spill_dir,
+        prefetch=args.prefetch
+    )
+    
+    start = time.perf_counter()
+    try:
+        with ScanProfiler(args.profile) if args.profile else contextlib.nullcontext():
+            results = finder.find_duplicates_with_similarity(
+                method=args.method,
+                threshold=args.threshold,
+                similarity_threshold=args.similarity
+            )
+    finally:
+        if cache is not None:
+            cache.close()
+    
+    write_results(finder, args.method, results, args.output, fmt)
+    if args.metrics:
+        with open(args.metrics, 'w', encoding='utf-8') as handle:
+            json.dump(finder.metrics.to_dict(), handle, indent=2)
+    if not args.quiet:
+        duplicates = results[0]
+        sys.stderr.write(
+            f"Found {sum(len(dups) for dups in duplicates.values())} duplicate files in {len(duplicates)} groups "
+            f"among {len(finder.file_stats or {})} images in {time.perf_counter() - start:.1f}s\n"
+        )
+    if args.link:
+        return link_duplicates(finder, args.link, quiet=args.quiet)
+    return 0
+
+def link_duplicates(finder, action, quiet=False):
+    """Replace the duplicates of finder's last exact scan with links to their originals, returns the exit code"""
+    results = finder.last_results
+    originals = {}
+    for position in results.pair_order().tolist():
+        original, dup, _ = results.pair_at(position)
+        originals[results.paths[dup]] = results.paths[original]
+    
+    file_actions = FileActions()
+    try:
+        _, done, errors = file_actions.apply(finder.folder_path, sorted(originals), action, originals=originals)
+    finally:
+        file_actions.close()
+    if not quiet:
+        reclaimed = sum(finder.file_stats[filename][0] for filename in done)
+        sys.stderr.write(f"Replaced {len(done)} duplicates with {action}s, reclaiming {format_file_size(reclaimed)}\n")
+        for filename, error in errors:
+            sys.stderr.write(f"  {filename}: {error}\n")
+    return 1 if errors else 0
+
 def main():
     # Custom header with gradient
     st.markdown("""
@@ -494,6 +3700,8 @@ def main():
         st.session_state.similarity_scores = {}
     if 'best_matches' not in st.session_state:
         st.session_state.best_matches = {}
+    if 'scan_results' not in st.session_state:
+        st.session_state.scan_results = None
     if 'folder_path' not in st.session_state:
         st.session_state.folder_path = None
     if 'files_to_delete' not in st.session_state:
@@ -502,6 +3710,26 @@ def main():
         st.session_state.recursive_search = True
     if 'scan_complete' not in st.session_state:
         st.session_state.scan_complete = False
+    if 'scan_state' not in st.session_state:
+        st.session_state.scan_state = None
+    if 'rescan_summary' not in st.session_state:
+        st.session_state.rescan_summary = None
+    if 'scan_metrics' not in st.session_state:
+        st.session_state.scan_metrics = None
+    if 'scan_job' not in st.session_state:
+        st.session_state.scan_job = None
+    if 'partial_version' not in st.session_state:
+        st.session_state.partial_version = 0
+    if 'resume_scan' not in st.session_state:
+        st.session_state.resume_scan = None
+    if 'file_action_result' not in st.session_state:
+        st.session_state.file_action_result = None
+    
+    # Scans run in the job runner across reruns; pick up partial or final results
+    job = collect_scan_job()
+    scanning = job is not None
+    if 'scan_profile' not in st.session_state:
+        st.session_state.scan_profile = None
     
     # Sidebar for configuration
     with st.sidebar:
@@ -521,8 +3749,7 @@ def main():
             
             # Count files
             try:
-                finder_temp = DuplicateImageFinder(folder_path, recursive=True)
-                total_files = len(finder_temp.get_image_files())
+                total_files = count_image_files(folder_path)
                 st.info(f"📁 Found approximately {total_files} images")
             except:
                 pass
@@ -538,13 +3765,29 @@ def main():
         )
         st.session_state.recursive_search = recursive_search
         
+        use_cache = st.checkbox(
+            "Reuse cached hashes",
+            value=True,
+            help="Skip re-hashing files whose size and modification time are unchanged since the last scan"
+        )
+        if use_cache:
+            cache_path = st.text_input(
+                "Hash cache file:",
+                value=default_cache_path(),
+                help="SQLite file that stores hashes between scans"
+            )
+        else:
+            cache_path = None
+        
         # Detection method
         st.markdown("#### 3. Detection Settings")
         method = st.selectbox(
             "Detection Method:",
-            options=['phash', 'md5', 'average_hash', 'dhash'],
+            options=['phash', 'md5', 'average_hash', 'dhash', 'whash'] + list(CASCADE_METHODS),
             index=0,
-            help="phash: Best for similar images | md5: Exact duplicates only"
+            format_func=lambda option: option.replace('+', ' → ') + " (cascade)" if option in CASCADE_METHODS else option,
+            help="phash: Best for similar images | md5: Exact duplicates only | whash: Most robust, slowest | "
+                 "cascade: cheap hash on every image, the second hash only confirms its candidates"
         )
         
         if method != 'md5':
@@ -554,8 +3797,9 @@ def main():
                     "Hash Threshold:",
                     min_value=0,
                     max_value=64,
-                    value=5,
-                    help="Lower = more strict"
+                    value=12,
+                    help="Maximum number of differing hash bits for two images to be grouped. "
+                         "Lower = more strict and faster"
                 )
             with col2:
                 similarity_threshold = st.slider(
@@ -565,69 +3809,122 @@ def main():
                     value=80,
                     help="Minimum similarity to mark as duplicate"
                 )
+            radius = match_radius(threshold, similarity_threshold)
+            st.caption(f"Grouping images within {radius} bits ({100 * (1 - radius / HASH_BITS):.1f}% similar)")
+            
+            workers = st.number_input(
+                "Worker processes:",
+                min_value=1,
+                max_value=os.cpu_count() or 1,
+                value=os.cpu_count() or 1,
+                help="Number of CPU cores used to calculate image hashes"
+            )
+            
+            fast_decode = st.checkbox(
+                "Fast decode",
+                value=True,
+                help="Decode images at reduced size in grayscale for hashing. Much faster for large photos, "
+                     "hashes may differ from a full decode by a bit or two"
+            )
+            
+            prepare_thumbnails = st.checkbox(
+                "Prepare thumbnails while hashing",
+                value=True,
+                help="Save the Visual Groups thumbnails from the decode the hashing pass already does"
+            )
         else:
             threshold = 0
             similarity_threshold = 100
+            workers = 1
+            fast_decode = False
+            prepare_thumbnails = False
+            digest = st.selectbox(
+                "Content digest:",
+                options=list(CONTENT_DIGESTS),
+                index=0,
+                help="md5 is the classic choice; blake2b and xxh3 (if the xxhash package is installed) are faster"
+            )
+        
+        on_network = bool(st.session_state.folder_path) and is_network_path(st.session_state.folder_path)
+        prefetch = st.number_input(
+            "Prefetch threads:",
+            min_value=0,
+            max_value=64,
+            value=PREFETCH_THREADS if on_network else 0,
+            help="Files read ahead in parallel while earlier ones are hashed. Pays off on network shares and "
+                 "FUSE mounts, where it is on by default; 0 reads one file at a time"
+        )
+        
+        incremental_rescan = st.checkbox(
+            "Incremental rescan",
+            value=True,
+            help="Rescan only hashes files that were added or modified since the last scan"
+        )
+        
+        profile_scan = st.checkbox(
+            "Profile scan",
+            value=False,
+            help="Record a cProfile of the next scan and show its hot paths in the Performance panel"
+        )
+        
+        st.session_state.scan_settings = {
+            'folder_path': st.session_state.folder_path,
+            'recursive': st.session_state.recursive_search,
+            'method': method,
+            'threshold': threshold,
+            'similarity_threshold': similarity_threshold,
+            'workers': int(workers),
+            'cache_path': cache_path,
+            'digest': digest if method == 'md5' else 'md5',
+            'fast_decode': fast_decode,
+            'thumbnail_dir': default_thumbnail_dir() if prepare_thumbnails else None,
+            'profile': profile_scan,
+            'prefetch': int(prefetch)
+        }
         
         # Action buttons
         st.markdown("#### 4. Actions")
         
         scan_col, clear_col = st.columns(2)
         with scan_col:
-            if st.button("🔍 Scan Now", use_container_width=True, type="primary"):
+            if st.button("🔍 Scan Now", use_container_width=True, type="primary", disabled=scanning):
                 if st.session_state.folder_path and os.path.exists(st.session_state.folder_path):
-                    with st.spinner("🚀 Scanning for duplicates..."):
-                        finder = DuplicateImageFinder(
-                            st.session_state.folder_path, 
-                            recursive=st.session_state.recursive_search
-                        )
-                        
-                        if method == 'md5':
-                            duplicates, hash_values, similarity_scores, best_matches = finder.find_duplicates_with_similarity(
-                                method=method
-                            )
-                        else:
-                            duplicates, hash_values, similarity_scores, best_matches = finder.find_duplicates_with_similarity(
-                                method=method, 
-                                threshold=threshold,
-                                similarity_threshold=similarity_threshold
-                            )
-                        
-                        st.session_state.duplicates = duplicates
-                        st.session_state.hash_values = hash_values
-                        st.session_state.similarity_scores = similarity_scores
-                        st.session_state.best_matches = best_matches
-                        st.session_state.scan_complete = True
-                    
-                    st.success("✅ Scan completed!")
+                    start_scan_job(st.session_state.scan_settings)
                     st.rerun()
                 else:
                     st.error("Please select a valid folder first!")
         
+        if st.session_state.resume_scan is not None and not scanning:
+            resume_settings, resume_previous = st.session_state.resume_scan
+            st.caption(f"Interrupted scan of `{resume_settings['folder_path']}`")
+            if st.button("▶️ Resume Scan", use_container_width=True,
+                         help="Start the interrupted scan again; files it already hashed come from the cache"):
+                start_scan_job(resume_settings, resume_previous)
+                st.rerun()
+        
         with clear_col:
             if st.session_state.scan_complete:
-                if st.button("🗑️ Clear", use_container_width=True):
+                if st.button("🗑️ Clear", use_container_width=True, disabled=scanning):
                     st.session_state.duplicates = {}
                     st.session_state.similarity_scores = {}
                     st.session_state.best_matches = {}
+                    st.session_state.scan_results = None
                     st.session_state.files_to_delete = set()
                     st.session_state.scan_complete = False
+                    st.session_state.scan_state = None
+                    st.session_state.scan_metrics = None
+                    st.session_state.scan_profile = None
+                    st.session_state.resume_scan = None
+                    st.session_state.file_action_result = None
                     st.rerun()
         
         # Statistics
         st.markdown("#### 📊 Statistics")
-        if st.session_state.duplicates:
-            total_duplicates = sum(len(dup_list) for dup_list in st.session_state.duplicates.values())
-            avg_similarity = 0
-            count = 0
-            
-            for original, scores in st.session_state.similarity_scores.items():
-                for dup, score in scores.items():
-                    avg_similarity += score
-                    count += 1
-            
-            if count > 0:
-                avg_similarity = avg_similarity / count
+        results = st.session_state.scan_results
+        if results is not None and results.num_groups:
+            total_duplicates = results.num_duplicates
+            similarities = results.duplicate_similarities()
+            avg_similarity = float(similarities.mean()) if len(similarities) else 0
             
             st.markdown(f"""
             <div class="metric-card">
@@ -639,7 +3936,7 @@ def main():
             st.markdown(f"""
             <div class="metric-card">
                 <div style="font-size: 0.9em; color: #4D4D4D;">Unique Originals</div>
-                <div style="font-size: 1.8em; font-weight: bold; color: #1E5050;">{len(st.session_state.duplicates)}</div>
+                <div style="font-size: 1.8em; font-weight: bold; color: #1E5050;">{results.num_groups}</div>
             </div>
             """, unsafe_allow_html=True)
             
@@ -651,6 +3948,10 @@ def main():
             """, unsafe_allow_html=True)
         else:
             st.info("No scan results yet")
+        
+        if st.session_state.scan_metrics:
+            st.markdown("#### ⏱️ Performance")
+            render_performance_panel(st.session_state.scan_metrics, st.session_state.scan_profile)
     
     # Main content area
     if st.session_state.folder_path:
@@ -665,34 +3966,50 @@ def main():
             """, unsafe_allow_html=True)
         
         with col2:
-            if st.button("🔄 Change Folder", use_container_width=True):
+            if st.button("🔄 Change Folder", use_container_width=True, disabled=scanning):
                 st.session_state.folder_path = None
                 st.session_state.duplicates = {}
                 st.session_state.similarity_scores = {}
                 st.session_state.best_matches = {}
+                st.session_state.scan_results = None
                 st.session_state.files_to_delete = set()
                 st.session_state.scan_complete = False
+                st.session_state.scan_state = None
+                st.session_state.scan_metrics = None
+                st.session_state.scan_profile = None
+                st.session_state.resume_scan = None
+                st.session_state.file_action_result = None
                 st.rerun()
         
         with col3:
             if st.session_state.scan_complete:
-                if st.button("🔄 Rescan", use_container_width=True):
-                    st.session_state.duplicates = {}
-                    st.session_state.similarity_scores = {}
-                    st.session_state.best_matches = {}
+                if st.button("🔄 Rescan", use_container_width=True, disabled=scanning):
+                    previous_scan = st.session_state.scan_state if incremental_rescan else None
                     st.session_state.files_to_delete = set()
+                    start_scan_job(st.session_state.scan_settings, previous_scan)
                     st.rerun()
         
-        # Display results
-        if st.session_state.duplicates:
-            total_duplicates = sum(len(dup_list) for dup_list in st.session_state.duplicates.values())
+        if scanning:
+            scan_progress_panel(job.id)
+        
+        if st.session_state.rescan_summary:
+            added, modified, removed = st.session_state.rescan_summary
+            st.caption(f"🔄 Last rescan: {added} added, {modified} modified, {removed} removed")
+        
+        if st.session_state.file_action_result:
+            show_file_action_result(disabled=scanning)
+        
+        # Display results, every tab reads the scan's ScanResults and its reverse indexes
+        results = st.session_state.scan_results
+        if st.session_state.duplicates and results is not None:
+            total_duplicates = results.num_duplicates
             
             st.markdown(f"""
             <div style="text-align: center; margin: 25px 0;">
                 <h2 style="color: #1E5050;">📋 Analysis Results</h2>
                 <p style="font-size: 1.2em;">
                     Found <span style="color: #008571; font-weight: bold;">{total_duplicates}</span> duplicate files in 
-                    <span style="color: #1E5050; font-weight: bold;">{len(st.session_state.duplicates)}</span> groups
+                    <span style="color: #1E5050; font-weight: bold;">{results.num_groups}</span> groups
                 </p>
             </div>
             """, unsafe_allow_html=True)
@@ -701,20 +4018,42 @@ def main():
             tab1, tab2, tab3, tab4 = st.tabs(["📸 Visual Groups", "📊 Similarity Analysis", "🏆 Best Matches", "🗂️ File Management"])
             
             with tab1:
-                # Display each duplicate group
-                for idx, (original, duplicates_list) in enumerate(st.session_state.duplicates.items()):
+                sort_col, pager_col = st.columns([1, 2])
+                with sort_col:
+                    group_sort = st.selectbox(
+                        "Sort groups by:",
+                        options=list(GROUP_SORT_OPTIONS),
+                        format_func=GROUP_SORT_OPTIONS.get,
+                        key="group_sort"
+                    )
+                with pager_col:
+                    page, page_size = page_controls("groups", results.num_groups, default_size=10)
+                
+                ordered_groups = results.group_order(group_sort)
+                visible_groups, page, num_pages = paginate(ordered_groups, page, page_size)
+                st.caption(f"Showing groups {(page - 1) * page_size + 1}-{(page - 1) * page_size + len(visible_groups)} "
+                           f"of {len(ordered_groups)}")
+                
+                # Display the duplicate groups on this page only; group numbers follow scan order
+                for idx in visible_groups.tolist():
+                    group_number = idx + 1
+                    group_rows = results.group_rows(idx).tolist()
+                    group_similarity = results.member_similarity[
+                        results.group_offsets[idx]:results.group_offsets[idx + 1]
+                    ].tolist()
+                    original = results.paths[group_rows[0]]
+                    duplicates_list = [results.paths[row] for row in group_rows[1:]]
                     with st.container():
                         st.markdown(f'<div class="duplicate-group">', unsafe_allow_html=True)
                         
                         col1, col2 = st.columns([3, 1])
                         with col1:
-                            st.markdown(f"### 🏷️ Group {idx+1}")
+                            st.markdown(f"### 🏷️ Group {group_number}")
                             st.markdown(f"**Original:** `{original}`")
                             st.markdown(f"*{len(duplicates_list)} duplicate(s) found*")
                         
                         with col2:
-                            original_path = os.path.join(st.session_state.folder_path, original)
-                            original_size = get_file_size(original_path)
+                            original_size = row_size_text(results, group_rows[0])
                             st.markdown(f"""
                             <div style="text-align: right;">
                                 <div style="font-size: 0.9em; color: #4D4D4D;">File Size</div>
@@ -723,12 +4062,10 @@ def main():
                             """, unsafe_allow_html=True)
                         
                         # Display similarity scores
-                        if original in st.session_state.similarity_scores:
-                            st.markdown("**Similarity Scores:**")
-                            for dup in duplicates_list:
-                                similarity = st.session_state.similarity_scores[original].get(dup, 0)
-                                meter_html, _ = create_similarity_meter(similarity)
-                                st.markdown(meter_html, unsafe_allow_html=True)
+                        st.markdown("**Similarity Scores:**")
+                        for similarity in group_similarity[1:]:
+                            meter_html, _ = create_similarity_meter(similarity)
+                            st.markdown(meter_html, unsafe_allow_html=True)
                         
                         # Display images in a grid
                         all_files = [original] + duplicates_list
@@ -744,7 +4081,7 @@ def main():
                                     # Show similarity badge for duplicates
                                     badge_html = ""
                                     if i > 0:  # Not the original
-                                        similarity = st.session_state.similarity_scores.get(original, {}).get(filename, 0)
+                                        similarity = group_similarity[i]
                                         if similarity > 0:
                                             badge_color = get_badge_color(similarity)
                                             badge_html = f'<div class="match-badge" style="background: {badge_color};">{similarity:.0f}%</div>'
@@ -752,14 +4089,14 @@ def main():
                                     st.markdown(f"""
                                     <div class="image-container">
                                         {badge_html if badge_html else ""}
-                                        <img src="data:image/png;base64,{img_base64}" 
+                                        <img src="data:{THUMBNAIL_MIME};base64,{img_base64}" 
                                              style="width:100%; height:auto; border-radius:8px;">
                                         <div style="padding:10px; font-size:0.8em;">
                                             <div style="color: {'#008571' if i==0 else '#FF5722'}; font-weight: bold; margin-bottom: 5px;">
                                                 {'🟢 Original' if i==0 else '🔴 Duplicate'}
                                             </div>
                                             <div style="word-break: break-all; font-size: 0.75em; margin-bottom: 5px;">{filename[-30:]}</div>
-                                            <span class="file-size">{get_file_size(filepath)}</span>
+                                            <span class="file-size">{row_size_text(results, group_rows[i])}</span>
                                         </div>
                                     </div>
                                     """, unsafe_allow_html=True)
@@ -767,12 +4104,13 @@ def main():
                                 # Checkbox for deletion selection - FIXED
                                 if filename != original:
                                     checkbox_key = f"del_{hash(filename)}_{idx}"  # Use hash for unique key
+                                    # Groups off the page lose their widgets, so seed the box from the selection
                                     if st.checkbox(f"Delete {filename[:20]}...", key=checkbox_key, 
+                                                  value=filename in st.session_state.files_to_delete,
                                                   help=f"Select to delete {filename}"):
                                         st.session_state.files_to_delete.add(filename)
-                                    elif filename in st.session_state.files_to_delete:
-                                        # This doesn't automatically uncheck, but the state is managed
-                                        pass
+                                    else:
+                                        st.session_state.files_to_delete.discard(filename)
                         
                         st.markdown('</div>', unsafe_allow_html=True)
                         st.markdown('</div>', unsafe_allow_html=True)
@@ -781,34 +4119,14 @@ def main():
                 # Similarity analysis
                 st.markdown("### 📈 Similarity Analysis")
                 
-                data = []
-                for original, duplicates_list in st.session_state.duplicates.items():
-                    for dup in duplicates_list:
-                        original_path = os.path.join(st.session_state.folder_path, original)
-                        dup_path = os.path.join(st.session_state.folder_path, dup)
-                        
-                        similarity = st.session_state.similarity_scores.get(original, {}).get(dup, 0)
-                        
-                        data.append({
-                            'Original File': original,
-                            'Duplicate File': dup,
-                            'Similarity (%)': similarity,
-                            'Match Level': (
-                                'Exact' if similarity >= 99 else
-                                'Very High' if similarity >= 90 else
-                                'High' if similarity >= 80 else
-                                'Medium' if similarity >= 70 else
-                                'Low' if similarity >= 60 else
-                                'Very Low'
-                            ),
-                            'Original Size': get_file_size(original_path),
-                            'Duplicate Size': get_file_size(dup_path),
-                            'Hash': st.session_state.hash_values.get(dup, 'N/A')[:20] + '...'
-                        })
+                pairs = results.pair_order()
                 
-                if data:
-                    df = pd.DataFrame(data)
-                    df = df.sort_values('Similarity (%)', ascending=False)
+                if len(pairs):
+                    page, page_size = page_controls("pairs", len(pairs), default_size=100)
+                    visible_pairs, page, num_pages = paginate(pairs, page, page_size)
+                    
+                    # Only the visible rows are built and sent to the browser
+                    df = pd.DataFrame(similarity_report_rows(results, visible_pairs.tolist()))
                     
                     # Display with custom styling
                     def color_similarity(val):
@@ -831,11 +4149,12 @@ def main():
                                     )
                                 })
                     
-                    # Export
-                    csv = df.to_csv(index=False).encode('utf-8')
+                    # Export, the full report is only built when the button is clicked
                     st.download_button(
                         label="📥 Download Similarity Report",
-                        data=csv,
+                        data=lambda: pd.DataFrame(
+                            similarity_report_rows(results, pairs.tolist())
+                        ).to_csv(index=False).encode('utf-8'),
                         file_name="similarity_report.csv",
                         mime="text/csv",
                         use_container_width=True
@@ -845,104 +4164,84 @@ def main():
                 # Best matches analysis
                 st.markdown("### 🏆 Best Match Analysis")
                 
-                if st.session_state.best_matches:
-                    best_match_data = []
-                    for filename, match_info in st.session_state.best_matches.items():
-                        filepath = os.path.join(st.session_state.folder_path, filename)
-                        
-                        best_match_data.append({
-                            'Image': filename,
-                            'Best Match': match_info['best_match'],
-                            'Similarity (%)': match_info['similarity'],
-                            'Is Duplicate?': 'Yes' if filename in [dup for dups in st.session_state.duplicates.values() for dup in dups] else 'No',
-                            'File Size': get_file_size(filepath)
-                        })
+                best_rows = results.best_match_order()
+                if len(best_rows):
+                    page, page_size = page_controls("best", len(best_rows), default_size=100)
+                    visible_rows, page, num_pages = paginate(best_rows, page, page_size)
                     
-                    if best_match_data:
-                        df_best = pd.DataFrame(best_match_data)
-                        df_best = df_best.sort_values('Similarity (%)', ascending=False)
-                        
-                        st.dataframe(df_best, use_container_width=True, hide_index=True,
-                                    column_config={
-                                        "Similarity (%)": st.column_config.NumberColumn(
-                                            format="%.1f%%"
-                                        )
-                                    })
-                        
-                        # Export
-                        csv_best = df_best.to_csv(index=False).encode('utf-8')
-                        st.download_button(
-                            label="📥 Download Best Matches",
-                            data=csv_best,
-                            file_name="best_matches.csv",
-                            mime="text/csv",
-                            use_container_width=True
-                        )
+                    df_best = pd.DataFrame(best_match_rows(results, visible_rows.tolist()))
+                    st.dataframe(df_best, use_container_width=True, hide_index=True,
+                                column_config={
+                                    "Similarity (%)": st.column_config.NumberColumn(
+                                        format="%.1f%%"
+                                    )
+                                })
+                    
+                    # Export, built only when the button is clicked
+                    st.download_button(
+                        label="📥 Download Best Matches",
+                        data=lambda: pd.DataFrame(
+                            best_match_rows(results, best_rows.tolist())
+                        ).to_csv(index=False).encode('utf-8'),
+                        file_name="best_matches.csv",
+                        mime="text/csv",
+                        use_container_width=True
+                    )
             
             with tab4:
                 # File management - FIXED DELETION
                 st.markdown("### 🗂️ File Management")
+                # Files must not move under a scan that is reading them, nor the results under a selection
+                if scanning:
+                    st.caption("⏳ File actions are available again once the scan has finished.")
                 
                 if st.session_state.files_to_delete:
                     st.warning(f"**{len(st.session_state.files_to_delete)} files selected for deletion**")
                     
-                    # Show selected files
-                    for filename in sorted(st.session_state.files_to_delete):
-                        filepath = os.path.join(st.session_state.folder_path, filename)
+                    # Show selected files, a long selection only in part
+                    selected = sorted(st.session_state.files_to_delete)
+                    for filename in selected[:SELECTION_PREVIEW]:
+                        row = results.paths.index(filename)
+                        match = results.original_of(row) if row >= 0 else None
                         
-                        # Find original and similarity
-                        original_file = None
-                        similarity_score = 0
-                        for orig, dups in st.session_state.duplicates.items():
-                            if filename in dups:
-                                original_file = orig
-                                similarity_score = st.session_state.similarity_scores.get(orig, {}).get(filename, 0)
-                                break
-                        
-                        if original_file:
+                        if match is not None:
+                            original_row, similarity_score = match
                             st.markdown(f"""
                             <div style="background: rgba(255, 87, 34, 0.1); padding: 10px; border-radius: 8px; margin: 5px 0; border-left: 4px solid #FF5722;">
                                 <strong>{filename}</strong><br>
-                                <small>Size: {get_file_size(filepath)} | Matches: {original_file} ({similarity_score:.1f}%)</small>
+                                <small>Size: {row_size_text(results, row)} | Matches: {results.paths[original_row]} ({similarity_score:.1f}%)</small>
                             </div>
                             """, unsafe_allow_html=True)
+                    if len(selected) > SELECTION_PREVIEW:
+                        st.caption(f"...and {len(selected) - SELECTION_PREVIEW:,} more")
+                    
+                    # Links only make sense for byte-identical files, i.e. after an exact scan
+                    scan_state = st.session_state.scan_state
+                    exact_scan = scan_state is not None and scan_state.hash_key in CONTENT_DIGESTS
+                    action = st.radio(
+                        "Action:",
+                        options=[action for action in FILE_ACTIONS if exact_scan or action not in LINK_ACTIONS],
+                        format_func=FILE_ACTIONS.get,
+                        horizontal=True,
+                        key="file_action",
+                        help="Quarantined files are moved into a hidden folder inside the scanned folder and can be "
+                             "restored. After an exact scan, duplicates can instead become hardlinks or "
+                             "copy-on-write reflinks to their original: every path stays, the space is reclaimed."
+                    )
                     
-                    # Confirmation and deletion - FIXED
                     col1, col2, col3 = st.columns(3)
                     
                     with col1:
-                        if st.button("✅ Confirm & Delete", type="primary", use_container_width=True):
-                            deleted_count = 0
-                            error_files = []
-                            
-                            for filename in list(st.session_state.files_to_delete):  # Create copy
-                                filepath = os.path.join(st.session_state.folder_path, filename)
-                                try:
-                                    if os.path.exists(filepath):
-                                        os.remove(filepath)
-                                        deleted_count += 1
-                                        st.session_state.files_to_delete.remove(filename)  # Remove from set
-                                    else:
-                                        error_files.append(f"{filename}: File not found")
-                                except Exception as e:
-                                    error_files.append(f"{filename}: {str(e)}")
-                            
-                            if deleted_count > 0:
-                                st.success(f"✅ Successfully deleted {deleted_count} files!")
-                                # Clear results and force rescan
-                                st.session_state.duplicates = {}
-                                st.session_state.similarity_scores = {}
-                                st.session_state.best_matches = {}
-                                st.rerun()
-                            
-                            if error_files:
-                                st.error(f"❌ Failed to delete {len(error_files)} files:")
-                                for error in error_files:
-                                    st.write(f"- {error}")
+                        label = {'delete': "✅ Confirm & Delete", 'quarantine': "✅ Confirm & Quarantine"}.get(
+                            action, "✅ Confirm & Link")
+                        if st.button(label, type="primary", use_container_width=True, disabled=scanning):
+                            apply_file_action(action, selected)
+                            st.rerun()
                     
                     with col2:
                         if st.button("🗑️ Clear Selection", use_container_width=True):
                             st.session_state.files_to_delete.clear()
+                            reset_selection_checkboxes()
                             st.rerun()
                     
                     with col3:
@@ -951,6 +4250,13 @@ def main():
                 
                 else:
                     st.info("👈 Select files to delete in the Visual Groups tab")
+                    if st.button("☑️ Select all duplicates", help=f"Select all {results.num_duplicates:,} duplicates",
+                                 disabled=scanning):
+                        st.session_state.files_to_delete = {
+                            results.paths[row] for row in np.flatnonzero(results.duplicate_rows).tolist()
+                        }
+                        reset_selection_checkboxes()
+                        st.rerun()
         
         elif st.session_state.scan_complete and not st.session_state.duplicates:
             st.markdown("""
@@ -1010,6 +4316,9 @@ def main():
         """, unsafe_allow_html=True)
 
 if __name__ == "__main__":
+    if not st.runtime.exists():
+        # Plain `python duplicate_finder_app.py FOLDER ...` runs the headless scanner
+        sys.exit(cli_main())
     try:
         from PIL import Image
         import imagehash
@@ -1017,6 +4326,6 @@ if __name__ == "__main__":
     except ImportError as e:
         st.error(f"Missing required package: {e}")
         st.info("Install required packages with:")
-        st.code("pip install pillow imagehash streamlit pandas")
+        st.code("pip install pillow imagehash streamlit pandas numpy")
     else:
         main()
\ No newline at end of file
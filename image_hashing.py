@@ -0,0 +1,143 @@
+"""
+Image decoding and perceptual hashing run by the scan's worker processes.
+
+Kept out of duplicate_finder_app.py on purpose: Streamlit executes that script
+as a fresh __main__ module on every rerun, so functions defined there stop
+pickling by name as soon as the page reruns while a scan is still submitting
+work to its pool. Functions here pickle as image_hashing.<name> however often
+the script reruns.
+"""
+import os
+import io
+import hashlib
+import threading
+
+import imagehash
+from PIL import Image, features
+
+HASH_METHODS = {
+    'phash': imagehash.phash,
+    'average_hash': imagehash.average_hash,
+    'dhash': imagehash.dhash,
+    'whash': imagehash.whash
+}
+
+# Intermediate size for fast decoding; the hashes themselves work on 32x32 or smaller
+FAST_DECODE_SIZE = (128, 128)
+
+THUMBNAIL_SIZE = (200, 200)
+# WebP is smaller at the same quality; fall back to JPEG when Pillow lacks it
+THUMBNAIL_FORMAT = 'WEBP' if features.check('webp') else 'JPEG'
+THUMBNAIL_MIME = f"image/{THUMBNAIL_FORMAT.lower()}"
+THUMBNAIL_QUALITY = 80
+
+def thumbnail_path(thumbnail_dir, filepath, size, mtime_ns, max_size=THUMBNAIL_SIZE):
+    """On-disk location of a file's thumbnail, keyed by path, size and mtime so edits get a fresh one"""
+    key = hashlib.sha1(
+        f"{os.path.abspath(filepath)}|{size}|{mtime_ns}|{max_size[0]}x{max_size[1]}".encode('utf-8', 'surrogateescape')
+    ).hexdigest()
+    return os.path.join(thumbnail_dir, key[:2], f"{key}.{THUMBNAIL_FORMAT.lower()}")
+
+def save_thumbnail(img, path, max_size=THUMBNAIL_SIZE):
+    """Write a compact thumbnail of an opened image; the original image is left untouched"""
+    thumb = img.copy()
+    thumb.thumbnail(max_size, reducing_gap=2.0)
+    if thumb.mode not in ('RGB', 'L'):
+        thumb = thumb.convert('RGBA' if THUMBNAIL_FORMAT == 'WEBP' and 'A' in thumb.getbands() else 'RGB')
+    
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write under a unique name and rename, so concurrent workers never expose a partial file
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        thumb.save(tmp_path, format=THUMBNAIL_FORMAT, quality=THUMBNAIL_QUALITY)
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def jpeg_draft_scale(image_size, requested_size):
+    """The DCT scale JPEG draft() decodes at: the largest of 8, 4, 2 and 1 that keeps both sides at least requested_size"""
+    scale = min(image_size[0] // requested_size[0], image_size[1] // requested_size[1])
+    return next((s for s in (8, 4, 2) if scale >= s), 1)
+
+def shares_thumbnail_decode(img, fast_decode=True):
+    """
+    Whether the decode for hashing also gives a full quality display
+    thumbnail: always, except for a JPEG whose reduced decode is smaller than
+    the THUMBNAIL_SIZE draft the viewer would decode it at.
+    """
+    return (not fast_decode or img.format != 'JPEG'
+            or jpeg_draft_scale(img.size, FAST_DECODE_SIZE) == jpeg_draft_scale(img.size, THUMBNAIL_SIZE))
+
+def prepare_image_for_hashing(img, fast_decode=True, thumbnail_to=None):
+    """
+    Decode an opened image for hashing. Fast mode lets JPEG decode straight to
+    grayscale at a reduced DCT scale, and shrinks other formats with
+    Image.reduce before the hash resamples them.
+    If thumbnail_to is a path, a display thumbnail is saved from the same decode,
+    which shares_thumbnail_decode() must allow.
+    """
+    if fast_decode and img.format == 'JPEG':
+        # With a thumbnail to save, decode YCbCr at the same scale: its Y plane is
+        # exactly what the grayscale draft yields, so hashes do not change
+        img.draft('YCbCr' if thumbnail_to is not None and img.mode == 'RGB' else 'L', FAST_DECODE_SIZE)
+    if thumbnail_to is not None:
+        try:
+            save_thumbnail(img, thumbnail_to)
+        except OSError:
+            pass
+    
+    if not fast_decode:
+        return img.convert('RGB') if img.mode != 'RGB' else img
+    
+    if img.mode == 'YCbCr':
+        img = img.getchannel('Y')
+    elif img.mode != 'L':
+        img = img.convert('L')
+    img.thumbnail(FAST_DECODE_SIZE, reducing_gap=2.0)
+    return img
+
+def compute_image_hash(filepath, method='phash', fast_decode=True, thumbnail_dir=None, content=None):
+    """
+    Decode one image and compute its perceptual hash.
+    Returns (hex hash, None) or (None, error message).
+    With a thumbnail_dir, a missing display thumbnail is written on the way.
+    content is an optional (bytes, size, mtime_ns) already read by a prefetch
+    reader, decoded from memory instead of opening the file again.
+    """
+    hash_func = HASH_METHODS.get(method, imagehash.phash)
+    try:
+        thumbnail_to = None
+        if thumbnail_dir is not None:
+            if content is not None:
+                size, mtime_ns = content[1:]
+            else:
+                stat = os.stat(filepath)
+                size, mtime_ns = stat.st_size, stat.st_mtime_ns
+            thumbnail_to = thumbnail_path(thumbnail_dir, filepath, size, mtime_ns)
+            if os.path.exists(thumbnail_to):
+                thumbnail_to = None
+        
+        with Image.open(io.BytesIO(content[0]) if content is not None else filepath) as img:
+            if thumbnail_to is not None and not shares_thumbnail_decode(img, fast_decode):
+                # Decode the thumbnail at the viewer's scale, so it does not depend on who wrote it first
+                with Image.open(io.BytesIO(content[0]) if content is not None else filepath) as full:
+                    full.draft('RGB', THUMBNAIL_SIZE)
+                    try:
+                        save_thumbnail(full, thumbnail_to)
+                    except OSError:
+                        pass
+                thumbnail_to = None
+            img = prepare_image_for_hashing(img, fast_decode, thumbnail_to)
+            
+            return str(hash_func(img)), None
+    except Exception as e:
+        return None, str(e)
+
+def compute_image_hashes(filepaths, method='phash', fast_decode=True, thumbnail_dir=None, contents=None):
+    """Hash a chunk of files in one worker task, returns a list of compute_image_hash results"""
+    if contents is None:
+        contents = [None] * len(filepaths)
+    return [compute_image_hash(filepath, method, fast_decode, thumbnail_dir, content)
+            for filepath, content in zip(filepaths, contents)]
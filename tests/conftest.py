@@ -0,0 +1,41 @@
+import os
+import sys
+import random
+
+import numpy as np
+import pytest
+from PIL import Image
+
+# The app is a script, not a package: import it from the repository root like the benchmark does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def make_image(path, seed, size=(160, 120)):
+    """A smooth random colour field, distinct enough between seeds for perceptual hashes"""
+    rng = random.Random(seed)
+    field = np.array([[[rng.randrange(256) for _ in range(3)] for _ in range(5)] for _ in range(4)], dtype=np.uint8)
+    img = Image.fromarray(field).resize(size, Image.BICUBIC)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    img.save(path, quality=90)
+    return img
+
+def make_files(root, contents):
+    """Write each filename's bytes under root, creating subfolders"""
+    for filename, data in contents.items():
+        path = root / filename
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+    return str(root)
+
+@pytest.fixture
+def image_folder(tmp_path):
+    """Six distinct images, a byte copy of two of them in a subfolder and a resized copy of one"""
+    root = tmp_path / "images"
+    for seed in range(6):
+        make_image(str(root / f"img{seed}.jpg"), seed)
+    sub = root / "sub"
+    sub.mkdir()
+    for seed in (0, 1):
+        (sub / f"img{seed}_copy.jpg").write_bytes((root / f"img{seed}.jpg").read_bytes())
+    with Image.open(root / "img2.jpg") as img:
+        img.resize((120, 90)).save(sub / "img2_small.png")
+    return str(root)
@@ -0,0 +1,74 @@
+import random
+
+import numpy as np
+import pytest
+
+import duplicate_finder_app as app
+
+def planted_hashes(count, seed):
+    """Random 64-bit hashes, each later one often a few bit flips away from an earlier one or identical to it"""
+    rng = random.Random(seed)
+    values = []
+    for _ in range(count):
+        if values and rng.random() < 0.6:
+            value = rng.choice(values)
+            for bit in rng.sample(range(64), rng.randint(0, 14)):
+                value ^= 1 << bit
+        else:
+            value = rng.getrandbits(64)
+        values.append(value)
+    return values
+
+def brute_force_pairs(values, max_distance):
+    return {(i, j) for i in range(len(values)) for j in range(i + 1, len(values))
+            if bin(values[i] ^ values[j]).count('1') <= max_distance}
+
+def brute_force_clusters(values, max_distance):
+    """(components of two or more as sorted lists, degree of each position)"""
+    pairs = brute_force_pairs(values, max_distance)
+    label = list(range(len(values)))
+    
+    def root(item):
+        while label[item] != item:
+            item = label[item]
+        return item
+    
+    degree = [0] * len(values)
+    for i, j in pairs:
+        degree[i] += 1
+        degree[j] += 1
+        label[max(root(i), root(j))] = min(root(i), root(j))
+    components = {}
+    for item in range(len(values)):
+        components.setdefault(root(item), []).append(item)
+    return sorted(group for group in components.values() if len(group) > 1), degree
+
+@pytest.mark.parametrize('max_distance', [0, 3, 7, 12])
+def test_near_pairs_match_brute_force(max_distance):
+    values = planted_hashes(400, seed=max_distance)
+    # near_pairs works on distinct hashes, as cluster_hashes hands them over
+    unique = sorted(set(values))
+    found = set()
+    for first, second in app.near_pairs(np.array(unique, dtype=np.uint64), max_distance, chunk_size=64):
+        chunk = list(zip(first.tolist(), second.tolist()))
+        assert all(i < j for i, j in chunk)
+        assert not found & set(chunk), "a pair was reported twice"
+        found.update(chunk)
+    assert found == brute_force_pairs(unique, max_distance)
+
+# At 12 bits and more the multi-index would probe more buckets than there are hashes, so the dense scan runs
+@pytest.mark.parametrize('max_distance', [0, 5, 12, 40])
+def test_cluster_hashes_match_brute_force(max_distance):
+    values = planted_hashes(300, seed=100 + max_distance)
+    groups, degree = app.cluster_hashes(np.array(values, dtype=np.uint64), max_distance)
+    expected_groups, expected_degree = brute_force_clusters(values, max_distance)
+    
+    assert [group.tolist() for group in groups] == expected_groups
+    assert degree.tolist() == expected_degree
+
+def test_union_find_merges_arrays_of_pairs():
+    links = app.UnionFind(8)
+    links.union(np.array([7, 1, 3]), np.array([6, 2, 1]))
+    links.union(np.array([5]), np.array([5]))
+    roots = links.roots()
+    assert roots.tolist() == [0, 1, 1, 1, 4, 5, 6, 6]
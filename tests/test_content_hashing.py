@@ -0,0 +1,43 @@
+import hashlib
+import os
+
+import pytest
+
+import duplicate_finder_app as app
+
+EXPECTED = {
+    'md5': hashlib.md5,
+    'blake2b': lambda data: hashlib.blake2b(data, digest_size=16)
+}
+
+@pytest.mark.parametrize('size', [0, 1, app.READ_CHUNK_SIZE - 1, app.READ_CHUNK_SIZE + 1, 3 * app.READ_CHUNK_SIZE])
+@pytest.mark.parametrize('digest', ['md5', 'blake2b'])
+def test_contents_and_samples_match_hashlib(tmp_path, size, digest):
+    data = os.urandom(size)
+    path = tmp_path / "file.bin"
+    path.write_bytes(data)
+    
+    assert app.hash_file_contents(str(path), digest) == EXPECTED[digest](data).hexdigest()
+    tail = data[max(app.SAMPLE_SIZE, size - app.SAMPLE_SIZE):] if size > app.SAMPLE_SIZE else b''
+    assert app.hash_file_sample(str(path), size, digest) == EXPECTED[digest](data[:app.SAMPLE_SIZE] + tail).hexdigest()
+
+def test_a_file_truncated_while_hashed_comes_up_short(tmp_path, monkeypatch):
+    # Hashed from a memory map, the next page would raise SIGBUS and kill the process
+    path = tmp_path / "shrinking.bin"
+    data = os.urandom(4 * app.READ_CHUNK_SIZE)
+    path.write_bytes(data)
+    
+    class Truncating:
+        def __init__(self):
+            self.inner = hashlib.md5()
+        
+        def update(self, view):
+            self.inner.update(view)
+            os.truncate(path, app.READ_CHUNK_SIZE + 10)
+        
+        def hexdigest(self):
+            return self.inner.hexdigest()
+    
+    monkeypatch.setitem(app.CONTENT_DIGESTS, 'truncating', Truncating)
+    expected = hashlib.md5(data[:app.READ_CHUNK_SIZE + 10]).hexdigest()
+    assert app.hash_file_contents(str(path), 'truncating') == expected
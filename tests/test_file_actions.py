@@ -0,0 +1,82 @@
+import os
+
+import pytest
+
+import duplicate_finder_app as app
+
+from conftest import make_files
+
+def make_actions(tmp_path):
+    # One worker, so files are handled in order
+    return app.FileActions(str(tmp_path / "journal.sqlite3"), workers=1)
+
+def journal(actions, batch_id):
+    return {path: (state, error) for path, state, error in actions.conn.execute(
+        "SELECT path, state, error FROM batch_files WHERE batch = ?", (batch_id,)
+    )}
+
+def test_quarantine_and_undo(tmp_path):
+    folder = make_files(tmp_path / "photos", {'a.jpg': b'a', 'sub/b.jpg': b'b', 'c.jpg': b'c'})
+    actions = make_actions(tmp_path)
+    
+    batch_id, done, errors = actions.apply(folder, ['a.jpg', 'sub/b.jpg', 'gone.jpg'], 'quarantine')
+    assert done == ['a.jpg', 'sub/b.jpg']
+    assert errors == [('gone.jpg', "File not found")]
+    assert not os.path.exists(os.path.join(folder, 'a.jpg'))
+    with open(actions.quarantine_path(folder, batch_id, 'sub/b.jpg'), 'rb') as f:
+        assert f.read() == b'b'
+    
+    restored, undo_errors = actions.undo(batch_id)
+    assert sorted(restored) == ['a.jpg', 'sub/b.jpg'] and undo_errors == []
+    with open(os.path.join(folder, 'sub', 'b.jpg'), 'rb') as f:
+        assert f.read() == b'b'
+    assert not os.path.exists(os.path.join(folder, app.QUARANTINE_DIRNAME, str(batch_id)))
+    actions.close()
+
+def test_deleted_files_cannot_be_restored(tmp_path):
+    folder = make_files(tmp_path / "photos", {'a.jpg': b'a', 'b.jpg': b'b'})
+    actions = make_actions(tmp_path)
+    
+    batch_id, done, errors = actions.apply(folder, ['a.jpg'], 'delete')
+    assert done == ['a.jpg'] and errors == []
+    assert sorted(os.listdir(folder)) == ['b.jpg']
+    with pytest.raises(ValueError):
+        actions.undo(batch_id)
+    actions.close()
+
+def test_recover_settles_a_batch_interrupted_mid_way(tmp_path, monkeypatch):
+    folder = make_files(tmp_path / "photos", {f'{name}.jpg': name.encode() for name in 'abcde'})
+    actions = make_actions(tmp_path)
+    
+    class Crash(BaseException):
+        pass
+    
+    move_file = app.move_file
+    moved = []
+    
+    def crash_on_third(source, target):
+        if len(moved) == 2:
+            raise Crash()
+        move_file(source, target)
+        moved.append(source)
+    
+    monkeypatch.setattr(app, 'move_file', crash_on_third)
+    with pytest.raises(Crash):
+        actions.apply(folder, ['a.jpg', 'b.jpg', 'c.jpg', 'd.jpg'], 'quarantine')
+    actions.close()
+    monkeypatch.setattr(app, 'move_file', move_file)
+    
+    # A fresh process finds the batch unfinished and settles it from what is on disk
+    actions = make_actions(tmp_path)
+    (batch_id,) = [row[0] for row in actions.conn.execute("SELECT id FROM batches WHERE finished = 0")]
+    assert actions.recover() == 4
+    assert journal(actions, batch_id) == {
+        'a.jpg': ('done', None), 'b.jpg': ('done', None),
+        'c.jpg': ('failed', "Interrupted"), 'd.jpg': ('failed', "Interrupted")
+    }
+    assert actions.recover() == 0
+    
+    restored, errors = actions.undo(batch_id)
+    assert sorted(restored) == ['a.jpg', 'b.jpg'] and errors == []
+    assert sorted(set(os.listdir(folder)) - {app.QUARANTINE_DIRNAME}) == ['a.jpg', 'b.jpg', 'c.jpg', 'd.jpg', 'e.jpg']
+    actions.close()
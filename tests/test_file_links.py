@@ -0,0 +1,71 @@
+import os
+
+import pytest
+
+import duplicate_finder_app as app
+
+from conftest import make_files
+
+def test_hardlinks_and_undo(tmp_path):
+    folder = make_files(tmp_path / "photos", {'orig.jpg': b'same bytes', 'dup.jpg': b'same bytes',
+                                              'other.jpg': b'different!'})
+    # One worker, so files are handled in order
+    actions = app.FileActions(str(tmp_path / "journal.sqlite3"), workers=1)
+    originals = {'dup.jpg': 'orig.jpg', 'other.jpg': 'orig.jpg'}
+    
+    batch_id, done, errors = actions.apply(folder, ['dup.jpg', 'other.jpg'], 'hardlink', originals=originals)
+    assert done == ['dup.jpg']
+    assert errors == [('other.jpg', "Contents differ from the original")]
+    assert os.path.samefile(os.path.join(folder, 'dup.jpg'), os.path.join(folder, 'orig.jpg'))
+    
+    _, done, errors = actions.apply(folder, ['dup.jpg'], 'hardlink', originals=originals)
+    assert done == [] and errors == [('dup.jpg', "Already a hardlink of its original")]
+    
+    restored, errors = actions.undo(batch_id)
+    assert restored == ['dup.jpg'] and errors == []
+    assert not os.path.samefile(os.path.join(folder, 'dup.jpg'), os.path.join(folder, 'orig.jpg'))
+    with open(os.path.join(folder, 'dup.jpg'), 'rb') as f:
+        assert f.read() == b'same bytes'
+    actions.close()
+
+def test_replace_with_link_checks_contents_first(tmp_path):
+    original, same, differs, shorter = (tmp_path / name for name in ("orig.jpg", "same.jpg", "differs.jpg",
+                                                                       "shorter.jpg"))
+    original.write_bytes(b'x' * 1000 + b'a')
+    same.write_bytes(b'x' * 1000 + b'a')
+    # Same size, differs only past the first chunk
+    differs.write_bytes(b'x' * 1000 + b'b')
+    shorter.write_bytes(b'x' * 1000)
+    
+    assert app.same_contents(str(same), str(original), chunk_size=64)
+    assert not app.same_contents(str(differs), str(original), chunk_size=64)
+    assert not app.same_contents(str(shorter), str(original), chunk_size=64)
+    
+    with pytest.raises(ValueError):
+        app.replace_with_link(str(differs), str(original))
+    assert differs.read_bytes() == b'x' * 1000 + b'b'
+    assert sorted(os.listdir(tmp_path)) == ['differs.jpg', 'orig.jpg', 'same.jpg', 'shorter.jpg']
+    
+    assert app.replace_with_link(str(same), str(original))
+    assert os.path.samefile(same, original)
+    assert not app.replace_with_link(str(same), str(original))
+
+@pytest.mark.parametrize('method', ['phash', 'md5'])
+def test_a_scan_treats_hardlinks_as_one_file(image_folder, method):
+    def scan():
+        finder = app.DuplicateImageFinder(image_folder, recursive=True, workers=1, progress=app.ScanProgress())
+        duplicates, hash_values, similarity_scores, _ = finder.find_duplicates_with_similarity(method=method)
+        return finder, dict(duplicates), dict(hash_values), dict(similarity_scores)
+    
+    _, duplicates, hash_values, scores = scan()
+    for source, link in [('img3.jpg', 'sub/img3_link.jpg'), ('img3.jpg', 'a_link.jpg'), ('img0.jpg', 'img0_link.jpg')]:
+        os.link(os.path.join(image_folder, source), os.path.join(image_folder, link))
+    finder, linked_duplicates, linked_hash_values, linked_scores = scan()
+    
+    # The first path of each file is the one scanned, the links are neither read nor grouped
+    assert (linked_duplicates, linked_scores) == (duplicates, scores)
+    if 'img3.jpg' in hash_values:
+        hash_values['a_link.jpg'] = hash_values.pop('img3.jpg')
+    assert linked_hash_values == hash_values
+    assert finder.metrics.counters['hardlinks_skipped'] == 3
+    assert finder.metrics.counters['files_hashed'] == len(hash_values)
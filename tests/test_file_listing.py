@@ -0,0 +1,37 @@
+import random
+
+import numpy as np
+
+import duplicate_finder_app as app
+
+def random_paths(count, seed):
+    rng = random.Random(seed)
+    # Shared prefixes longer than one radix round, multi-byte characters and undecodable bytes
+    parts = ['album_2023_holiday/', 'a', 'b', '/', 'é', '中', '\udcff', 'IMG_0001', '.jpg']
+    return [''.join(rng.choice(parts) for _ in range(rng.randint(1, 8))) for _ in range(count)]
+
+def test_sorted_listing_matches_sorting_the_strings():
+    paths = random_paths(3000, seed=1)
+    paths += paths[:20]
+    listing = app.FileListing()
+    for idx, path in enumerate(paths):
+        listing.append(path, (idx, 10 * idx) if idx % 3 else None)
+    
+    table, sizes, mtimes, order = listing.sorted()
+    expected = sorted(paths, key=lambda path: path.encode('utf-8', 'surrogateescape'))
+    assert list(table) == expected
+    assert [paths[row] for row in order.tolist()] == expected
+    assert sizes.tolist() == [row if row % 3 else -1 for row in order.tolist()]
+    assert mtimes.tolist() == [10 * row if row % 3 else -1 for row in order.tolist()]
+
+def test_empty_listing():
+    table, sizes, mtimes, order = app.FileListing().sorted()
+    assert len(table) == len(sizes) == len(mtimes) == len(order) == 0
+
+def test_rows_of_finds_every_path_of_another_table():
+    table = app.PathTable.from_paths(sorted(set(random_paths(2000, seed=2))))
+    probes = [table[row] for row in range(0, len(table), 7)] + ['missing.jpg', 'album_2023_holiday/x']
+    rows = table.rows_of(app.PathTable.from_paths(probes))
+    assert rows.tolist() == [table.index(path) for path in probes]
+    assert rows[-2:].tolist() == [-1, -1]
+    assert np.array_equal(app.PathTable.from_paths([]).rows_of(table), np.full(len(table), -1))
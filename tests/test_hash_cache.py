@@ -0,0 +1,65 @@
+import itertools
+
+import duplicate_finder_app as app
+
+def make_cache(tmp_path, **kwargs):
+    return app.HashCache(str(tmp_path / "cache.sqlite3"), **kwargs)
+
+def test_lookup_returns_only_fresh_rows(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.store('/photos', 'phash', [('a.jpg', 10, 100, 'aa'), ('b.jpg', 20, 200, 'bb'), ('c.jpg', 30, 300, 'cc')])
+    
+    # b was rewritten (mtime moved), c changed size, d was never hashed
+    hits = cache.lookup('/photos', 'phash', {'a.jpg': (10, 100), 'b.jpg': (20, 201), 'c.jpg': (31, 300),
+                                              'd.jpg': (40, 400)})
+    assert hits == {'a.jpg': 'aa'}
+    assert (cache.hits, cache.misses) == (1, 3)
+    cache.close()
+
+def test_rows_are_kept_apart_by_folder_and_method(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.store('/photos', 'phash', [('a.jpg', 10, 100, 'phash-a')])
+    cache.store('/photos', 'md5', [('a.jpg', 10, 100, 'md5-a')])
+    cache.store('/other', 'phash', [('a.jpg', 10, 100, 'other-a')])
+    
+    assert cache.lookup('/photos', 'phash', {'a.jpg': (10, 100)}) == {'a.jpg': 'phash-a'}
+    assert cache.lookup('/photos', 'md5', {'a.jpg': (10, 100)}) == {'a.jpg': 'md5-a'}
+    assert cache.lookup('/other', 'dhash', {'a.jpg': (10, 100)}) == {}
+    cache.close()
+
+def test_lookup_reads_only_the_asked_paths_in_chunks(tmp_path):
+    cache = make_cache(tmp_path)
+    entries = [(f"f{i}.jpg", i, i, f"{i:016x}") for i in range(2 * app.HashCache.LOOKUP_CHUNK + 7)]
+    cache.store('/photos', 'phash', entries)
+    
+    batch = {path: (size, mtime_ns) for path, size, mtime_ns, _ in entries[3:3 + app.HashCache.LOOKUP_CHUNK + 2]}
+    assert cache.lookup('/photos', 'phash', batch) == {path: f"{size:016x}" for path, (size, _) in batch.items()}
+    assert cache.lookup('/photos', 'phash', {}) == {}
+    cache.close()
+
+def test_invalidate_and_prune_missing(tmp_path):
+    cache = make_cache(tmp_path)
+    stats = {'a.jpg': (1, 1), 'b.jpg': (2, 2), 'c.jpg': (3, 3)}
+    cache.store('/photos', 'phash', [(path, size, mtime, path) for path, (size, mtime) in stats.items()])
+    
+    cache.invalidate('/photos', ['a.jpg'])
+    assert set(cache.lookup('/photos', 'phash', stats)) == {'b.jpg', 'c.jpg'}
+    assert cache.prune_missing('/photos', ['c.jpg']) == 1
+    assert set(cache.lookup('/photos', 'phash', stats)) == {'c.jpg'}
+    cache.invalidate('/photos')
+    assert cache.lookup('/photos', 'phash', stats) == {}
+    cache.close()
+
+def test_eviction_drops_least_recently_used_rows(tmp_path, monkeypatch):
+    # A clock that always moves, so rows written back to back never tie on last_used
+    ticks = itertools.count(1)
+    monkeypatch.setattr(app.time, 'time', lambda: float(next(ticks)))
+    cache = make_cache(tmp_path, max_entries=2)
+    cache.store('/photos', 'phash', [('old.jpg', 1, 1, 'o')])
+    cache.store('/photos', 'phash', [('mid.jpg', 2, 2, 'm'), ('new.jpg', 3, 3, 'n')])
+    cache.lookup('/photos', 'phash', {'old.jpg': (1, 1)})
+    
+    assert cache.evict() == 1
+    remaining = cache.lookup('/photos', 'phash', {'old.jpg': (1, 1), 'mid.jpg': (2, 2), 'new.jpg': (3, 3)})
+    assert set(remaining) == {'old.jpg', 'new.jpg'}
+    cache.close()
@@ -0,0 +1,35 @@
+import os
+import shutil
+
+import pytest
+from PIL import Image
+
+import duplicate_finder_app as app
+
+from conftest import make_image
+
+def scan(folder, method, previous_scan=None):
+    finder = app.DuplicateImageFinder(folder, recursive=True, workers=1, progress=app.ScanProgress())
+    results = finder.find_duplicates_with_similarity(method=method, previous_scan=previous_scan)
+    return finder, [dict(view) for view in results]
+
+@pytest.mark.parametrize('method', ['phash', 'md5'])
+def test_incremental_rescan_matches_a_full_scan(image_folder, method):
+    finder, _ = scan(image_folder, method)
+    
+    # One file removed, one copy added, one rewritten with other contents, one new image
+    os.remove(os.path.join(image_folder, 'sub', 'img1_copy.jpg'))
+    shutil.copy(os.path.join(image_folder, 'img3.jpg'), os.path.join(image_folder, 'img3_copy.jpg'))
+    with Image.open(os.path.join(image_folder, 'img4.jpg')) as img:
+        img.rotate(90).save(os.path.join(image_folder, 'img5.jpg'))
+    make_image(os.path.join(image_folder, 'sub', 'img6.jpg'), 6)
+    
+    incremental, incremental_results = scan(image_folder, method, previous_scan=finder.last_scan)
+    _, full_results = scan(image_folder, method)
+    
+    assert incremental_results == full_results
+    assert finder.last_scan.change_counts(incremental.last_results) == (2, 1, 1)
+    # Only the files that changed were read again
+    counters = incremental.metrics.counters
+    assert counters['hashes_from_previous_scan'] > 0
+    assert counters['files_hashed'] == (3 if method == 'phash' else 2)
@@ -0,0 +1,38 @@
+import os
+import pickle
+import sys
+import time
+import types
+
+from streamlit.testing.v1 import AppTest
+
+import duplicate_finder_app as app
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'duplicate_finder_app.py')
+
+def test_worker_functions_pickle_after_main_is_replaced(monkeypatch):
+    # Streamlit reruns the script as a brand new __main__ while a background job keeps submitting work
+    monkeypatch.setitem(sys.modules, '__main__', types.ModuleType('__main__'))
+    assert pickle.loads(pickle.dumps(app.compute_image_hashes)) is app.compute_image_hashes
+
+def test_background_scan_with_a_pool_survives_reruns(image_folder, monkeypatch):
+    # The worker input is capped at the core count, allow a pool on single-core machines too
+    monkeypatch.setattr(os, 'cpu_count', lambda: 4)
+    at = AppTest.from_file(APP_PATH, default_timeout=120)
+    at.run()
+    at.sidebar.text_input[0].input(image_folder).run()
+    at.sidebar.text_input[1].input('')
+    [box for box in at.sidebar.checkbox if box.label == 'Prepare thumbnails while hashing'][0].uncheck()
+    [number for number in at.sidebar.number_input if number.label == 'Worker processes:'][0].set_value(2)
+    at.run()
+    
+    # Scan Now starts the job and reruns, every poll after that executes the script as a new __main__
+    [button for button in at.sidebar.button if 'Scan Now' in button.label][0].click().run()
+    deadline = time.monotonic() + 120
+    while at.session_state['scan_job'] is not None and time.monotonic() < deadline:
+        time.sleep(0.2)
+        at.run()
+    
+    assert [error.value for error in at.error] == []
+    assert at.session_state['scan_complete']
+    assert len(at.session_state['duplicates']) == 3
@@ -0,0 +1,25 @@
+import os
+
+import pytest
+from PIL import Image
+
+import image_hashing
+
+from conftest import make_image
+
+@pytest.mark.parametrize('size', [(1100, 1100), (3200, 2400), (900, 260), (150, 100)])
+def test_hashing_writes_the_thumbnail_the_viewer_would(tmp_path, size):
+    path = str(tmp_path / "photo.jpg")
+    make_image(path, 1, size)
+    thumbnail_dir = str(tmp_path / "thumbnails")
+    
+    # Writing the thumbnail on the way must not change the hash
+    assert (image_hashing.compute_image_hash(path, thumbnail_dir=thumbnail_dir) ==
+            image_hashing.compute_image_hash(path))
+    stat = os.stat(path)
+    with Image.open(image_hashing.thumbnail_path(thumbnail_dir, path, stat.st_size, stat.st_mtime_ns)) as thumb:
+        written = thumb.size
+    with Image.open(path) as img:
+        img.draft('RGB', image_hashing.THUMBNAIL_SIZE)
+        img.thumbnail(image_hashing.THUMBNAIL_SIZE)
+        assert written == img.size